@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Content-hashed copies of the build outputs for long-lived caching.
+
+Each output is copied to a name that includes a hash of its contents, such as
+calibration_courses.3f9a0c2b7d41e6a8.geojson. A copy whose hash already exists
+is left alone. The copies never change, so they can be cached indefinitely,
+and the page finds them through a small manifest, the only file it needs to
+revalidate:
+
+    {"version": 1, "files": {"calibration_courses.geojson": {
+        "path": "calibration_courses.3f9a0c2b7d41e6a8.geojson", "sha256": "...", "bytes": 123}}}
+
+Paths are relative to the manifest. Copies listed by the current or the
+previous manifest are kept, so a page that loaded the previous manifest can
+still fetch its files when the site is rebuilt in place; older copies are
+deleted. A deploy that replaces the whole site, as GitHub Pages does, only has
+the current copies, so the page falls back to the unhashed file when a copy is
+gone.
+
+No precompressed copies are written: GitHub Pages compresses responses
+itself, and can't serve a .gz or .br file with a Content-Encoding.
+
+The copies are only written by prepare_data.py --hashed-artifacts, and only
+used by a page whose <courses-view> has a manifesturl. GitHub Pages sends the
+same short max-age for every file, so there the copies are cached no longer
+than the plain files, and the manifest is one more request before the data.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+
+from course_store import file_hash
+
+MANIFEST_VERSION = 1
+HASH_LENGTH = 16
+BLOCK_SIZE = 1 << 20
+# Precompressed siblings of the copies written by earlier builds, deleted along with their copies
+COMPRESSED_SUFFIXES = ('.gz', '.br')
+
+
+def hashed_name(path, sha256):
+    path = Path(path)
+    return f"{path.stem}.{sha256[:HASH_LENGTH]}{path.suffix}"
+
+
+def hashed_name_pattern(path):
+    """
+    Matches the hashed copies of path and any compressed siblings.
+    """
+    path = Path(path)
+    suffixes = '|'.join(re.escape(suffix) for suffix in COMPRESSED_SUFFIXES)
+    return re.compile(rf"{re.escape(path.stem)}\.[0-9a-f]{{{HASH_LENGTH}}}{re.escape(path.suffix)}(?:{suffixes})?")
+
+
+def _write_atomically(destination, write):
+    """
+    Call write with a file object for destination's .tmp file, then move it into
+    place, so a half-written file never has a final name.
+    """
+    temporary_file = f"{destination}.tmp"
+    try:
+        with open(temporary_file, 'wb') as f:
+            write(f)
+    except BaseException:
+        Path(temporary_file).unlink(missing_ok=True)
+        raise
+    os.replace(temporary_file, destination)
+
+
+def finalize_artifact(path):
+    """
+    Write the hashed copy of path, if it doesn't exist yet. Returns its manifest
+    entry and whether it was written.
+    """
+    path = Path(path)
+    sha256 = file_hash(path).hex()
+    hashed_file = path.with_name(hashed_name(path, sha256))
+    written = False
+    if not hashed_file.exists():
+        def copy_source(f):
+            with open(path, 'rb') as source_file:
+                shutil.copyfileobj(source_file, f, BLOCK_SIZE)
+        _write_atomically(hashed_file, copy_source)
+        written = True
+    return {'path': hashed_file.name, 'sha256': sha256, 'bytes': hashed_file.stat().st_size}, written
+
+
+def load_manifest(manifest_file):
+    try:
+        with open(manifest_file, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if manifest.get('version') == MANIFEST_VERSION else {}
+
+
+def manifest_paths(manifest):
+    return {entry['path'] for entry in manifest.get('files', {}).values()}
+
+
+def finalize_artifacts(files, manifest_file):
+    """
+    Write hashed copies of files, which must be in the manifest's directory, and
+    a manifest listing them. Copies not listed by this or the previous manifest
+    are deleted. Returns the manifest, the number of files whose copies were
+    written, and the deleted files.
+    """
+    manifest_file = Path(manifest_file)
+    previous_manifest = load_manifest(manifest_file)
+
+    entries = {}
+    rewritten = 0
+    for path in map(Path, files):
+        entries[path.name], written = finalize_artifact(path)
+        rewritten += written
+    manifest = {'version': MANIFEST_VERSION, 'files': entries}
+
+    keep = manifest_paths(manifest) | manifest_paths(previous_manifest)
+    stale = []
+    for path in map(Path, files):
+        pattern = hashed_name_pattern(path)
+        for candidate in path.parent.iterdir():
+            if pattern.fullmatch(candidate.name) and candidate.name not in keep:
+                candidate.unlink()
+                stale.append(candidate)
+
+    _write_atomically(manifest_file, lambda f: f.write(json.dumps(manifest, indent=2).encode('utf-8')))
+    return manifest, rewritten, stale
+
+
+def check_manifest(manifest_file):
+    """
+    Check that every file in a manifest exists and matches its hash.
+    Returns a list of problems.
+    """
+    manifest_file = Path(manifest_file)
+    manifest = load_manifest(manifest_file)
+    if not manifest:
+        return [f"'{manifest_file}' is not a version {MANIFEST_VERSION} manifest"]
+
+    problems = []
+    for name, entry in manifest['files'].items():
+        hashed_file = manifest_file.parent / entry['path']
+        if not hashed_file.exists():
+            problems.append(f"{name}: '{hashed_file}' is missing")
+            continue
+        if file_hash(hashed_file).hex() != entry['sha256'] or entry['path'] != hashed_name(name, entry['sha256']):
+            problems.append(f"{name}: '{hashed_file}' doesn't match its hash")
+        original = manifest_file.parent / name
+        if original.exists() and file_hash(original).hex() != entry['sha256']:
+            problems.append(f"{name}: has changed since the manifest was written")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the build artifact manifest against the files it lists.")
+    parser.add_argument("manifest_file", nargs="?", default="data/manifest.json")
+    args = parser.parse_args()
+
+    problems = check_manifest(args.manifest_file)
+    for problem in problems:
+        print(problem)
+    if problems:
+        exit(1)
+    print(f"Every file in '{args.manifest_file}' matches its hash.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+"""
+Time each stage of the data pipeline on synthetic sheets of increasing size.
+
+Results are written as JSON, and can be compared against a baseline from an
+earlier run. Any stage that gets slower than the baseline by more than the
+threshold fails the run.
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import math
+import platform
+import random
+import re
+import shutil
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from artifacts import finalize_artifacts
+from course_records import CourseRecords
+from course_store import CourseStore, extract_url_from_anchor
+from geodesy import (Points, haversine_distance, haversine_from, haversine_pairs, neighbor_pairs,
+                     neighbor_pairs_involving)
+from lint_tsv import (COURSE_FIELDS, NAME_LINTER, ROW_FIELDS, LintState, check_row, check_rows, find_close_courses,
+                      find_similar_courses, lint_tsv, row_key, value_hash)
+from metrics import Metrics
+from names import normalize
+from nearest import NearestIndex, NearestIndexBuilder, brute_force, sample_queries
+from overlays import OverlayCache, load_overlays, measure_lines, overlay_files
+from prepare_data import (IncrementalMapBuilder, add_derived_properties, patch_features, read_features,
+                          sort_features, write_feature_collection)
+from search_index import SearchIndex, SearchIndexBuilder
+from summary import SummaryBuilder
+from synthetic_courses import synthetic_names, write_synthetic_additional_data, write_synthetic_tsv
+
+ROAD_TYPES = {
+    'avenue': 'Ave', 'boulevard': 'Blvd', 'circle': 'Cir', 'court': 'Ct', 'drive': 'Dr',
+    'expressway': 'Expy', 'freeway': 'Fwy', 'highway': 'Hwy', 'lane': 'Ln', 'parkway': 'Pkwy',
+    'place': 'Pl', 'road': 'Rd', 'square': 'Sq', 'street': 'St', 'terrace': 'Ter',
+    'turnpike': 'Tpke', 'way': 'Way'
+}
+
+# Overlays written alongside the additional data file, each patching a different sample of courses
+OVERLAY_COUNT = 3
+# Nearest-course queries timed, and how many of them are checked against a brute-force search
+NEAREST_QUERY_COUNT = 1000
+NEAREST_CHECKED_COUNT = 5
+# One row in this many is moved, renamed or relinked before the incremental lint
+LINT_CHANGE_INTERVAL = 100
+# Largest sheet the watch mode's rebuild is timed on, as it keeps every feature in memory
+WATCH_MAX_SIZE = 100000
+# Course names and the problems the name rules must find in them
+NAME_RULE_CASES = [
+    ("Calibration Course", {}),
+    ("Celebration Park Calibration", {}),
+    ("Calibrated Run 5K", {}),
+    ("Calibrating Run 5K", {}),
+    ("Calibrator Course", {}),
+    ("Calibrators Course", {}),
+    ("Calibraton Course", {'misspelling': 'calibraton'}),
+    ("Cakibration Course", {'misspelling': 'cakibration'}),
+    ("Main St 1- 000ft", {'typoed_measurement': '1- 000ft'}),
+    ("Main St 1000ft", {}),
+]
+# Points the batched distances and neighbor grid are checked on, and the radius of the pairs looked for
+GEODESY_CHECK_POINTS = 400
+GEODESY_CHECK_RADIUS = 2000
+# Stages faster than this are too noisy to compare against a baseline
+MIN_COMPARABLE_SECONDS = 0.1
+
+
+def legacy_normalize(name):
+    """
+    The original chain of regex helpers that built nameAbbreviated, kept as the
+    reference the compiled engine in names.py must match byte for byte.
+    """
+    text = re.sub(r'\s+-?\s*(?:calibration\s+courses?|calibration|cal\.?\s*courses?|cal\s+crses?)', '', name, flags=re.IGNORECASE)
+    text = text.replace(" yards", "yd")
+
+    text = re.sub(r'\b(?:one\s+|a\s+)?quarter[\s-]*(?=mil(?:e|er)s?|mi\b)', '1/4 ', text, flags=re.IGNORECASE)
+    text = re.sub(r'\b(?:one\s+|a\s+)?half[\s-]*(?=mil(?:e|er)s?|mi\b)', '1/2 ', text, flags=re.IGNORECASE)
+    number_pattern = r'(\d+(?:\.\d+)?|\d+\s*/\s*\d+)'
+    for unit_pattern, unit in ((r'[ \s-]?(meters?|mtr|m)\b', 'm'),
+                               (r'[ \s-]?(?:(?:feet|foot|ft\.?)\b|\')', 'ft'),
+                               (r'[ \s-]?(?:miles?|milers?|mi)\b', 'mi')):
+        text = re.sub(number_pattern + unit_pattern,
+                      lambda match: re.sub(r'\s+', '', match.group(1)) + unit, text, flags=re.IGNORECASE)
+
+    text = re.sub(r'\s*(?:\s*-\s*)?(?:\d+(?:\.\d+)?|\d+\s*/\s*\d+)(?:\s*(?:m|ft|mi|km)\b)', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'\s*(?:-\s*)?\(\s*\)', '', text)
+
+    pattern = r'\b(' + '|'.join(sorted(ROAD_TYPES.keys(), key=len, reverse=True)) + r')\b'
+    text = re.sub(pattern, lambda match: ROAD_TYPES[match.group(1).lower()], text, flags=re.IGNORECASE)
+    text = re.sub(r'\b([NSEW]|NE|NW|SE|SW)\.(?!\w)', r'\1', text)
+    text = re.sub(r'\b(Ave|Blvd|Cir|Ct|Dr|Expy|Fwy|Hwy|Ln|Pkwy|Pl|Rd|Sq|St|Ter|Trl|Tpke|Way)\.(?!\w)', r'\1', text)
+
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def check_names(names):
+    """
+    Check the compiled engine against the original chain. Returns the number of mismatches.
+    """
+    mismatches = 0
+    for name in names:
+        expected = legacy_normalize(name)
+        actual = normalize(name)
+        if actual != expected:
+            mismatches += 1
+            print(f"Mismatch for {name!r}: expected {expected!r}, got {actual!r}")
+    return mismatches
+
+
+def legacy_haversine(lat1, lon1, lat2, lon2):
+    """
+    The original one-pair-at-a-time distance, kept as the reference the batched
+    functions in geodesy.py must match bit for bit.
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
+    c = 2 * math.asin(math.sqrt(a))
+    return c * 6371000
+
+
+def geodesy_check_points(count, seed=0):
+    """
+    Seeded random points in clusters a few kilometers across, some straddling the
+    antimeridian and some around or exactly on the poles.
+    """
+    rng = random.Random(seed)
+    centers = [(0, 180), (52.5, -180), (90, 0), (-90, 0), (89.99, 120), (-89.995, -60)]
+    centers += [(rng.uniform(-80, 80), rng.uniform(-180, 180)) for _ in range(14)]
+    lats, lons = [], []
+    for index in range(count):
+        lat, lon = centers[index % len(centers)]
+        lats.append(max(-90.0, min(90.0, lat + rng.uniform(-0.02, 0.02))))
+        lons.append((lon + rng.uniform(-0.05, 0.05) + 180) % 360 - 180)
+    return lats, lons
+
+
+def check_name_rules(cases=NAME_RULE_CASES):
+    """
+    Check the problems the name rules find in known names. Returns the number of mismatches.
+    """
+    mismatches = 0
+    for name, expected in cases:
+        found = NAME_LINTER.check(name)
+        if found != expected:
+            mismatches += 1
+            print(f"Name rule mismatch for {name!r}: expected {expected!r}, got {found!r}")
+    return mismatches
+
+
+def check_geodesy(count=GEODESY_CHECK_POINTS, radius=GEODESY_CHECK_RADIUS):
+    """
+    Check the batched distances against the original scalar one, and the pairs
+    found by the neighbor grid against every pair within radius. Returns the
+    number of mismatches.
+    """
+    lats, lons = geodesy_check_points(count)
+    points = Points(lats, lons)
+    mismatches = 0
+
+    all_pairs = [(i, j) for i in range(count) for j in range(i + 1, count)]
+    distances = haversine_pairs(points, all_pairs)
+    for (i, j), distance in zip(all_pairs, distances):
+        expected = legacy_haversine(lats[i], lons[i], lats[j], lons[j])
+        if distance != expected or haversine_distance(lats[i], lons[i], lats[j], lons[j]) != expected:
+            mismatches += 1
+            print(f"Distance mismatch for ({lats[i]}, {lons[i]}) to ({lats[j]}, {lons[j]}): expected {expected!r}, "
+                  f"got {distance!r}")
+    for i in range(0, count, count // 10):
+        expected = [legacy_haversine(lats[i], lons[i], lat, lon) for lat, lon in zip(lats, lons)]
+        if list(haversine_from(points, lats[i], lons[i])) != expected:
+            mismatches += 1
+            print(f"Distances from ({lats[i]}, {lons[i]}) differ from the scalar ones")
+
+    def within(candidates):
+        return [pair for pair, distance in zip(candidates, haversine_pairs(points, candidates)) if distance <= radius]
+
+    groups = [None if index % 7 == 0 else index % 2 for index in range(count)]
+    changed = set(range(0, count, 13))
+    expected = within(all_pairs)
+    expected_grouped = [(i, j) for i, j in expected if groups[i] is not None and groups[i] == groups[j]]
+    for description, found, wanted in (
+            ("neighbor_pairs", within(neighbor_pairs(points, radius)), expected),
+            ("grouped neighbor_pairs", within(neighbor_pairs(points, radius, groups)), expected_grouped),
+            ("neighbor_pairs_involving", within(neighbor_pairs_involving(points, radius, changed)),
+             [(i, j) for i, j in expected if i in changed or j in changed])):
+        if found != wanted:
+            mismatches += 1
+            print(f"{description} found {len(found)} pairs within {radius}m, expected {len(wanted)}: "
+                  f"missing {sorted(set(wanted) - set(found))[:5]}, extra {sorted(set(found) - set(wanted))[:5]}")
+    return mismatches
+
+
+class StageTimer:
+    def __init__(self):
+        self.timings = {}
+
+    def __call__(self, stage, function, *args, **kwargs):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        self.timings[stage] = time.perf_counter() - start
+        return result
+
+
+def lint_courses(rows):
+    """
+    Split sheet rows into the course records the spatial lint checks work on.
+    """
+    kinds = dict(ROW_FIELDS)
+    courses = CourseRecords([(field, kinds[field]) for field in COURSE_FIELDS])
+    for row in rows:
+        if row.get('Latitude') and row.get('Longitude'):
+            courses.append({'id': row['CourseID'], 'name': row['Name'], 'lat': float(row['Latitude']),
+                            'lon': float(row['Longitude']), 'city': row['City'], 'state': row['State'],
+                            'dist': row['Dist'], 'units': row['Units']})
+    return courses
+
+
+def course_dicts(rows):
+    """
+    What the lint used to keep for each row, as dictionaries: the row's key,
+    hash and check_row result, and for a course with coordinates a copy of the
+    fields the spatial checks compare.
+    """
+    results = []
+    courses = []
+    occurrences = Counter()
+    for row, values in zip(rows, zip(*rows.columns.values())):
+        key = row_key(row.get('CourseID'), occurrences)
+        result = check_row(row)
+        results.append((key, value_hash(values).hex(), result))
+        if 'lat' in result:
+            courses.append({'key': key, **{field: result[field] for field in COURSE_FIELDS}})
+    return results, courses
+
+
+def course_records(rows):
+    """
+    What the lint keeps for each row now: its check_row result and hash as
+    columns, and the courses with coordinates selected from them.
+    """
+    records, hashes, _, _ = check_rows(rows, LintState(), Metrics(), hashed=True)
+    located = [index for index, lat in enumerate(records.columns['lat']) if lat == lat]
+    occurrences = Counter()
+    keys = [row_key(course_id, occurrences) for course_id in records.columns['id']]
+    courses = records.select(located, COURSE_FIELDS)
+    courses.add_field('key', 's', [keys[index] for index in located])
+    return records, hashes, courses
+
+
+def measure_memory(size, work_dir):
+    """
+    The bytes per row the lint keeps for a synthetic sheet of size rows, held as
+    dictionaries the way it used to be and as course records. Returns a
+    dictionary mapping representation to bytes per row.
+    """
+    tsv_file = work_dir / f"courses_{size}.tsv"
+    write_synthetic_tsv(tsv_file, size)
+    rows = CourseStore.from_tsv(tsv_file)
+    memory = {}
+    for name, build in (("course_dicts", course_dicts), ("course_records", course_records)):
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        with contextlib.redirect_stdout(io.StringIO()):
+            kept = build(rows)
+        memory[name] = (tracemalloc.get_traced_memory()[0] - start) / size
+        tracemalloc.stop()
+        del kept
+    return memory
+
+
+def duplicated_links(rows):
+    cert_links_to_courses = defaultdict(list)
+    for row in rows:
+        cert_link = extract_url_from_anchor(row['Certificate URL'])
+        if cert_link:
+            cert_links_to_courses[cert_link].append({'id': row['CourseID'], 'name': row['Name']})
+    return {link: courses for link, courses in cert_links_to_courses.items() if len(courses) > 1}
+
+
+def benchmark_size(size, work_dir, jobs=()):
+    """
+    Time every stage on a synthetic sheet with the given number of rows, and the
+    conversion again with each number of worker processes in jobs.
+    Returns a dictionary mapping stage name to seconds.
+    """
+    tsv_file = work_dir / f"courses_{size}.tsv"
+    additional_data_file = work_dir / f"additional_data_{size}.geojson"
+    overlay_dir = work_dir / f"overlays_{size}"
+    overlay_cache_file = work_dir / f"overlay_cache_{size}"
+    course_ids = write_synthetic_tsv(tsv_file, size)
+    write_synthetic_additional_data(additional_data_file, course_ids)
+    overlay_dir.mkdir(exist_ok=True)
+    for seed in range(1, OVERLAY_COUNT + 1):
+        write_synthetic_additional_data(overlay_dir / f"{seed:02d}.geojson", course_ids, seed=seed)
+    overlays = overlay_files(additional_data_file, overlay_dir)
+    overlay_cache_file.unlink(missing_ok=True)
+
+    def load_cached_overlays():
+        cache = OverlayCache(overlay_cache_file)
+        merged = load_overlays(overlays, cache)[0]
+        cache.save()
+        return merged
+
+    timer = StageTimer()
+
+    store_file = work_dir / f"courses_{size}.store"
+    rows = timer("parse", CourseStore.from_tsv, tsv_file)
+    timer("store_save", rows.save, store_file)
+    # The later stages read the mapped store, as lint_tsv.py does after prepare_data.py
+    rows = timer("store_open", CourseStore.open, store_file)
+    timer("normalize", lambda: [normalize(row['Name'].replace(' (EXPIRED)', '')) for row in rows])
+    features = timer("convert", lambda: list(read_features(rows)))
+    for job_count in jobs:
+        parallel_features = timer(f"convert_jobs_{job_count}", lambda: list(read_features(rows, jobs=job_count)))
+        if parallel_features != features:
+            print(f"Conversion with {job_count} jobs differs from the serial conversion at {size} rows")
+            exit(1)
+    features = timer("sort", lambda: list(sort_features(features)))
+    timer("overlay_load", load_cached_overlays)
+    additional_features = timer("overlay_load_cached", load_cached_overlays)
+    line_features = []
+    features = timer("patch", lambda: list(patch_features(features, additional_features, line_features)))
+    measurements = timer("measure_lines", measure_lines, line_features)
+    for feature, measurement in zip(line_features, measurements):
+        coordinates = feature['geometry'].get('coordinates')
+        # Each line's length must match the sum of its segments measured one at a time
+        expected = sum(haversine_distance(start[1], start[0], end[1], end[0])
+                       for start, end in zip(coordinates, coordinates[1:])) if measurement else None
+        if measurement and measurement['lineLengthMeters'] != round(expected, 2):
+            print(f"Line length of {feature['properties']['certificateId']} is {measurement['lineLengthMeters']}m, "
+                  f"expected {expected:.2f}m at {size} rows")
+            exit(1)
+    features = timer("derive", lambda: list(add_derived_properties(features, 2026, set(), set())))
+    search_index = SearchIndexBuilder()
+    timer("search_index", lambda: list(search_index.collect(features)))
+    timer("search_index_write", search_index.write, work_dir / f"search_{size}")
+    timer("search_queries", lambda: [SearchIndex(work_dir / f"search_{size}").search(query)
+                                     for query in ('oak', 'park st', 'ca', 'zzqxj')])
+    summary = SummaryBuilder()
+    timer("summary", lambda: list(summary.collect(features)) and summary.build(2026))
+    nearest_index = NearestIndexBuilder()
+    nearest_index_file = work_dir / f"nearest_{size}.index"
+    timer("nearest_index", lambda: list(nearest_index.collect(features)) and
+          nearest_index.write(nearest_index_file, b'\0' * 32))
+    index = NearestIndex.open(nearest_index_file)
+    queries = sample_queries(features, NEAREST_QUERY_COUNT)
+    results = timer("nearest_queries", lambda: [index.search(**query) for query in queries])
+    for query, found in list(zip(queries, results))[:NEAREST_CHECKED_COUNT]:
+        if [(distance, feature_index) for distance, feature_index, _ in found] != brute_force(features, **query):
+            print(f"Nearest-course query {query} differs from a brute-force search at {size} rows")
+            exit(1)
+    timer("serialize", write_feature_collection, features, work_dir / f"courses_{size}.geojson", compact=True,
+          precision=7)
+    timer("artifacts", finalize_artifacts, [work_dir / f"courses_{size}.geojson"], work_dir / f"manifest_{size}.json")
+
+    timer("lint_empty_links", lambda: [row['CourseID'] for row in rows
+                                       if not extract_url_from_anchor(row['Certificate URL'])])
+    timer("lint_duplicate_links", duplicated_links, rows)
+    timer("lint_name_rules", lambda: [NAME_LINTER.check(row['Name']) for row in rows])
+    timer("lint_approximate", lambda: [row for row in rows if row['Color'].upper() == 'PURPLE'])
+    courses = lint_courses(rows)
+    timer("lint_proximity", find_close_courses, courses, 10)
+    timer("lint_near_duplicates", find_similar_courses, courses)
+
+    # The whole lint, then again on a slightly changed sheet reusing the first run's results
+    lint_state_file = work_dir / f"lint_state_{size}"
+    lint_state_file.unlink(missing_ok=True)
+    changed_rows = [dict(row.items()) for row in rows]
+    for index in range(0, len(changed_rows), LINT_CHANGE_INTERVAL):
+        row = changed_rows[index]
+        change = (index // LINT_CHANGE_INTERVAL) % 3
+        if change == 0 and row['Latitude']:
+            row['Latitude'] = str(float(row['Latitude']) + 0.00005)
+        elif change == 1:
+            row['Name'] += ' Calibraion'
+        else:
+            row['Certificate URL'] = changed_rows[index - 1]['Certificate URL']
+    changed_tsv_file = work_dir / f"courses_{size}_changed.tsv"
+    with open(changed_tsv_file, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows.columns), delimiter='\t', lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(changed_rows)
+    changed_rows = CourseStore.from_tsv(changed_tsv_file)
+    reports = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for stage, lint_rows, state_file in (("lint_cold", rows, lint_state_file),
+                                             ("lint_incremental", changed_rows, lint_state_file),
+                                             ("lint_changed_cold", changed_rows, None)):
+            reports[stage] = work_dir / f"{stage}_{size}.txt"
+            timer(stage, lint_tsv, lint_rows, reports[stage], state_file=state_file)
+    # Apart from the time it was generated, the incremental report must match checking everything again
+    incremental, cold = (reports[stage].read_text(encoding='utf-8').split('\n', 2)[2]
+                         for stage in ("lint_incremental", "lint_changed_cold"))
+    if incremental != cold:
+        print(f"Incremental lint report differs from a full lint at {size} rows")
+        exit(1)
+
+    # The map data as --watch builds it, then again once the same rows have changed
+    if size <= WATCH_MAX_SIZE:
+        watched_tsv_file = work_dir / f"courses_{size}_watched.tsv"
+        shutil.copyfile(tsv_file, watched_tsv_file)
+
+        def build_watched(builder, overlays_changed):
+            builder.read_sheet(Metrics())
+            changed_ids = builder.read_overlays(Metrics()) if overlays_changed else set()
+            return builder.build(2026, changed_ids)
+
+        output_options = {'compact': True, 'precision': 7}
+        builder = IncrementalMapBuilder(watched_tsv_file, additional_data_file, overlay_dir, overlay_cache_file,
+                                        output_options)
+        with contextlib.redirect_stdout(io.StringIO()):
+            timer("watch_build", build_watched, builder, True)
+            shutil.copyfile(changed_tsv_file, watched_tsv_file)
+            rebuilt = timer("watch_rebuild", build_watched, builder, False)
+            fresh = build_watched(IncrementalMapBuilder(watched_tsv_file, additional_data_file, overlay_dir,
+                                                        overlay_cache_file, output_options), True)
+        # Only the changed rows are converted again, but the features must match building from scratch
+        if rebuilt[1] != fresh[1] or rebuilt[2] != fresh[2]:
+            print(f"Rebuilt map data differs from a fresh build at {size} rows")
+            exit(1)
+
+    return timer.timings
+
+
+def compare_to_baseline(results, baseline, threshold):
+    """
+    Return a description of each stage that is more than threshold times slower
+    than in the baseline.
+    """
+    regressions = []
+    for size, timings in results.items():
+        for stage, seconds in timings.items():
+            baseline_seconds = baseline.get(size, {}).get(stage)
+            if baseline_seconds is None or max(seconds, baseline_seconds) < MIN_COMPARABLE_SECONDS:
+                continue
+            if seconds > baseline_seconds * threshold:
+                regressions.append(f"{stage} at {size} rows: {seconds:.3f}s, baseline {baseline_seconds:.3f}s "
+                                   f"({seconds / baseline_seconds:.2f}x)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the data pipeline on synthetic courses.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 1000000])
+    parser.add_argument("--output", type=Path, default=Path("benchmark_results.json"),
+                        help="Where to write the timings")
+    parser.add_argument("--baseline", type=Path, help="Timings from an earlier run to compare against")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[],
+                        help="Also time the conversion with each of these numbers of worker processes")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Run each size this many times and keep the fastest time of each stage")
+    parser.add_argument("--threshold", type=float, default=1.5,
+                        help="Fail if a stage takes longer than this multiple of its baseline time")
+    parser.add_argument("--tsv", type=Path, default=Path("data/calibration_courses.tsv"),
+                        help="Sheet whose names are checked against the original normalization chain")
+    parser.add_argument("--memory", action="store_true",
+                        help="Measure the memory the lint keeps per row at each size instead of timing the stages")
+    args = parser.parse_args()
+
+    if args.memory:
+        memory = {}
+        with tempfile.TemporaryDirectory() as work_dir:
+            for size in args.sizes:
+                memory[str(size)] = measure_memory(size, Path(work_dir))
+                for name, bytes_per_row in memory[str(size)].items():
+                    print(f"{size}\t{name}\t{bytes_per_row:.0f} bytes/row")
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'python': platform.python_version(), 'memory': memory}, f, indent=2)
+        print(f"Memory use written to {args.output}")
+        return
+
+    names = synthetic_names(10000)
+    if args.tsv.exists():
+        with open(args.tsv, 'r', encoding='utf-8') as tsv_file:
+            names += [row['Name'].replace(' (EXPIRED)', '') for row in csv.DictReader(tsv_file, delimiter='\t')]
+    if check_names(names) or check_name_rules() or check_geodesy():
+        exit(1)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in args.sizes:
+            runs = [benchmark_size(size, Path(work_dir), args.jobs) for _ in range(args.repeat)]
+            results[str(size)] = {stage: min(run[stage] for run in runs) for stage in runs[0]}
+            for stage, seconds in results[str(size)].items():
+                print(f"{size}\t{stage}\t{seconds:.3f}s\t{seconds / size * 1e6:.2f}us/row")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'python': platform.python_version(), 'results': results}, f, indent=2)
+    print(f"Timings written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        regressions = compare_to_baseline(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            exit(1)
+        print(f"No stage regressed by more than {args.threshold}x against {args.baseline}.")
+
+
+if __name__ == "__main__":
+    main()
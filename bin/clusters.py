@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Precomputed point clusters for every map zoom level.
+
+Clusters are built the way MapLibre's own clustering (supercluster) builds
+them: points are projected to Web Mercator, and working down from the highest
+zoom, each point or cluster swallows every unclaimed neighbour within the
+cluster radius at that zoom. Neighbours are found through a grid with cells one
+radius wide, so each level takes linear time.
+
+Each zoom level is written to its own GeoJSON file of just that level's
+clusters; a course that isn't in one is shown on its own. As in supercluster,
+each cluster links to what it was merged from rather than listing its leaves:
+its properties are the point_count, the children, which are the cluster_ids of
+clusters in the next zoom level up, and the courses, which are the positions
+in calibration_courses.geojson of courses that were still on their own there.
+So each course is written out once, in the cluster it first joins.
+"""
+import argparse
+import json
+import math
+from collections import defaultdict
+from pathlib import Path
+
+# Match the course-points source in map_style.json
+CLUSTER_RADIUS = 40
+CLUSTER_MAX_ZOOM = 18
+TILE_EXTENT = 512
+
+
+def project(lon, lat):
+    """
+    Project to Web Mercator, scaled to the unit square.
+    """
+    sin = math.sin(lat * math.pi / 180)
+    y = 0.5 - 0.25 * math.log((1 + sin) / (1 - sin)) / math.pi if abs(sin) < 1 else (0 if sin > 0 else 1)
+    return lon / 360 + 0.5, min(max(y, 0), 1)
+
+
+def unproject(x, y):
+    lat = 360 * math.atan(math.exp((180 - y * 360) * math.pi / 180)) / math.pi - 90
+    return (x - 0.5) * 360, lat
+
+
+class ClusterBuilder:
+    """
+    Collects course points, then clusters them at every zoom level.
+    """
+
+    def __init__(self, radius=CLUSTER_RADIUS, max_zoom=CLUSTER_MAX_ZOOM, min_zoom=0):
+        self.radius = radius
+        self.max_zoom = max_zoom
+        self.min_zoom = min_zoom
+        self.points = []
+        self.count = 0
+
+    def add(self, feature):
+        coordinates = feature.get('geometry', {}).get('coordinates')
+        if coordinates:
+            x, y = project(coordinates[0], coordinates[1])
+            self.points.append((x, y, 1, self.count))
+        self.count += 1
+
+    def collect(self, features):
+        """
+        Add each feature of a stream as it passes through.
+        """
+        for feature in features:
+            self.add(feature)
+            yield feature
+
+    def _cluster(self, items, zoom):
+        """
+        Merge items, (x, y, point count, course position) tuples, at a zoom
+        level, into (x, y, point count, members) tuples, where the members are
+        the positions in items each was made from. An item with no neighbours is
+        carried over as the only member of itself.
+        """
+        radius = self.radius / (TILE_EXTENT * 2 ** zoom)
+
+        cells = defaultdict(list)
+        for index, (x, y, _, _) in enumerate(items):
+            cells[(math.floor(x / radius), math.floor(y / radius))].append(index)
+
+        clustered = [False] * len(items)
+        clusters = []
+        for index, (x, y, count, _) in enumerate(items):
+            if clustered[index]:
+                continue
+            clustered[index] = True
+
+            cell_x, cell_y = math.floor(x / radius), math.floor(y / radius)
+            weighted_x, weighted_y = x * count, y * count
+            total = count
+            members = [index]
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    for neighbor in cells.get((cell_x + dx, cell_y + dy), ()):
+                        if clustered[neighbor]:
+                            continue
+                        neighbor_x, neighbor_y, neighbor_count, _ = items[neighbor]
+                        if (neighbor_x - x) ** 2 + (neighbor_y - y) ** 2 > radius ** 2:
+                            continue
+                        clustered[neighbor] = True
+                        weighted_x += neighbor_x * neighbor_count
+                        weighted_y += neighbor_y * neighbor_count
+                        total += neighbor_count
+                        members.append(neighbor)
+
+            if total == count:
+                clusters.append((x, y, count, members))
+            else:
+                clusters.append((weighted_x / total, weighted_y / total, total, members))
+        return clusters
+
+    def build(self):
+        """
+        Return a dictionary mapping each zoom level to its clusters of more than
+        one course, as (longitude, latitude, point count, children, courses)
+        tuples, where a cluster's position in its level is its cluster_id.
+        """
+        levels = {}
+        items = self.points
+        for zoom in range(self.max_zoom, self.min_zoom - 1, -1):
+            # The cluster_id of each cluster in the level above, by its position there
+            cluster_ids = {}
+            for position, (_, _, count, _) in enumerate(items):
+                if count > 1:
+                    cluster_ids[position] = len(cluster_ids)
+
+            finer, items, clusters = items, [], []
+            for x, y, count, members in self._cluster(finer, zoom):
+                if count == 1:
+                    # A single course keeps its position in the GeoJSON
+                    items.append((x, y, 1, finer[members[0]][3]))
+                    continue
+                items.append((x, y, count, None))
+                clusters.append((*unproject(x, y), count,
+                                 [cluster_ids[member] for member in members if member in cluster_ids],
+                                 [finer[member][3] for member in members if member not in cluster_ids]))
+            levels[zoom] = clusters
+        return levels
+
+
+def cluster_level_to_geojson(clusters):
+    features = []
+    for cluster_id, (lon, lat, count, children, courses) in enumerate(clusters):
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [round(lon, 7), round(lat, 7)]},
+            "properties": {"cluster": True, "cluster_id": cluster_id, "point_count": count,
+                           "children": children, "courses": courses}
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def write_cluster_levels(levels, output_dir):
+    output_dir = Path(output_dir)
+    output_dir.mkdir(exist_ok=True)
+    for zoom, clusters in levels.items():
+        level_file = output_dir / f"{zoom}.json"
+        with open(f"{level_file}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(cluster_level_to_geojson(clusters), f, separators=(',', ':'))
+        Path(f"{level_file}.tmp").replace(level_file)
+
+
+def check_cluster_levels(output_dir, geojson_file):
+    """
+    Check that each zoom level's clusters hold every course at most once, with
+    as many courses under each cluster as its point_count, and that every
+    cluster of the level above is a child of exactly one of them.
+    Returns a list of problem descriptions.
+    """
+    with open(geojson_file, 'r', encoding='utf-8') as f:
+        located = [bool(feature.get('geometry', {}).get('coordinates')) for feature in json.load(f)['features']]
+
+    problems = []
+    level_files = sorted(Path(output_dir).glob('*.json'), key=lambda path: int(path.stem), reverse=True)
+    if not level_files:
+        problems.append(f"No cluster levels found in '{output_dir}'")
+    # The courses under each cluster of the level above
+    finer = []
+    for level_file in level_files:
+        with open(level_file, 'r', encoding='utf-8') as f:
+            features = json.load(f)['features']
+        children = sorted(child for feature in features for child in feature['properties']['children'])
+        if children != list(range(len(finer))):
+            problems.append(f"Zoom {level_file.stem}: children don't account for each cluster of the level above once")
+            break
+
+        level = []
+        for feature in features:
+            properties = feature['properties']
+            courses = list(properties['courses'])
+            for child in properties['children']:
+                courses.extend(finer[child])
+            if len(courses) != properties['point_count']:
+                problems.append(f"Zoom {level_file.stem}: cluster {properties['cluster_id']} has {len(courses)} "
+                                f"courses, expected {properties['point_count']}")
+            level.append(courses)
+        courses = [course for cluster in level for course in cluster]
+        if len(set(courses)) != len(courses):
+            problems.append(f"Zoom {level_file.stem}: a course is in more than one cluster")
+        elif not all(0 <= course < len(located) and located[course] for course in courses):
+            problems.append(f"Zoom {level_file.stem}: a cluster has a course that isn't a located course")
+        finer = level
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check precomputed cluster levels against the course GeoJSON.")
+    parser.add_argument("cluster_dir", nargs="?", default="data/clusters")
+    parser.add_argument("geojson_file", nargs="?", default="data/calibration_courses.geojson")
+    args = parser.parse_args()
+
+    problems = check_cluster_levels(args.cluster_dir, args.geojson_file)
+    for problem in problems:
+        print(problem)
+    if problems:
+        exit(1)
+    print(f"Cluster levels in '{args.cluster_dir}' account for every course in '{args.geojson_file}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Compact columnar binary export of the course points.
+
+The file is little-endian and every section starts on a 4-byte boundary, so a
+client can map each column straight onto a typed array.
+
+    header      magic "CCRS", uint16 version, uint16 column count,
+                uint32 feature count, uint32 string count, uint32 coordinate scale
+    strings     (string count + 1) uint32 offsets into the UTF-8 blob that follows.
+                String i is blob[offsets[i]:offsets[i + 1]]. Every distinct string
+                appears once.
+    columns     for each column:
+                  uint8 name length, ASCII name, uint8 type, uint8 code width
+                  dictionary columns only: uint32 entry count, entries as string refs
+                  feature count values, of code width bytes for dictionary columns
+
+Column types and their missing value:
+
+    c  coordinate  int32 of degrees * coordinate scale   -2^31
+    s  string      uint32 string ref                      0xFFFFFFFF
+    d  dictionary  uint8/16/32 code into the entries      entry of 0xFFFFFFFF
+    f  float32                                            NaN
+    b  bool        uint8                                  255
+    y  year        uint16                                 0
+
+Properties without a column are not exported.
+"""
+import argparse
+import json
+import math
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b'CCRS'
+VERSION = 1
+COORDINATE_SCALE = 10_000_000
+
+MISSING_STRING = 0xFFFFFFFF
+MISSING_COORDINATE = -2 ** 31
+MISSING_BOOL = 255
+MISSING_YEAR = 0
+
+COLUMNS = [
+    ('longitude', 'c'),
+    ('latitude', 'c'),
+    ('certificateId', 's'),
+    ('name', 's'),
+    ('nameAbbreviated', 's'),
+    ('city', 's'),
+    ('state', 'd'),
+    ('courseLength', 'f'),
+    ('units', 'd'),
+    ('measurer', 'd'),
+    ('certificateLink', 's'),
+    ('approximate', 'b'),
+    ('year', 'y'),
+    ('expired', 'b'),
+    ('courseLengthMeters', 'f'),
+]
+
+ARRAY_TYPES = {'c': 'i', 's': 'I', 'f': 'f', 'b': 'B', 'y': 'H'}
+CODE_ARRAY_TYPES = {1: 'B', 2: 'H', 4: 'I'}
+
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _padding(length):
+    return b'\0' * (-length % 4)
+
+
+class ColumnWriter:
+    """
+    Accumulates features into columns, then writes them out in one go.
+    """
+
+    def __init__(self):
+        self.strings = {}
+        self.count = 0
+        self.columns = {name: array('I' if column_type == 'd' else ARRAY_TYPES[column_type])
+                        for name, column_type in COLUMNS}
+        # Dictionary columns map string refs to codes while collecting
+        self.dictionaries = {name: {} for name, column_type in COLUMNS if column_type == 'd'}
+
+    def _string_ref(self, value):
+        if value is None:
+            return MISSING_STRING
+        return self.strings.setdefault(value, len(self.strings))
+
+    def add(self, feature):
+        coordinates = feature.get('geometry', {}).get('coordinates') or [None, None]
+        properties = feature.get('properties', {})
+        values = {'longitude': coordinates[0], 'latitude': coordinates[1], **properties}
+
+        for name, column_type in COLUMNS:
+            value = values.get(name)
+            if column_type == 'c':
+                value = MISSING_COORDINATE if value is None else round(value * COORDINATE_SCALE)
+            elif column_type == 's':
+                value = self._string_ref(value)
+            elif column_type == 'd':
+                dictionary = self.dictionaries[name]
+                value = dictionary.setdefault(self._string_ref(value), len(dictionary))
+            elif column_type == 'f':
+                value = math.nan if value is None else value
+            elif column_type == 'b':
+                value = MISSING_BOOL if value is None else int(value)
+            elif column_type == 'y':
+                value = value or MISSING_YEAR
+            self.columns[name].append(value)
+        self.count += 1
+
+    def collect(self, features):
+        """
+        Add each feature of a stream as it passes through.
+        """
+        for feature in features:
+            self.add(feature)
+            yield feature
+
+    def write(self, output_file):
+        with open(f"{output_file}.tmp", 'wb') as f:
+            f.write(MAGIC + struct.pack('<HHIII', VERSION, len(COLUMNS), self.count, len(self.strings), COORDINATE_SCALE))
+
+            offsets = array('I', [0])
+            blob = bytearray()
+            for string in self.strings:
+                blob += string.encode('utf-8')
+                offsets.append(len(blob))
+            f.write(_little_endian(offsets) + blob + _padding(len(blob)))
+
+            for name, column_type in COLUMNS:
+                values = self.columns[name]
+                code_width = 0
+                header = bytes([len(name)]) + name.encode('ascii')
+                if column_type == 'd':
+                    entries = array('I', self.dictionaries[name])
+                    code_width = 1 if len(entries) <= 0xFF else 2 if len(entries) <= 0xFFFF else 4
+                    values = array(CODE_ARRAY_TYPES[code_width], values)
+                header += bytes([ord(column_type), code_width])
+                f.write(header + _padding(len(header)))
+                if column_type == 'd':
+                    f.write(struct.pack('<I', len(entries)) + _little_endian(entries))
+                data = _little_endian(values)
+                f.write(data + _padding(len(data)))
+        os.replace(f"{output_file}.tmp", output_file)
+
+
+def _read_array(data, offset, typecode, count):
+    values = array(typecode)
+    end = offset + values.itemsize * count
+    values.frombytes(data[offset:end])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values, end + (-end % 4)
+
+
+def read_columns(input_file):
+    """
+    Read a columnar export back into a dictionary of decoded columns, with None
+    for missing values.
+    """
+    with open(input_file, 'rb') as f:
+        data = f.read()
+
+    if data[:4] != MAGIC:
+        raise ValueError(f"'{input_file}' is not a course columns file")
+    version, column_count, count, string_count, coordinate_scale = struct.unpack_from('<HHIII', data, 4)
+    if version != VERSION:
+        raise ValueError(f"Unsupported course columns version {version}")
+
+    offsets, offset = _read_array(data, 20, 'I', string_count + 1)
+    blob_start = offset
+    strings = [data[blob_start + start:blob_start + end].decode('utf-8') for start, end in zip(offsets, offsets[1:])]
+    offset = blob_start + offsets[-1]
+    offset += -offset % 4
+
+    def string(ref):
+        return None if ref == MISSING_STRING else strings[ref]
+
+    columns = {}
+    for _ in range(column_count):
+        name_length = data[offset]
+        name = data[offset + 1:offset + 1 + name_length].decode('ascii')
+        column_type = chr(data[offset + 1 + name_length])
+        code_width = data[offset + 2 + name_length]
+        offset += 3 + name_length
+        offset += -offset % 4
+
+        if column_type == 'd':
+            entry_count, = struct.unpack_from('<I', data, offset)
+            entries, offset = _read_array(data, offset + 4, 'I', entry_count)
+            codes, offset = _read_array(data, offset, CODE_ARRAY_TYPES[code_width], count)
+            columns[name] = [string(entries[code]) for code in codes]
+            continue
+
+        values, offset = _read_array(data, offset, ARRAY_TYPES[column_type], count)
+        if column_type == 'c':
+            columns[name] = [None if value == MISSING_COORDINATE else value / coordinate_scale for value in values]
+        elif column_type == 's':
+            columns[name] = [string(value) for value in values]
+        elif column_type == 'f':
+            columns[name] = [None if math.isnan(value) else value for value in values]
+        elif column_type == 'b':
+            columns[name] = [None if value == MISSING_BOOL else bool(value) for value in values]
+        elif column_type == 'y':
+            columns[name] = [None if value == MISSING_YEAR else value for value in values]
+
+    return count, columns
+
+
+def check_round_trip(binary_file, geojson_file):
+    """
+    Compare a columnar export with the GeoJSON it was built alongside. Coordinates
+    and float32 lengths are compared within their quantization error.
+    Returns a list of mismatch descriptions.
+    """
+    count, columns = read_columns(binary_file)
+    with open(geojson_file, 'r', encoding='utf-8') as f:
+        features = json.load(f)['features']
+
+    if count != len(features):
+        return [f"Feature count differs: {count} in '{binary_file}', {len(features)} in '{geojson_file}'"]
+
+    mismatches = []
+    for index, feature in enumerate(features):
+        coordinates = feature.get('geometry', {}).get('coordinates') or [None, None]
+        expected = {'longitude': coordinates[0], 'latitude': coordinates[1], **feature.get('properties', {})}
+        for name, column_type in COLUMNS:
+            value = columns[name][index]
+            expected_value = expected.get(name)
+            if value is None or expected_value is None or column_type not in 'cf':
+                matches = value == expected_value
+            elif column_type == 'c':
+                matches = math.isclose(value, expected_value, abs_tol=1.5 / COORDINATE_SCALE)
+            else:
+                matches = math.isclose(value, expected_value, rel_tol=2 ** -23)
+            if not matches:
+                mismatches.append(f"Feature {index} ({expected.get('certificateId')}): "
+                                  f"{name} is {value!r}, expected {expected_value!r}")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check a course columns export against its GeoJSON.")
+    parser.add_argument("binary_file", nargs="?", default="data/calibration_courses.bin")
+    parser.add_argument("geojson_file", nargs="?", default="data/calibration_courses.geojson")
+    args = parser.parse_args()
+
+    mismatches = check_round_trip(args.binary_file, args.geojson_file)
+    for mismatch in mismatches:
+        print(mismatch)
+    if mismatches:
+        exit(1)
+    print(f"'{args.binary_file}' matches '{args.geojson_file}'.")
+
+
+if __name__ == "__main__":
+    main()
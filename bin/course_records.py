@@ -0,0 +1,166 @@
+"""
+Compact per-course records shared by lint_tsv.py and prepare_data.py.
+
+A million courses held as dictionaries cost a dictionary, a float object per
+coordinate and a string object per field each, and copy the same few city,
+state, units and measurer strings over and over. CourseRecords keeps each field
+in a column instead, like CourseStore keeps the sheet: numbers in float arrays,
+flags in a byte array, and everything else in lists, with the values of fields
+that repeat interned so every course that shares one holds the same string.
+Courses are referred to by index; a CourseRecord is a view of one, readable like
+the dictionary it replaces.
+
+Each field is stored as one of these kinds:
+
+    d   float64 array, NaN where a course has no value
+    b   flag, as a byte array of 0 and 1
+    i   interned string
+    s   any other value
+"""
+import math
+import sys
+from array import array
+
+# Sheet values shared by many courses, interned wherever they're kept
+INTERNED_FIELDS = ('city', 'state', 'units', 'measurer')
+
+
+def intern_value(value):
+    """
+    The interned copy of a string, so equal strings are stored once. Anything
+    else is returned as it is.
+    """
+    return sys.intern(value) if type(value) is str else value
+
+
+def _empty_column(kind):
+    if kind == 'd':
+        return array('d')
+    if kind == 'b':
+        return bytearray()
+    return []
+
+
+def _stored(kind, value):
+    if kind == 'd':
+        return math.nan if value is None else value
+    if kind == 'b':
+        return 1 if value else 0
+    if kind == 'i':
+        return intern_value(value)
+    return value
+
+
+class CourseRecord:
+    """
+    A view of one course of a CourseRecords, usable like a dictionary of its fields.
+    """
+    __slots__ = ('records', 'index')
+
+    def __init__(self, records, index):
+        self.records = records
+        self.index = index
+
+    def __getitem__(self, field):
+        return self.records.columns[field][self.index]
+
+    def __contains__(self, field):
+        return field in self.records.columns
+
+    def get(self, field, default=None):
+        if field not in self.records.columns:
+            return default
+        return self.records.columns[field][self.index]
+
+    def keys(self):
+        return self.records.columns.keys()
+
+
+class CourseRecords:
+    """
+    Courses stored field by field. fields is a list of (field, kind) pairs.
+    """
+
+    def __init__(self, fields, columns=None):
+        self.fields = list(fields)
+        # Field name to column, in field order
+        self.columns = columns or {field: _empty_column(kind) for field, kind in self.fields}
+        self._layout = [(field, kind, self.columns[field]) for field, kind in self.fields]
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), ()))
+
+    def __getitem__(self, index):
+        return CourseRecord(self, index)
+
+    def __iter__(self):
+        return (CourseRecord(self, index) for index in range(len(self)))
+
+    def append(self, values):
+        """
+        Add a course from a mapping of its fields, missing fields stored as None,
+        NaN or 0 by kind. Returns the course's index.
+        """
+        get = values.get
+        # _stored inlined, as this runs for every field of every row
+        for field, kind, column in self._layout:
+            value = get(field)
+            if kind == 's':
+                column.append(value)
+            elif kind == 'i':
+                column.append(sys.intern(value) if type(value) is str else value)
+            elif kind == 'd':
+                column.append(math.nan if value is None else value)
+            else:
+                column.append(1 if value else 0)
+        return len(self) - 1
+
+    def add_field(self, field, kind, values):
+        """
+        Add a field, with a value for each course.
+        """
+        self.fields.append((field, kind))
+        self.columns[field] = _empty_column(kind)
+        self.columns[field].extend(_stored(kind, value) for value in values)
+        self._layout.append((field, kind, self.columns[field]))
+
+    def copy(self, records, index):
+        """
+        Add the course at index of records, which has the same fields. Returns its
+        index here.
+        """
+        for field, column in self.columns.items():
+            column.append(records.columns[field][index])
+        return len(self) - 1
+
+    def select(self, indices, fields=None):
+        """
+        A CourseRecords of the courses at indices, in that order, with only the
+        given field names if fields is given. Values are shared, not copied.
+        """
+        kinds = dict(self.fields)
+        fields = [(field, kinds[field]) for field in fields] if fields else self.fields
+        columns = {}
+        for field, kind in fields:
+            column = self.columns[field]
+            values = [column[index] for index in indices]
+            columns[field] = _empty_column(kind)
+            columns[field].extend(values)
+        return CourseRecords(fields, columns)
+
+    def to_json(self):
+        """
+        The columns as a dictionary of field to list of values, for json.dumps.
+        """
+        return {field: list(column) for field, column in self.columns.items()}
+
+    @classmethod
+    def from_json(cls, fields, columns):
+        """
+        Rebuild records from to_json's columns, which must have every field.
+        """
+        stored = {}
+        for field, kind in fields:
+            stored[field] = _empty_column(kind)
+            stored[field].extend(map(intern_value, columns[field]) if kind == 'i' else columns[field])
+        return cls(fields, stored)
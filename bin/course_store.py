@@ -0,0 +1,291 @@
+"""
+A parsed course sheet shared by prepare_data.py and lint_tsv.py.
+
+The sheet is parsed once into columns. Each text column is a single string
+holding every value back to back, plus an array of offsets into it, so a
+million rows cost a few hundred bytes each rather than a dictionary and a
+dozen string objects each. Rows are lightweight views with the same interface
+as the csv.DictReader rows the scripts used to get. Latitude, Longitude and
+Dist are also available as float arrays.
+
+The parsed table is saved next to the sheet along with a hash of the sheet's
+bytes, so the next script to load the same sheet memory-maps it instead of
+parsing again. The file is little-endian:
+
+    header      magic "CSTR", uint16 version, uint16 column count, uint32 row count,
+                32-byte SHA-256 of the sheet
+    names       for each column: uint16 length, UTF-8 name; padded to 8 bytes
+    text        for each column:
+                  uint32 missing count, uint32 row indices of the missing values
+                  (row count + 1) uint32 character offsets into the column text
+                  uint32 byte length, UTF-8 column text; padded to 8 bytes
+    numbers     Latitude, Longitude and Dist as row count float64s, NaN where the
+                value is blank or not a number
+"""
+import csv
+import hashlib
+import math
+import mmap
+import re
+import struct
+import sys
+from array import array
+from itertools import accumulate, islice
+from pathlib import Path
+
+MAGIC = b'CSTR'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI32s')
+NUMERIC_COLUMNS = ('Latitude', 'Longitude', 'Dist')
+# Rows parsed before their fields are appended to the columns
+PARSE_BLOCK_SIZE = 10000
+
+ANCHOR_PATTERN = re.compile(r"<a\s+(?:[^>]*?\s+)?href=['\"]([^'\"]*)['\"]")
+
+
+def extract_url_from_anchor(html_string):
+    """Extract URL from HTML anchor tag."""
+    match = ANCHOR_PATTERN.search(html_string)
+    if match:
+        return match.group(1)
+    return None
+
+
+def _to_float(value):
+    try:
+        return float(value.replace(",", ""))
+    except (AttributeError, ValueError):
+        return math.nan
+
+
+def _write_aligned(f, data, alignment):
+    f.write(data)
+    f.write(b'\0' * (-f.tell() % alignment))
+
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+class TextColumn:
+    """
+    A read-only sequence of strings stored back to back in one string.
+    Values in missing are None, like the fields csv.DictReader fills in for a short row.
+    """
+    __slots__ = ('text', 'offsets', 'missing')
+
+    def __init__(self, text, offsets, missing=frozenset()):
+        self.text = text
+        self.offsets = offsets
+        self.missing = missing
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if self.missing and index in self.missing:
+            return None
+        return self.text[self.offsets[index]:self.offsets[index + 1]]
+
+    def __iter__(self):
+        text = self.text
+        values = (text[start:end] for start, end in zip(self.offsets, islice(self.offsets, 1, None)))
+        if not self.missing:
+            return values
+        return (None if index in self.missing else value for index, value in enumerate(values))
+
+
+class CourseRow:
+    """
+    A view of one row of a CourseStore, usable like a csv.DictReader row.
+    """
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __getitem__(self, column):
+        return self.store.columns[column][self.index]
+
+    def __contains__(self, column):
+        return column in self.store.columns
+
+    def get(self, column, default=None):
+        if column not in self.store.columns:
+            return default
+        return self.store.columns[column][self.index]
+
+    def keys(self):
+        return self.store.columns.keys()
+
+    def items(self):
+        return [(column, values[self.index]) for column, values in self.store.columns.items()]
+
+
+class CourseStore:
+    """
+    The rows of a course sheet, stored column by column.
+    """
+
+    def __init__(self, columns, row_count, numbers=None, source_hash=None, buffer=None):
+        # Column name to TextColumn, in sheet order
+        self.columns = columns
+        self.row_count = row_count
+        # Latitude, Longitude and Dist as float sequences, converted on first use
+        self.numbers = numbers or {}
+        self.source_hash = source_hash
+        # Keeps a memory-mapped file open for as long as the store is used
+        self._buffer = buffer
+
+    def __len__(self):
+        return self.row_count
+
+    def __iter__(self):
+        return (CourseRow(self, index) for index in range(self.row_count))
+
+    def row(self, index):
+        return CourseRow(self, index)
+
+    def number_column(self, name):
+        """
+        A numeric column as floats, NaN where the value is blank or not a number.
+        """
+        if name not in self.numbers:
+            values = self.columns.get(name, [None] * self.row_count)
+            self.numbers[name] = array('d', map(_to_float, values))
+        return self.numbers[name]
+
+    @property
+    def latitude(self):
+        return self.number_column('Latitude')
+
+    @property
+    def longitude(self):
+        return self.number_column('Longitude')
+
+    @property
+    def dist(self):
+        return self.number_column('Dist')
+
+    @classmethod
+    def from_tsv(cls, input_file):
+        """
+        Parse a sheet the way csv.DictReader would: the first row names the columns,
+        empty rows are skipped, and short rows are padded with None.
+        """
+        with open(input_file, 'r', encoding='utf-8') as tsv_file:
+            reader = csv.reader(tsv_file, delimiter='\t')
+            names = next(reader, [])
+            texts = [[] for _ in names]
+            offsets = [array('I', [0]) for _ in names]
+            missing = [set() for _ in names]
+            row_count = 0
+            while True:
+                rows = [fields for fields in islice(reader, PARSE_BLOCK_SIZE) if fields]
+                if not rows:
+                    break
+                for position, fields in enumerate(rows):
+                    if len(fields) < len(names):
+                        for column in range(len(fields), len(names)):
+                            missing[column].add(row_count + position)
+                        fields += [''] * (len(names) - len(fields))
+                # Append a block a column at a time, which keeps the work in C
+                for text, column_offsets, values in zip(texts, offsets, zip(*rows)):
+                    text.append(''.join(values))
+                    column_offsets.extend(islice(accumulate(map(len, values), initial=column_offsets[-1]), 1, None))
+                row_count += len(rows)
+
+        columns = {name: TextColumn(''.join(text), column_offsets, frozenset(column_missing))
+                   for name, text, column_offsets, column_missing in zip(names, texts, offsets, missing)}
+        return cls(columns, row_count, source_hash=file_hash(input_file))
+
+    @classmethod
+    def load(cls, input_file, store_file=None):
+        """
+        Load a sheet, reusing the parsed table saved in store_file if it was saved from
+        the same bytes. Otherwise the sheet is parsed and, if store_file is given, saved there.
+        """
+        if store_file and Path(store_file).exists():
+            try:
+                store = cls.open(store_file)
+            except (OSError, ValueError):
+                store = None
+            if store and store.source_hash == file_hash(input_file):
+                return store
+
+        store = cls.from_tsv(input_file)
+        if store_file:
+            store.save(store_file)
+        return store
+
+    def save(self, store_file):
+        temporary_file = f"{store_file}.tmp"
+        with open(temporary_file, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(self.columns), self.row_count, self.source_hash))
+            _write_aligned(f, b''.join(struct.pack('<H', len(name.encode('utf-8'))) + name.encode('utf-8')
+                                       for name in self.columns), 8)
+            for column in self.columns.values():
+                text = column.text.encode('utf-8')
+                f.write(struct.pack('<I', len(column.missing)) + _little_endian(array('I', sorted(column.missing))))
+                f.write(_little_endian(array('I', column.offsets)))
+                _write_aligned(f, struct.pack('<I', len(text)) + text, 8)
+            for name in NUMERIC_COLUMNS:
+                f.write(_little_endian(array('d', self.number_column(name))))
+        Path(temporary_file).replace(store_file)
+
+    @classmethod
+    def open(cls, store_file):
+        """
+        Memory-map a saved store. Offsets and numbers are read straight from the
+        mapped file; each column's text is decoded in one go.
+        """
+        if sys.byteorder != 'little':
+            raise ValueError("Saved course stores can only be mapped on little-endian machines")
+
+        with open(store_file, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(buffer)
+
+        magic, version, column_count, row_count, source_hash = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"'{store_file}' is not a version {VERSION} course store")
+        offset = HEADER.size
+
+        names = []
+        for _ in range(column_count):
+            length, = struct.unpack_from('<H', view, offset)
+            names.append(bytes(view[offset + 2:offset + 2 + length]).decode('utf-8'))
+            offset += 2 + length
+        offset += -offset % 8
+
+        columns = {}
+        for name in names:
+            missing_count, = struct.unpack_from('<I', view, offset)
+            missing = frozenset(view[offset + 4:offset + 4 + missing_count * 4].cast('I'))
+            offset += 4 + missing_count * 4
+            offsets = view[offset:offset + (row_count + 1) * 4].cast('I')
+            offset += (row_count + 1) * 4
+            text_length, = struct.unpack_from('<I', view, offset)
+            text = str(view[offset + 4:offset + 4 + text_length], 'utf-8')
+            offset += 4 + text_length
+            offset += -offset % 8
+            columns[name] = TextColumn(text, offsets, missing)
+
+        numbers = {}
+        for name in NUMERIC_COLUMNS:
+            numbers[name] = view[offset:offset + row_count * 8].cast('d')
+            offset += row_count * 8
+
+        return cls(columns, row_count, numbers, source_hash, buffer)
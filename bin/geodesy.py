@@ -0,0 +1,227 @@
+"""
+Batched great circle distance, bearing and midpoint calculations.
+
+Coordinates are converted to radians once, up front, along with the sine and
+cosine of each latitude, so computing many distances costs only the trigonometry
+that depends on both points of a pair. Every function evaluates the haversine formula in the same
+order, so a batched distance is bit-for-bit equal to the scalar one.
+"""
+import math
+from array import array
+from collections import defaultdict
+
+EARTH_RADIUS_METERS = 6371000
+
+
+class Points:
+    """
+    Latitudes and longitudes (decimal degrees) stored as radian columns.
+    """
+    __slots__ = ('lat', 'lon', 'sin_lat', 'cos_lat')
+
+    def __init__(self, lats, lons):
+        self.lat = array('d', map(math.radians, lats))
+        self.lon = array('d', map(math.radians, lons))
+        self.sin_lat = array('d', map(math.sin, self.lat))
+        self.cos_lat = array('d', map(math.cos, self.lat))
+
+    def __len__(self):
+        return len(self.lat)
+
+    def unit_vectors(self):
+        """
+        Return (x, y, z) columns of the points on the unit sphere.
+        """
+        xs = array('d', (c * math.cos(lon) for c, lon in zip(self.cos_lat, self.lon)))
+        ys = array('d', (c * math.sin(lon) for c, lon in zip(self.cos_lat, self.lon)))
+        return xs, ys, array('d', self.sin_lat)
+
+
+# Cells along each axis of the grid, as the radix of a cell's integer key. Any
+# radius of a meter or more gives fewer than half this many cells each side of 0.
+GRID_AXIS_CELLS = 1 << 25
+# Key offsets of the 13 neighboring cells that come after a cell in (x, y, z) order
+FORWARD_NEIGHBORS = [(dx * GRID_AXIS_CELLS + dy) * GRID_AXIS_CELLS + dz
+                     for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1) if (dx, dy, dz) > (0, 0, 0)]
+# Key offsets of a cell and all 26 of its neighbors
+ALL_NEIGHBORS = [(dx * GRID_AXIS_CELLS + dy) * GRID_AXIS_CELLS + dz
+                 for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)]
+
+
+def _bucket(vectors, cell_size, groups):
+    """
+    Bucket unit vectors into grid cells one cell_size wide, per group, as a
+    dictionary of group to a dictionary of cell key to ascending point indices.
+    """
+    floor, isfinite = math.floor, math.isfinite
+    grids = defaultdict(lambda: defaultdict(list))
+    for index, (x, y, z) in enumerate(zip(*vectors)):
+        group = groups[index] if groups is not None else None
+        if groups is not None and group is None:
+            continue
+        if not (isfinite(x) and isfinite(y) and isfinite(z)):
+            # NaN coordinates are never within radius of anything
+            continue
+        key = (floor(x / cell_size) * GRID_AXIS_CELLS + floor(y / cell_size)) * GRID_AXIS_CELLS + floor(z / cell_size)
+        grids[group][key].append(index)
+    return grids
+
+
+def neighbor_pairs(points, radius, groups=None):
+    """
+    Find candidate (i, j) index pairs, i < j, for points that may be within radius
+    meters of each other, ordered by i and then j. If groups is given, only points
+    with equal group keys are paired, and points whose key is None are left out.
+
+    Points are bucketed into a grid over unit-sphere (x, y, z) coordinates with
+    cells one radius wide. The straight-line chord between two points is never
+    longer than the great circle arc, so any pair within radius meters lies in the
+    same or an adjacent cell, including across the poles and the antimeridian.
+    Each occupied cell is paired with itself and the half of its neighbors that
+    come after it, so every pair of cells is looked at once.
+    """
+    # Guard against a zero-width cell; identical points still share a cell
+    cell_size = max(radius, 1) / EARTH_RADIUS_METERS
+    grids = _bucket(points.unit_vectors(), cell_size, groups)
+
+    pairs = []
+    for cells in grids.values():
+        get = cells.get
+        for key, members in cells.items():
+            # Members are in ascending order
+            for position, i in enumerate(members):
+                pairs.extend((i, j) for j in members[position + 1:])
+            for offset in FORWARD_NEIGHBORS:
+                neighbors = get(key + offset)
+                if neighbors:
+                    pairs.extend((i, j) if i < j else (j, i) for i in members for j in neighbors)
+    pairs.sort()
+    return pairs
+
+
+def neighbor_pairs_involving(points, radius, indices, groups=None):
+    """
+    Like neighbor_pairs, but only the candidate pairs that include one of indices.
+    Every point is still bucketed, but only the cells around those points are
+    looked in, so finding the pairs of a few changed points is cheap.
+    """
+    cell_size = max(radius, 1) / EARTH_RADIUS_METERS
+    vectors = points.unit_vectors()
+    grids = _bucket(vectors, cell_size, groups)
+    xs, ys, zs = vectors
+    floor, isfinite = math.floor, math.isfinite
+
+    pairs = set()
+    for i in indices:
+        group = groups[i] if groups is not None else None
+        x, y, z = xs[i], ys[i], zs[i]
+        if (groups is not None and group is None) or not (isfinite(x) and isfinite(y) and isfinite(z)):
+            continue
+        key = (floor(x / cell_size) * GRID_AXIS_CELLS + floor(y / cell_size)) * GRID_AXIS_CELLS + floor(z / cell_size)
+        get = grids[group].get
+        for offset in ALL_NEIGHBORS:
+            for j in get(key + offset, ()):
+                if j != i:
+                    pairs.add((i, j) if i < j else (j, i))
+    return sorted(pairs)
+
+
+def haversine_pairs(points, pairs):
+    """
+    Calculate the distance in meters for each (i, j) index pair into points.
+    """
+    lat, lon, cos_lat = points.lat, points.lon, points.cos_lat
+    sin, asin, sqrt = math.sin, math.asin, math.sqrt
+    distances = array('d')
+    for i, j in pairs:
+        dlon = lon[j] - lon[i]
+        dlat = lat[j] - lat[i]
+        a = sin(dlat / 2) ** 2 + cos_lat[i] * cos_lat[j] * sin(dlon / 2) ** 2
+        distances.append(2 * asin(sqrt(a)) * EARTH_RADIUS_METERS)
+    return distances
+
+
+def bearing_pairs(points, pairs):
+    """
+    Calculate the initial great circle bearing in degrees clockwise from north,
+    in [0, 360), from i to j for each (i, j) index pair into points.
+    """
+    lon, sin_lat, cos_lat = points.lon, points.sin_lat, points.cos_lat
+    sin, cos, atan2, degrees = math.sin, math.cos, math.atan2, math.degrees
+    bearings = array('d')
+    for i, j in pairs:
+        dlon = lon[j] - lon[i]
+        y = sin(dlon) * cos_lat[j]
+        x = cos_lat[i] * sin_lat[j] - sin_lat[i] * cos_lat[j] * cos(dlon)
+        bearings.append(degrees(atan2(y, x)) % 360)
+    return bearings
+
+
+def midpoint_pairs(points, pairs):
+    """
+    Calculate the point halfway along the great circle from i to j for each
+    (i, j) index pair into points. Returns latitude and longitude columns in
+    decimal degrees, with longitudes in [-180, 180).
+    """
+    lon, sin_lat, cos_lat = points.lon, points.sin_lat, points.cos_lat
+    sin, cos, atan2, sqrt, degrees = math.sin, math.cos, math.atan2, math.sqrt, math.degrees
+    lats = array('d')
+    lons = array('d')
+    for i, j in pairs:
+        dlon = lon[j] - lon[i]
+        bx = cos_lat[j] * cos(dlon)
+        by = cos_lat[j] * sin(dlon)
+        lats.append(degrees(atan2(sin_lat[i] + sin_lat[j], sqrt((cos_lat[i] + bx) ** 2 + by ** 2))))
+        lons.append((degrees(lon[i] + atan2(by, cos_lat[i] + bx)) + 180) % 360 - 180)
+    return lats, lons
+
+
+def line_lengths(lines):
+    """
+    Calculate the length in meters of each line, given as a sequence of
+    [longitude, latitude] positions as in GeoJSON, as the sum of the great circle
+    distances along its segments. Every segment of every line is measured in one batch.
+    """
+    positions = [position for line in lines for position in line]
+    points = Points([position[1] for position in positions], [position[0] for position in positions])
+
+    segments = []
+    # Index into segments just past each line's last segment
+    ends = []
+    start = 0
+    for line in lines:
+        segments.extend((index, index + 1) for index in range(start, start + len(line) - 1))
+        start += len(line)
+        ends.append(len(segments))
+
+    distances = haversine_pairs(points, segments)
+    return array('d', (sum(distances[begin:end]) for begin, end in zip([0] + ends, ends)))
+
+
+def haversine_from(points, lat, lon):
+    """
+    Calculate the distance in meters from a single point to every one of points.
+    """
+    origin = Points([lat], [lon])
+    lat1, lon1, cos_lat1 = origin.lat[0], origin.lon[0], origin.cos_lat[0]
+    sin, asin, sqrt = math.sin, math.asin, math.sqrt
+    return array('d', (
+        2 * asin(sqrt(sin((lat2 - lat1) / 2) ** 2 + cos_lat1 * cos_lat2 * sin((lon2 - lon1) / 2) ** 2)) * EARTH_RADIUS_METERS
+        for lat2, lon2, cos_lat2 in zip(points.lat, points.lon, points.cos_lat)
+    ))
+
+
+def haversine_pairwise(points):
+    """
+    Calculate the full matrix of distances between points, as a list of rows.
+    Only practical for small inputs; use haversine_pairs for candidate pairs.
+    """
+    return [haversine_pairs(points, ((i, j) for j in range(len(points)))) for i in range(len(points))]
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    """
+    Calculate the great circle distance between two points
+    on the earth (specified in decimal degrees)
+    """
+    return haversine_pairs(Points([lat1, lat2], [lon1, lon2]), [(0, 1)])[0]
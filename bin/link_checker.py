@@ -0,0 +1,578 @@
+#!/usr/bin/env python3
+"""
+Check that certificate links resolve, many at once, with the results cached on disk.
+
+Links are checked with HEAD requests, or GET where a server won't answer HEAD,
+following redirects. Requests go out from asyncio over a pool of keep-alive
+HTTP/1.1 connections, with at most a few open to any one host, a bound on the
+requests in flight overall, and a limit on how often each host gets a request.
+
+Each link's result is cached by URL with the time it was checked and the
+ETag and Last-Modified of the response. A link that worked is reused until
+its TTL runs out; each link's TTL is spread between half and all of the
+configured TTL by a hash of its URL, so links checked on the same run don't all
+go stale together. A stale link is checked again with If-None-Match and
+If-Modified-Since, so an unchanged certificate costs a 304. Broken links are
+checked again every run, so fixed links and passing outages clear. A run can be
+capped at a number of checks, taking the links never checked and then those
+checked longest ago first; the rest keep their cached result, if they have
+one, until a later run gets to them, so a cold cache warms up over several runs.
+
+Run on its own, this checks the link checker against a stub HTTP server on
+localhost that answers slowly, redirects, and 404s.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import ssl
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, urljoin, urlsplit
+
+from metrics import Metrics
+
+LINK_CACHE_VERSION = 1
+# Requests in flight at once, connections open to any one host, and requests per second to any one host
+DEFAULT_CONCURRENCY = 16
+DEFAULT_PER_HOST = 4
+DEFAULT_HOST_RATE = 10
+# How long a link that worked is trusted before it's checked again
+LINK_TTL_SECONDS = 30 * 24 * 60 * 60
+# Links checked by one run of the lint at most, which takes about this many tenths of a second on one host
+MAX_CHECKS_PER_RUN = 1000
+REQUEST_TIMEOUT_SECONDS = 20
+MAX_REDIRECTS = 5
+# Statuses from servers that won't answer HEAD, so the link is tried again with GET
+HEAD_REFUSED_STATUSES = {403, 405, 501}
+# Response bodies up to this size are read so the connection can be reused; larger ones close it
+MAX_DRAINED_BYTES = 64 * 1024
+USER_AGENT = "calibration-courses-link-checker/1"
+# Characters left as they are in a request's path and query, including any escapes already there
+URL_SAFE = "/%:@!$&'()*+,;=?~"
+
+
+def is_broken(result):
+    return bool(result.get('error')) or (result.get('status') or 0) >= 400
+
+
+def describe(result):
+    """
+    A short description of a link's result, like "HTTP 404 after 1 redirect".
+    """
+    if result.get('error'):
+        return f"Error: {result['error']}"
+    redirects = result.get('redirects', 0)
+    if redirects:
+        return f"HTTP {result['status']} after {redirects} redirect{'s' if redirects > 1 else ''}"
+    return f"HTTP {result['status']}"
+
+
+def link_ttl(url, ttl):
+    """
+    The TTL of url's cached result: between half and all of ttl, by a hash of the URL.
+    """
+    fraction = int.from_bytes(hashlib.sha256(url.encode('utf-8')).digest()[:4], 'big') / 2 ** 32
+    return ttl * (0.5 + fraction / 2)
+
+
+class LinkCache:
+    """
+    Link results from earlier runs, saved as a header line and then a line of
+    JSON per link. Only the links looked up this run are saved.
+    """
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        # URL to result
+        self.entries = {}
+        self.used = {}
+        if cache_file:
+            self.entries = self._read(cache_file)
+
+    @staticmethod
+    def _read(cache_file):
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline())
+                if header.get('version') != LINK_CACHE_VERSION:
+                    return {}
+                return {entry['url']: entry for entry in map(json.loads, f)}
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def get(self, url):
+        return self.entries.get(url)
+
+    def put(self, url, result):
+        self.used[url] = result
+
+    def save(self):
+        if not self.cache_file:
+            return
+        with open(f"{self.cache_file}.tmp", 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'version': LINK_CACHE_VERSION}) + '\n')
+            for result in self.used.values():
+                f.write(json.dumps(result, separators=(',', ':')) + '\n')
+        os.replace(f"{self.cache_file}.tmp", self.cache_file)
+
+
+class HostRateLimiter:
+    """
+    Spaces out the requests to each host so they start at most rate a second.
+    The clock and sleep default to the event loop's, and can be replaced to
+    check the schedule without waiting for it.
+    """
+
+    def __init__(self, rate, clock=None, sleep=asyncio.sleep):
+        self.interval = 1 / rate if rate else 0
+        self.clock = clock
+        self.sleep = sleep
+        # Host to the earliest time its next request can start
+        self.next_start = {}
+
+    async def wait(self, host):
+        """
+        Wait until the next request to host can start. Returns the time it was scheduled for.
+        """
+        now = self.clock() if self.clock else asyncio.get_running_loop().time()
+        start = max(now, self.next_start.get(host, now))
+        self.next_start[host] = start + self.interval
+        if start > now:
+            await self.sleep(start - now)
+        return start
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP/1.1 connections, kept per (scheme, host, port) for reuse, with
+    at most per_host of them in use for a host at once.
+    """
+
+    def __init__(self, per_host=DEFAULT_PER_HOST, timeout=REQUEST_TIMEOUT_SECONDS):
+        self.timeout = timeout
+        self.idle = defaultdict(list)
+        self.limits = defaultdict(lambda: asyncio.Semaphore(per_host))
+        self.ssl_context = None
+        self.opened = 0
+
+    async def _open(self, scheme, host, port):
+        ssl_context = None
+        if scheme == 'https':
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            ssl_context = self.ssl_context
+        self.opened += 1
+        return await asyncio.open_connection(host, port, ssl=ssl_context)
+
+    async def request(self, method, url, headers=None):
+        """
+        Send a request and read the response's status and headers. Returns the
+        status and a dictionary of lowercased header names to values.
+        """
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.scheme, parts.hostname, port)
+        # Links pasted into the sheet can have spaces and other characters that need escaping
+        target = quote(parts.path or '/', safe=URL_SAFE)
+        if parts.query:
+            target += f"?{quote(parts.query, safe=URL_SAFE)}"
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {parts.netloc.rpartition('@')[2]}",
+                 f"User-Agent: {USER_AGENT}", "Accept: */*"]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        request = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+        async with self.limits[key]:
+            while True:
+                reused = bool(self.idle[key])
+                reader, writer = self.idle[key].pop() if reused else await asyncio.wait_for(
+                    self._open(*key), self.timeout)
+                try:
+                    status, response_headers, keep_alive = await asyncio.wait_for(
+                        self._exchange(reader, writer, request, method), self.timeout)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    # The server may have closed a pooled connection while it sat idle
+                    if reused:
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                if keep_alive:
+                    self.idle[key].append((reader, writer))
+                else:
+                    writer.close()
+                return status, response_headers
+
+    @staticmethod
+    async def _exchange(reader, writer, request, method):
+        writer.write(request)
+        await writer.drain()
+
+        while True:
+            status_line = await reader.readline()
+            if not status_line:
+                raise ConnectionResetError("Connection closed before a response")
+            version, _, rest = status_line.decode('latin-1').strip().partition(' ')
+            status = int(rest.partition(' ')[0])
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise ConnectionResetError("Connection closed in the response headers")
+                if line in (b'\r\n', b'\n'):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            # Skip interim responses like 100 Continue
+            if not 100 <= status < 200:
+                break
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if method != 'HEAD' and status not in (204, 304):
+            length = headers.get('content-length')
+            if 'chunked' in headers.get('transfer-encoding', '').lower() or length is None \
+                    or not length.isdigit() or int(length) > MAX_DRAINED_BYTES:
+                keep_alive = False
+            elif keep_alive:
+                await reader.readexactly(int(length))
+        return status, headers, keep_alive
+
+    def close(self):
+        for connections in self.idle.values():
+            for _, writer in connections:
+                writer.close()
+        self.idle.clear()
+
+
+class LinkChecker:
+    """
+    Checks links concurrently, reusing the results cached in cache_file, and
+    checking at most max_checks of them if given.
+    """
+
+    def __init__(self, cache_file=None, concurrency=DEFAULT_CONCURRENCY, per_host=DEFAULT_PER_HOST,
+                 host_rate=DEFAULT_HOST_RATE, ttl=LINK_TTL_SECONDS, timeout=REQUEST_TIMEOUT_SECONDS, max_checks=None):
+        self.cache = LinkCache(cache_file)
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.host_rate = host_rate
+        self.ttl = ttl
+        self.timeout = timeout
+        self.max_checks = max_checks
+        self.connections_opened = 0
+
+    def check(self, urls, metrics=None):
+        """
+        Check each distinct URL, or reuse its cached result while it's fresh.
+        Returns a dictionary of URL to result, and saves the cache. Past
+        max_checks, a URL's stale cached result is returned as it is, and a URL
+        that was never checked is left out.
+        """
+        metrics = metrics or Metrics()
+        results = asyncio.run(self._check_all(list(dict.fromkeys(urls)), metrics))
+        self.cache.save()
+        return results
+
+    async def _check_all(self, urls, metrics):
+        pool = ConnectionPool(self.per_host, self.timeout)
+        limiter = HostRateLimiter(self.host_rate)
+        in_flight = asyncio.Semaphore(self.concurrency)
+        now = time.time()
+
+        results = {}
+        due = []
+        for url in urls:
+            cached = self.cache.get(url)
+            if cached and not is_broken(cached) and now - cached['checked'] < link_ttl(url, self.ttl):
+                metrics.count('links_reused_from_cache')
+                results[url] = cached
+                self.cache.put(url, cached)
+            else:
+                due.append((url, cached))
+        if self.max_checks is not None and len(due) > self.max_checks:
+            # Never checked first, then longest since checked
+            due.sort(key=lambda item: item[1]['checked'] if item[1] else float('-inf'))
+            for url, cached in due[self.max_checks:]:
+                metrics.count('links_deferred')
+                if cached:
+                    results[url] = cached
+                    self.cache.put(url, cached)
+            due = due[:self.max_checks]
+
+        async def check_one(url, cached):
+            async with in_flight:
+                result = await self._check_link(url, cached, pool, limiter, metrics)
+            self.cache.put(url, result)
+            return url, result
+
+        try:
+            results.update(await asyncio.gather(*(check_one(url, cached) for url, cached in due)))
+            # In the order the URLs were given
+            return {url: results[url] for url in urls if url in results}
+        finally:
+            pool.close()
+            self.connections_opened += pool.opened
+
+    async def _check_link(self, url, cached, pool, limiter, metrics):
+        """
+        Follow url's redirects with HEAD requests, or GET where HEAD is refused.
+        A cached result that worked is revalidated with its ETag and Last-Modified.
+        """
+        result = {'url': url, 'status': None, 'final_url': url, 'redirects': 0, 'etag': None,
+                  'last_modified': None, 'error': None, 'checked': time.time()}
+        validators = {}
+        if cached and not is_broken(cached):
+            if cached.get('etag'):
+                validators['If-None-Match'] = cached['etag']
+            if cached.get('last_modified'):
+                validators['If-Modified-Since'] = cached['last_modified']
+
+        current = url
+        method = 'HEAD'
+        try:
+            while True:
+                parts = urlsplit(current)
+                if parts.scheme not in ('http', 'https') or not parts.hostname:
+                    raise ValueError(f"Not an http(s) link: {current}")
+                await limiter.wait(parts.hostname)
+                status, headers = await pool.request(method, current, validators)
+                metrics.count('link_requests')
+                if method == 'HEAD' and status in HEAD_REFUSED_STATUSES:
+                    method = 'GET'
+                    continue
+                if status in (301, 302, 303, 307, 308) and headers.get('location'):
+                    if result['redirects'] >= MAX_REDIRECTS:
+                        raise ValueError(f"More than {MAX_REDIRECTS} redirects")
+                    result['redirects'] += 1
+                    current = urljoin(current, headers['location'])
+                    method = 'HEAD'
+                    continue
+                break
+        except asyncio.TimeoutError:
+            result['error'] = f"Timed out after {self.timeout:g}s"
+        except (OSError, ValueError, asyncio.IncompleteReadError) as e:
+            result['error'] = str(e) or type(e).__name__
+        else:
+            if status == 304 and validators:
+                metrics.count('links_revalidated')
+                return {**cached, 'checked': result['checked']}
+            result['status'] = status
+            result['etag'] = headers.get('etag')
+            result['last_modified'] = headers.get('last-modified')
+        result['final_url'] = current
+        metrics.count('links_broken' if is_broken(result) else 'links_checked')
+        return result
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers the stub server's paths: /ok.pdf (with an ETag), /slow.pdf (after
+    a delay), /redirect (to /ok.pdf), /redirect-loop, /missing.pdf (404) and
+    /no-head.pdf (405 to HEAD). Requests are tallied on the server.
+    """
+    protocol_version = 'HTTP/1.1'
+    etag = '"v1"'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def respond(self, body_wanted):
+        with self.server.lock:
+            self.server.requests[self.path] += 1
+        status, headers, body = 404, {}, b'Not found'
+        if self.path == '/ok.pdf':
+            if self.headers.get('If-None-Match') == self.etag:
+                status, body = 304, b''
+            else:
+                status, body = 200, b'%PDF-1.4'
+            headers['ETag'] = self.etag
+        elif self.path == '/slow.pdf':
+            time.sleep(self.server.delay)
+            status, body = 200, b'%PDF-1.4'
+        elif self.path == '/redirect':
+            status, headers, body = 301, {'Location': '/ok.pdf'}, b''
+        elif self.path == '/redirect-loop':
+            status, headers, body = 302, {'Location': '/redirect-loop'}, b''
+        elif self.path == '/no-head.pdf':
+            status, body = (405, b'') if not body_wanted else (200, b'%PDF-1.4')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body_wanted and status != 304:
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    def do_GET(self):
+        self.respond(True)
+
+
+def start_stub_server(delay):
+    """
+    Start the stub server on a free localhost port in a background thread.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.delay = delay
+    server.lock = threading.Lock()
+    server.connections = 0
+    server.requests = defaultdict(int)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FakeClock:
+    """
+    A clock for a HostRateLimiter that stands still, recording the sleeps it's
+    asked for instead of waiting.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.slept.append(delay)
+
+
+def check_rate_limiter(rate=20):
+    """
+    Check the times a HostRateLimiter schedules requests for, on a fake clock, so
+    the check doesn't depend on how busy the machine is. Returns a list of problems.
+    """
+    clock = FakeClock()
+    limiter = HostRateLimiter(rate, clock=clock, sleep=clock.sleep)
+
+    async def schedule():
+        return await asyncio.gather(*(limiter.wait(host) for host in ['a'] * 5 + ['b'] + ['a'] * 2))
+
+    starts = asyncio.run(schedule())
+    expected = [index / rate for index in range(7)]
+    problems = []
+    if any(abs(start - wanted) > 1e-9 for start, wanted in zip(starts[:5] + starts[6:], expected)):
+        problems.append(f"Requests to one host were scheduled for {starts[:5] + starts[6:]}, expected every 1/{rate}s")
+    if starts[5] != 0:
+        problems.append(f"The first request to a second host was scheduled for {starts[5]}, expected right away")
+    if len(clock.slept) != 6 or any(abs(delay - wanted) > 1e-9 for delay, wanted in zip(clock.slept, expected[1:])):
+        problems.append(f"The limiter slept for {clock.slept}, expected {expected[1:]}")
+    return problems
+
+
+def check_link_checker(work_dir):
+    """
+    Check links against the stub server end to end: what each kind of response
+    is reported as, that connections are reused, that cached results are reused
+    or revalidated with their ETag, and that a capped run defers the links past
+    the cap. Returns a list of problems.
+    """
+    timeout = 0.5
+    rate = 20
+    server = start_stub_server(delay=timeout * 4)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    cache_file = os.path.join(work_dir, 'link_cache')
+    expected = {
+        '/ok.pdf': (200, 0, False),
+        '/redirect': (200, 1, False),
+        '/missing.pdf': (404, 0, True),
+        '/no-head.pdf': (200, 0, False),
+        '/slow.pdf': (None, 0, True),
+        '/redirect-loop': (None, MAX_REDIRECTS, True),
+    }
+    urls = [base + path for path in expected] + ['ftp://example.com/certificate.pdf']
+    problems = []
+    try:
+        checker = LinkChecker(cache_file, host_rate=rate, timeout=timeout)
+        results = checker.check(urls)
+        for path, (status, redirects, broken) in expected.items():
+            result = results[base + path]
+            found = (result['status'], result['redirects'], is_broken(result))
+            if found != (status, redirects, broken):
+                problems.append(f"{path}: got status, redirects and broken {found}, expected "
+                                f"{(status, redirects, broken)} ({describe(result)})")
+        if not is_broken(results['ftp://example.com/certificate.pdf']):
+            problems.append("An ftp:// link wasn't reported as broken")
+
+        request_count = sum(server.requests.values())
+        if server.connections >= request_count:
+            problems.append(f"{request_count} requests took {server.connections} connections; none were reused")
+
+        # Fresh results are reused without a request, broken ones checked again
+        before = dict(server.requests)
+        metrics = Metrics()
+        LinkChecker(cache_file, host_rate=rate, timeout=timeout).check(urls, metrics)
+        again = {path for path, count in server.requests.items() if count > before.get(path, 0)}
+        if again & {'/ok.pdf', '/no-head.pdf'} or not {'/missing.pdf', '/slow.pdf'} <= again:
+            problems.append(f"Second run requested {sorted(again)}; expected only the broken links")
+        if metrics.counters['links_reused_from_cache'] != 3:
+            problems.append(f"Second run reused {metrics.counters['links_reused_from_cache']} cached results, "
+                            "expected 3")
+
+        # Stale results are revalidated with their ETag
+        metrics = Metrics()
+        results = LinkChecker(cache_file, host_rate=rate, timeout=timeout, ttl=0).check([base + '/ok.pdf'], metrics)
+        if metrics.counters['links_revalidated'] != 1 or results[base + '/ok.pdf']['status'] != 200:
+            problems.append("A stale link with an ETag wasn't revalidated with a 304")
+
+        # A capped run checks the links never checked first, and leaves the rest for the next
+        capped_cache_file = os.path.join(work_dir, 'capped_link_cache')
+        capped_urls = [base + path for path in ('/ok.pdf', '/no-head.pdf', '/redirect')]
+        metrics = Metrics()
+        results = LinkChecker(capped_cache_file, host_rate=rate, timeout=timeout, max_checks=2).check(capped_urls,
+                                                                                                        metrics)
+        if list(results) != capped_urls[:2] or metrics.counters['links_deferred'] != 1:
+            problems.append(f"A run capped at 2 checks returned {len(results)} results and deferred "
+                            f"{metrics.counters['links_deferred']}, expected 2 and 1")
+        results = LinkChecker(capped_cache_file, host_rate=rate, timeout=timeout, max_checks=2).check(capped_urls)
+        if list(results) != capped_urls or any(map(is_broken, results.values())):
+            problems.append("The next capped run didn't check the link the first one deferred")
+    finally:
+        server.shutdown()
+        server.server_close()
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check the link checker against a stub HTTP server, or check the given links.")
+    parser.add_argument("urls", nargs="*", help="Links to check instead of running against the stub server")
+    parser.add_argument("--cache", help="Cache file for the given links' results")
+    args = parser.parse_args()
+
+    if args.urls:
+        results = LinkChecker(args.cache).check(args.urls)
+        for url, result in results.items():
+            print(f"{url}\t{'BROKEN' if is_broken(result) else 'OK'}\t{describe(result)}")
+        if any(map(is_broken, results.values())):
+            exit(1)
+        return
+
+    problems = check_rate_limiter()
+    with tempfile.TemporaryDirectory() as work_dir:
+        problems += check_link_checker(work_dir)
+    for problem in problems:
+        print(problem)
+    if problems:
+        exit(1)
+    print("Link checker schedules requests and reports slow, redirecting, missing and HEAD-refusing links as expected.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Course name checks that run as one scan per name.
+
+Each NameRule declares its regular expressions and the words it fuzzy-matches
+once. NameLinter compiles every rule's patterns into a single regex with a
+named group per rule, plus one group that picks out candidate words for the
+fuzzy rules. Candidate words are compared with each rule's target words by a
+bounded edit distance instead of a loose regex, and the outcome is cached per
+word since the same words turn up in name after name.
+"""
+import re
+from functools import lru_cache
+
+
+@lru_cache(maxsize=65536)
+def edit_distance(word, target, limit):
+    """
+    The optimal string alignment distance between word and target (insertions,
+    deletions, substitutions and swaps of adjacent letters), or limit + 1 if it's
+    more than limit.
+    """
+    if abs(len(word) - len(target)) > limit:
+        return limit + 1
+
+    before_previous = None
+    previous = list(range(len(target) + 1))
+    for i, letter in enumerate(word, 1):
+        current = [i] + [0] * len(target)
+        for j, target_letter in enumerate(target, 1):
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (letter != target_letter))
+            if i > 1 and j > 1 and letter == target[j - 2] and word[i - 2] == target_letter:
+                distance = min(distance, before_previous[j - 2] + 1)
+            current[j] = distance
+        if min(current) > limit:
+            return limit + 1
+        before_previous, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+class NameRule:
+    """
+    A check on lowercased course names. A name is flagged by the first match of
+    any of the patterns, or failing that, by the first word within max_distance
+    edits of one of the words that isn't one of the accepted words.
+
+    Patterns are only tried at the start of a word, so they don't need a leading \\b.
+    """
+
+    def __init__(self, name, patterns=(), words=(), accepted=(), max_distance=2):
+        self.name = name
+        self.patterns = list(patterns)
+        self.words = list(words)
+        self.accepted = set(words) | set(accepted)
+        self.max_distance = max_distance
+
+    def is_near_miss(self, word):
+        if word in self.accepted:
+            return False
+        return any(edit_distance(word, target, self.max_distance) <= self.max_distance for target in self.words)
+
+
+class NameLinter:
+    """
+    Runs a set of NameRules over course names in one regex scan per name.
+    """
+    WORD_GROUP = '_word'
+
+    def __init__(self, rules):
+        self.rules = {rule.name: rule for rule in rules}
+        self.fuzzy_rules = [rule for rule in rules if rule.words]
+
+        alternatives = [f"(?P<{rule.name}>{'|'.join(rule.patterns)})" for rule in rules if rule.patterns]
+        if self.fuzzy_rules:
+            shortest = min(len(word) - rule.max_distance for rule in self.fuzzy_rules for word in rule.words)
+            longest = max(len(word) + rule.max_distance for rule in self.fuzzy_rules for word in rule.words)
+            # Last, so a word that a pattern matches is reported as that pattern's match
+            alternatives.append(f"(?P<{self.WORD_GROUP}>[a-z]{{{max(shortest, 1)},{longest}}}\\b)")
+        # Only trying the alternatives at word boundaries roughly halves the scan
+        self.pattern = re.compile(r'\b(?:' + '|'.join(alternatives) + ')')
+
+    def check(self, course_name):
+        """
+        Return a dictionary mapping the name of each rule the course name breaks
+        to the offending text.
+        """
+        matches = {}
+        near_misses = {}
+        for match in self.pattern.finditer(course_name.lower()):
+            group = match.lastgroup
+            if group != self.WORD_GROUP:
+                matches.setdefault(group, match.group())
+                continue
+            word = match.group()
+            for rule in self.fuzzy_rules:
+                if rule.name not in near_misses and rule.is_near_miss(word):
+                    near_misses[rule.name] = word
+        return {**near_misses, **matches}
@@ -1,77 +1,267 @@
 #!/usr/bin/env python3
-import csv
+import argparse
+import cProfile
+import hashlib
+import json
 import math
+import os
 import re
 from pathlib import Path
 from datetime import datetime, timezone
-from collections import defaultdict
+from collections import Counter, defaultdict
+
+import course_records
+import course_store
+import lint_rules
+from course_records import CourseRecords
+from course_store import CourseStore, extract_url_from_anchor
+from geodesy import Points, haversine_pairs, neighbor_pairs, neighbor_pairs_involving
+from link_checker import MAX_CHECKS_PER_RUN, LinkChecker, describe, is_broken
+from lint_rules import NameLinter, NameRule
+from metrics import Metrics
+from overlays import OverlayCache, load_overlays, measure_lines, overlay_files
+
+# How far apart two entries of the same course can be, and how alike their names
+DUPLICATE_RADIUS_METERS = 1000
+NAME_SIMILARITY_THRESHOLD = 0.6
+
+# What a pair of courses is compared on by the proximity and near-duplicate checks
+PROXIMITY_FIELDS = ('lat', 'lon')
+DUPLICATE_FIELDS = ('lat', 'lon', 'name', 'dist', 'units')
+
+# Each row's check_row result, and whether it got as far as the name and link
+ROW_FIELDS = [
+    ('id', 's'), ('name', 's'), ('link', 's'), ('misspelling', 's'), ('typoed_measurement', 's'),
+    ('city', 'i'), ('state', 'i'), ('dist', 'i'), ('units', 'i'), ('lat', 'd'), ('lon', 'd'),
+    ('purple', 'b'), ('has_name', 'b'), ('has_link', 'b'), ('error', 's')
+]
+# The fields of the courses with coordinates that the spatial checks compare
+COURSE_FIELDS = ('id', 'name', 'lat', 'lon', 'city', 'state', 'dist', 'units')
+# Bytes of each row's hash in the saved state
+ROW_HASH_SIZE = 16
+
+# How far a course line's measured length can be from the certified length
+LINE_LENGTH_TOLERANCE_PERCENT = 5
+UNIT_METERS = {'m': 1, 'km': 1000, 'ft': 0.3048, 'mi': 1609.344}
+
+NAME_WORD_PATTERN = re.compile(r'[a-z0-9]+')
+# Words (and units left after stripping digits) that don't tell one course from another
+GENERIC_NAME_WORDS = {
+    '', 'cal', 'calibration', 'calibrations', 'course', 'courses', 'crse', 'crses', 'expired', 'the',
+    'm', 'meter', 'meters', 'mtr', 'ft', 'feet', 'foot', 'mi', 'mile', 'miles', 'km', 'yd', 'yards'
+}
+
+
+def row_key(course_id, occurrences):
+    """
+    The key a row's results are saved under: its CourseID, numbered from the
+    second time the same CourseID appears. occurrences counts the CourseIDs so far.
+    """
+    if course_id is None:
+        return None
+    occurrences[course_id] += 1
+    if occurrences[course_id] > 1:
+        return f"{course_id}#{occurrences[course_id]}"
+    return course_id
 
 
-def extract_url_from_anchor(html_string):
-    """Extract URL from HTML anchor tag."""
-    import re
-    pattern = r"<a\s+(?:[^>]*?\s+)?href=['\"]([^'\"]*)['\"]"
-    match = re.search(pattern, html_string)
-    if match:
-        return match.group(1)
-    return None
+def changed_courses(courses, rechecked, state, fields):
+    """
+    The indices of the courses that are new since the last run, or whose fields
+    have changed. Only the courses at the rechecked indices, whose rows changed,
+    are compared with their rows in the LintState.
+    """
+    changed = []
+    for index in rechecked:
+        course = courses[index]
+        previous = state.index.get(course['key'])
+        if previous is None or math.isnan(state.rows.columns['lat'][previous]) or \
+                any(state.rows.columns[field][previous] != course[field] for field in fields):
+            changed.append(index)
+    return changed
 
 
-def haversine_distance(lat1, lon1, lat2, lon2):
+def incremental_pairs(courses, previous, pairs_involving):
     """
-    Calculate the great circle distance between two points
-    on the earth (specified in decimal degrees)
+    Candidate pairs for a check that compares courses on a few fields, reusing
+    the last run's result. previous holds the indices of the courses that are new
+    or whose fields have changed, and the keys of the pairs the check found last
+    run. Whether two courses pair up depends only on their fields, so the pairs
+    found last run between unchanged courses still stand, and no other pair of
+    them can. Only the candidates involving a changed course are looked for, with
+    pairs_involving(indices). Returns (i, j) index pairs, i < j, in order.
     """
-    # Convert decimal degrees to radians
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    changed, previous_pairs = previous
+    changed_set = set(changed)
+    index_of = {key: index for index, key in enumerate(courses.columns['key'])}
 
-    # Haversine formula
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = math.sin(dlat / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon / 2) ** 2
-    c = 2 * math.asin(math.sqrt(a))
-    r = 6371000  # Radius of earth in meters
-    return c * r
+    pairs = set(pairs_involving(changed))
+    for key1, key2 in previous_pairs:
+        i, j = index_of.get(key1), index_of.get(key2)
+        if i is not None and j is not None and i not in changed_set and j not in changed_set:
+            pairs.add((i, j) if i < j else (j, i))
+    return sorted(pairs)
 
 
-def detect_calibration_misspellings(course_name):
+def find_close_courses(courses, epsilon, previous=None):
     """
-    Detect common misspellings of 'Calibration' in course names.
-    Returns the misspelled word if found, None otherwise.
-    Explicitly ignores "celebration" as it's a valid word.
+    Find all pairs of courses (CourseRecords with COURSE_FIELDS) within epsilon
+    meters of each other.
+
+    Only pairs of courses in the same or adjacent cells of a grid one epsilon
+    wide get a haversine check; see geodesy.neighbor_pairs. If previous is given,
+    only pairs involving a new or moved course are looked for; see incremental_pairs.
+
+    Returns (index1, index2, distance) tuples in the same order as comparing
+    every course with every later course would.
     """
-    # Convert to lowercase for case-insensitive matching
-    name_lower = course_name.lower()
+    points = Points(courses.columns['lat'], courses.columns['lon'])
+    if previous is None:
+        candidate_pairs = neighbor_pairs(points, epsilon)
+    else:
+        candidate_pairs = incremental_pairs(courses, previous,
+                                            lambda changed: neighbor_pairs_involving(points, epsilon, changed))
 
-    # List of common misspellings
-    misspellings = [
-        "cakibration",
-        "calibraion",
-        "calibation",
-        "calibraton",
-        "calaibration"
-    ]
+    close_courses = []
+    for (i, j), distance in zip(candidate_pairs, haversine_pairs(points, candidate_pairs)):
+        if distance <= epsilon:
+            close_courses.append((i, j, distance))
 
-    # Create a regex pattern that will match these misspellings
-    misspelling_pattern = r'\b(' + '|'.join(misspellings) + r')\b'
+    return close_courses
 
-    # Find all misspellings in the course name
-    matches = re.findall(misspelling_pattern, name_lower)
 
-    if matches:
-        return matches[0]  # Return the first misspelling found
+def course_length_key(dist, units):
+    """
+    The course length as a comparable (number, unit) key, or None if it isn't a number.
+    """
+    try:
+        return float(dist.replace(",", "")), units.lower()
+    except (AttributeError, ValueError):
+        return None
+
 
-    # Also check for other potential misspellings not in our list
-    # This looks for words that are similar to "calibration" but not exactly
-    potential_pattern = r'\bc[a-z]*l[a-z]*b[a-z]*r[a-z]*t[a-z]*[io][a-z]*n\b'
-    potential_matches = re.findall(potential_pattern, name_lower)
+def certified_length_meters(dist, units):
+    """
+    The certified course length in meters, or None if it's missing or in unknown units.
+    """
+    length_key = course_length_key(dist, units)
+    if length_key is None or length_key[1] not in UNIT_METERS:
+        return None
+    return length_key[0] * UNIT_METERS[length_key[1]]
 
-    for match in potential_matches:
-        # Exclude the correct spelling and "celebration"
-        if match != "calibration" and match != "celebration":
-            return match
 
-    return None
+def find_mismeasured_lines(line_courses, course_lines, tolerance_percent):
+    """
+    Find course lines whose measured length is more than tolerance_percent off the
+    certified length of their course. line_courses maps certificateId to course.
+    Returns (course, line measurement, certified meters, percent off) tuples in
+    certificateId order.
+    """
+    mismeasured = []
+    for feature, measurement in zip(course_lines, measure_lines(course_lines)):
+        course = line_courses.get(feature.get('properties', {}).get('certificateId'))
+        if measurement is None or course is None:
+            continue
+        certified = certified_length_meters(course['dist'], course['units'])
+        if not certified:
+            continue
+        percent_off = (measurement['lineLengthMeters'] - certified) / certified * 100
+        if abs(percent_off) > tolerance_percent:
+            mismeasured.append((course, measurement, certified, percent_off))
+    mismeasured.sort(key=lambda line: line[0]['id'])
+    return mismeasured
+
+
+def name_trigrams(course_name):
+    """
+    The set of character trigrams of the words that identify a course, leaving out
+    numbers, units and words like 'calibration' that most names share. The words
+    are sorted first, so word order doesn't matter.
+    """
+    words = sorted(word for word in NAME_WORD_PATTERN.findall(course_name.lower())
+                   if word.strip('0123456789') not in GENERIC_NAME_WORDS)
+    text = f" {' '.join(words)} "
+    return frozenset(text[i:i + 3] for i in range(len(text) - 2))
+
+
+def find_similar_courses(courses, radius=DUPLICATE_RADIUS_METERS, threshold=NAME_SIMILARITY_THRESHOLD,
+                         previous=None):
+    """
+    Find pairs of courses (CourseRecords with COURSE_FIELDS) that are probably the
+    same course entered twice: the same length, within radius meters of each
+    other, and with names whose trigram sets have a Jaccard similarity of at
+    least threshold.
+
+    Candidates come from a spatial grid keyed by course length, so only nearby
+    courses of the same length are compared, and names are only broken into
+    trigrams for courses that have a candidate. If previous is given, only pairs
+    involving a new or changed course are looked for; see incremental_pairs.
+
+    Returns (index1, index2, similarity, distance) tuples in the same order as
+    comparing every course with every later course would.
+    """
+    points = Points(courses.columns['lat'], courses.columns['lon'])
+    lengths = list(map(course_length_key, courses.columns['dist'], courses.columns['units']))
+    names = courses.columns['name']
+
+    # Trigrams by name, as names are often shared
+    trigrams = {}
+    similar_pairs = []
+    similarities = []
+    if previous is None:
+        candidate_pairs = neighbor_pairs(points, radius, lengths)
+    else:
+        candidate_pairs = incremental_pairs(courses, previous,
+                                            lambda changed: neighbor_pairs_involving(points, radius, changed, lengths))
+    for i, j in candidate_pairs:
+        name1, name2 = names[i], names[j]
+        for name in (name1, name2):
+            if name not in trigrams:
+                trigrams[name] = name_trigrams(name)
+        union = len(trigrams[name1] | trigrams[name2])
+        similarity = len(trigrams[name1] & trigrams[name2]) / union if union else 0
+        if similarity >= threshold:
+            similar_pairs.append((i, j))
+            similarities.append(similarity)
+
+    similar_courses = []
+    for (i, j), similarity, distance in zip(similar_pairs, similarities, haversine_pairs(points, similar_pairs)):
+        if distance <= radius:
+            similar_courses.append((i, j, similarity, distance))
+
+    return similar_courses
+
+
+# Misspellings of 'Calibration' that have turned up in the sheet
+CALIBRATION_MISSPELLINGS = [
+    "cakibration",
+    "calibraion",
+    "calibation",
+    "calibraton",
+    "calaibration"
+]
+
+NAME_RULES = [
+    # Known misspellings first, then any other word within two edits of 'calibration'.
+    # "Celebration" is a valid word, and so are the plurals and other forms of "calibrate".
+    NameRule('misspelling', patterns=['(?:' + '|'.join(CALIBRATION_MISSPELLINGS) + r')\b'],
+             words=["calibration"], accepted=["calibrations", "celebration", "celebrations", "calibrated",
+                                              "calibrating", "calibrator", "calibrators"]),
+    # A number, a dash and whitespace before 'ft', like "1- 000ft" or "123- ft".
+    # "1000ft" and "123 ft" are fine.
+    NameRule('typoed_measurement', patterns=[r'\d+\s*-\s+\d*\s*ft\b']),
+]
+
+NAME_LINTER = NameLinter(NAME_RULES)
+
+
+def detect_calibration_misspellings(course_name):
+    """
+    Detect common misspellings of 'Calibration' in course names.
+    Returns the misspelled word if found, None otherwise.
+    Explicitly ignores "celebration" as it's a valid word.
+    """
+    return NAME_LINTER.check(course_name).get('misspelling')
 
 
 def detect_typoed_measurements(course_name):
@@ -79,176 +269,542 @@ def detect_typoed_measurements(course_name):
     Detect typoed measurements in course names.
     Specifically looks for numbers with a dash and whitespace followed by 'ft'.
     Returns the typoed measurement if found, None otherwise.
+    """
+    return NAME_LINTER.check(course_name).get('typoed_measurement')
 
-    Examples of typos:
-    - "1- 000ft" (has dash and whitespace)
-    - "123- ft" (has dash and whitespace)
 
-    Valid formats (not reported):
-    - "1000ft" (no space)
-    - "123 ft" (space but no dash)
+def check_row(row):
+    """
+    Run the per-row checks on a sheet row, returning what the report needs from
+    it: the course's id and name, its certificate link, any name problems,
+    whether it's at an approximate location, its city, state and length, and its
+    coordinates if it has them. A row that can't be checked has the message of
+    the error, and only what was found before it.
+    """
+    result = {}
+    try:
+        result['id'] = row['CourseID']
+        result['name'] = row['Name']
+        result['link'] = extract_url_from_anchor(row['Certificate URL'])
+
+        # Check the name against every name rule in one pass
+        name_problems = NAME_LINTER.check(result['name'])
+        for rule in ('misspelling', 'typoed_measurement'):
+            if name_problems.get(rule):
+                result[rule] = name_problems[rule]
+
+        # Check for purple color (approximate location)
+        if 'Color' in row and row['Color'].upper() == 'PURPLE':
+            result['purple'] = True
+        result['city'] = row.get('City', 'N/A')
+        result['state'] = row.get('State', 'N/A')
+        result['dist'] = row.get('Dist')
+        result['units'] = row.get('Units')
+
+        # Only courses with valid coordinates are compared with each other
+        if row.get('Latitude') and row.get('Longitude'):
+            lat = float(row['Latitude'])
+            lon = float(row['Longitude'])
+            # Compared courses are listed with their city and state
+            for column in ('City', 'State'):
+                if column not in row:
+                    raise KeyError(column)
+            result['lat'] = lat
+            result['lon'] = lon
+    except (ValueError, KeyError) as e:
+        result['error'] = f"Error processing course {row.get('CourseID', 'unknown')}: {e}"
+    return result
+
+
+def value_hash(values):
+    """
+    A hash of a row's values, for telling whether it has changed since the last run.
     """
-    # Case-insensitive matching for "ft" with possible whitespace
-    # Look for: number + dash + whitespace + digits + "ft"
-    typo_pattern = r'\b\d+\s*-\s+\d*\s*ft\b'
+    return hashlib.blake2b(repr(values).encode('utf-8'), digest_size=ROW_HASH_SIZE).digest()
 
-    # Find all typoed measurements in the course name, case insensitive
-    matches = re.findall(typo_pattern, course_name.lower())
 
-    if matches:
-        return matches[0]  # Return the first typoed measurement found
+def lint_state_version():
+    """
+    Hash the code the saved row results depend on, so any change to it means
+    every row is checked again.
+    """
+    digest = hashlib.sha256()
+    for module_file in (__file__, lint_rules.__file__, course_store.__file__, course_records.__file__):
+        digest.update(Path(module_file).read_bytes())
+    return digest.hexdigest()
 
-    return None
 
+class LintState:
+    """
+    The last run's row results and findings, saved as a line of JSON with the
+    findings, the sheet's columns and the pairs the spatial checks found, then a
+    line of JSON with each row's hash and its check_row result as ROW_FIELDS
+    columns. Rows are keyed by CourseID, numbered from the second time the same
+    CourseID appears; see row_key.
+    """
 
-def lint_tsv(input_file, output_file, epsilon=10):  # epsilon in meters
+    def __init__(self, state_file=None):
+        self.state_file = state_file
+        self.header = {}
+        self.rows = CourseRecords(ROW_FIELDS)
+        # ROW_HASH_SIZE bytes for each row
+        self.hashes = b''
+        # Row key to index into rows, empty if no row's results can be reused
+        self.index = {}
+        if state_file:
+            self._read(state_file)
+
+    def _read(self, state_file):
+        try:
+            with open(state_file, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline())
+                # Findings can be compared whatever code wrote them; results can't be reused
+                if header.get('version') == lint_state_version():
+                    saved = json.loads(f.readline())
+                    self.rows = CourseRecords.from_json(ROW_FIELDS, saved['rows'])
+                    self.hashes = bytes.fromhex(saved['hashes'])
+        except (OSError, ValueError, KeyError):
+            self.rows = CourseRecords(ROW_FIELDS)
+            self.hashes = b''
+            return
+        self.header = header
+        occurrences = Counter()
+        keys = (row_key(course_id, occurrences) for course_id in self.rows.columns['id'])
+        # Rows without a CourseID can't be matched up
+        self.index = {key: index for index, key in enumerate(keys) if key is not None}
+
+    @property
+    def generated(self):
+        return self.header.get('generated')
+
+    @property
+    def findings(self):
+        return self.header.get('findings', {})
+
+    def row_hash(self, index):
+        return self.hashes[index * ROW_HASH_SIZE:(index + 1) * ROW_HASH_SIZE]
+
+    def reusable(self, columns):
+        """
+        Whether rows can reuse their results, which they can't if the sheet's
+        columns have changed.
+        """
+        return bool(self.index) and self.header.get('columns') == columns
+
+    def pairs(self, check, parameter):
+        """
+        The keys of the pairs check found last run, if it ran with the same
+        parameter and the rows' results are reusable. Otherwise None.
+        """
+        pairs = self.header.get('pairs', {}).get(check)
+        if not self.index or not pairs or pairs['parameter'] != parameter:
+            return None
+        return [tuple(pair) for pair in pairs['keys']]
+
+    def save(self, generated, columns, rows, hashes, pairs, findings):
+        """
+        Save this run's rows (CourseRecords with ROW_FIELDS) and their hashes, its
+        pairs as a dictionary of check to parameter and list of key pairs, and its
+        findings.
+        """
+        if not self.state_file:
+            return
+        header = {
+            'version': lint_state_version(),
+            'generated': generated,
+            'columns': columns,
+            'pairs': {check: {'parameter': parameter, 'keys': keys} for check, (parameter, keys) in pairs.items()},
+            'findings': findings
+        }
+        with open(f"{self.state_file}.tmp", 'w', encoding='utf-8') as f:
+            f.write(json.dumps(header, separators=(',', ':')) + '\n')
+            f.write(json.dumps({'hashes': hashes.hex(), 'rows': rows.to_json()}, separators=(',', ':')) + '\n')
+        os.replace(f"{self.state_file}.tmp", self.state_file)
+
+
+# Sections of the report, as keyed in the changes, and their titles
+FINDING_SECTIONS = {
+    'empty_certificate_links': "Empty certificate links",
+    'duplicated_certificate_links': "Duplicated certificate links",
+    'broken_certificate_links': "Broken certificate links",
+    'calibration_misspellings': "'Calibration' misspellings",
+    'typoed_measurements': "Typoed measurements",
+    'close_coordinates': "Close coordinates",
+    'approximate_locations': "Approximate locations (PURPLE)",
+    'possible_duplicates': "Possible duplicate courses",
+    'mismeasured_lines': "Course lines off the certified length"
+}
+
+
+def report_findings(checks, mismeasured_lines):
     """
-    Lint the TSV file and write results to a text file:
-    1. Find all courses with empty certificate links
-    2. Find all courses with coordinates that are within epsilon meters of each other
-    3. Find all courses with 'Calibration' misspellings in their names
-    4. Find all courses with typoed measurements in their names
-    5. List all courses where Color is 'PURPLE' (approximate location)
-    6. Find all courses with duplicate certificate links
+    The report's findings by section, from the SheetChecks and the course lines
+    check, each with a key that identifies it from run to run and a line of text
+    describing it. Broken links are only a section if the links were checked.
+    """
+    rows = checks.rows
+    ids = rows.columns['id']
+    course_ids = checks.courses.columns['id']
+    course_names = checks.course_names
+
+    def pair_key(index1, index2):
+        return sorted([course_ids[index1], course_ids[index2]])
+
+    findings = {
+        'empty_certificate_links': [{'key': [ids[index]],
+                                     'text': f"{ids[index]}\t{course_names.get(ids[index], 'Unknown')}"}
+                                    for index in checks.empty_cert_links],
+        'duplicated_certificate_links': [
+            {'key': [link] + [ids[index] for index in indices],
+             'text': f"{link}\t{', '.join(ids[index] for index in indices)}"}
+            for link, indices in checks.duplicated_links.items()],
+        'calibration_misspellings': [{'key': [course['id'], course['misspelling']],
+                                      'text': f"{course['id']}\t{course['name']}"}
+                                     for course in map(rows.__getitem__, checks.misspelled_courses)],
+        'typoed_measurements': [{'key': [course['id'], course['typoed_measurement']],
+                                 'text': f"{course['id']}\t{course['name']}"}
+                                for course in map(rows.__getitem__, checks.typoed_measurement_courses)],
+        'close_coordinates': [{'key': pair_key(index1, index2),
+                               'text': f"{course_ids[index1]}\t{course_ids[index2]}\tDistance: {distance:.2f}m"}
+                              for index1, index2, distance in checks.close_courses],
+        'approximate_locations': [{'key': [course['id']],
+                                   'text': f"{course['id']}\t{course['name']}\t{course['city']}, {course['state']}"}
+                                  for course in map(rows.__getitem__, checks.purple_courses)],
+        'possible_duplicates': [{'key': pair_key(index1, index2),
+                                 'text': f"{course_ids[index1]}\t{course_ids[index2]}\tDistance: {distance:.2f}m, "
+                                         f"Name similarity: {similarity:.2f}"}
+                                for index1, index2, similarity, distance in checks.similar_courses],
+        'mismeasured_lines': [{'key': [course['id']],
+                               'text': f"{course['id']}\t{course['name']}\tLine: {percent_off:+.1f}%"}
+                              for course, _, _, percent_off in mismeasured_lines]
+    }
+    if checks.broken_links is not None:
+        findings['broken_certificate_links'] = [
+            {'key': [link] + [ids[index] for index in indices],
+             'text': f"{link}\t{describe(checks.link_results[link])}\t{', '.join(ids[index] for index in indices)}"}
+            for link, indices in checks.broken_links.items()]
+    return findings
+
+
+def finding_changes(findings, previous_findings):
     """
-    courses = []
-    empty_cert_links = []
-    misspelled_courses = []
-    typoed_measurement_courses = []
-    purple_courses = []
+    The findings that are new since the previous ones, and the previous findings
+    that have been resolved, each as a dictionary of section to findings.
+    Findings are matched by their keys.
+    """
+    new = {}
+    resolved = {}
+    for section in FINDING_SECTIONS:
+        current = findings.get(section, [])
+        previous = previous_findings.get(section, [])
+        current_keys = {tuple(finding['key']) for finding in current}
+        previous_keys = {tuple(finding['key']) for finding in previous}
+        new[section] = [finding for finding in current if tuple(finding['key']) not in previous_keys]
+        resolved[section] = [finding for finding in previous if tuple(finding['key']) not in current_keys]
+    return new, resolved
+
+
+def write_changes(changes_file, changes_json_file, timestamp, previous_timestamp, new, resolved):
+    """
+    Write the new and resolved findings as text and as JSON.
+    """
+    if changes_json_file:
+        with open(f"{changes_json_file}.tmp", 'w', encoding='utf-8') as f:
+            json.dump({'generated': timestamp, 'previous': previous_timestamp, 'new': new, 'resolved': resolved},
+                      f, indent=2)
+        os.replace(f"{changes_json_file}.tmp", changes_json_file)
 
-    # Dictionary to track certificate links and which courses use them
-    cert_links_to_courses = defaultdict(list)
+    if not changes_file:
+        return
+    with open(f"{changes_file}.tmp", 'w', encoding='utf-8') as f:
+        f.write("Calibration Courses QA Changes\n")
+        f.write(f"Generated: {timestamp}\n")
+        if previous_timestamp:
+            f.write(f"Since: {previous_timestamp}\n")
+        else:
+            f.write("Since: no previous run, so every finding is new\n")
+        f.write(f"{'=' * 50}\n")
+
+        for title, changes in (("NEW", new), ("RESOLVED", resolved)):
+            count = sum(len(findings) for findings in changes.values())
+            f.write(f"\n=== {title} FINDINGS ({count}) ===\n")
+            if not count:
+                f.write(f"No {title.lower()} findings.\n")
+            for section, findings in changes.items():
+                if findings:
+                    f.write(f"{FINDING_SECTIONS[section]}:\n")
+                    for finding in findings:
+                        f.write(f"{finding['text']}\n")
+    os.replace(f"{changes_file}.tmp", changes_file)
+
+
+def check_rows(courses_table, state, metrics, hashed=False):
+    """
+    Run check_row on each row of the course sheet, reusing the result saved in
+    the LintState for any row whose key and hash are unchanged. If hashed, each
+    row's hash is kept for saving in the state.
+
+    Returns the results as CourseRecords with ROW_FIELDS, their hashes as bytes,
+    a byte for each row that is 1 if the row was checked again, and the sheet's
+    columns.
+    """
+    rows = CourseRecords(ROW_FIELDS)
+    hashes = bytearray()
+    checked = bytearray()
+    occurrences = Counter()
+    columns = None
+    row_hashes = None
+    if hashed and isinstance(courses_table, CourseStore):
+        # Much quicker a column at a time than going through each row's columns
+        row_hashes = map(value_hash, zip(*courses_table.columns.values()))
+
+    for row in courses_table:
+        if columns is None:
+            columns = list(row.keys())
+            if not state.reusable(columns):
+                state.index = {}
+        key = row_key(row.get('CourseID'), occurrences)
+        hash_value = None
+        if hashed:
+            hash_value = next(row_hashes) if row_hashes else value_hash(tuple(value for _, value in row.items()))
+            hashes += hash_value
+
+        cached = state.index.get(key)
+        if cached is not None and state.row_hash(cached) == hash_value:
+            index = rows.copy(state.rows, cached)
+            checked.append(0)
+            metrics.count('rows_reused_from_state')
+        else:
+            result = check_row(row)
+            index = rows.append({**result, 'has_name': 'name' in result, 'has_link': 'link' in result})
+            checked.append(1)
+            metrics.count('rows_checked')
 
-    # Read in all courses
-    with open(input_file, 'r', encoding='utf-8') as tsv_file:
-        reader = csv.DictReader(tsv_file, delimiter='\t')
+        error = rows.columns['error'][index]
+        if error:
+            print(error)
+            metrics.count('rows_skipped')
+    return rows, hashes, checked, columns
 
-        # Create a dictionary to store course names by ID for easier lookup
-        course_names = {}
 
-        for row in reader:
-            try:
-                course_id = row['CourseID']
-                course_name = row['Name']
-                course_names[course_id] = course_name
-                cert_link = extract_url_from_anchor(row['Certificate URL'])
+class SheetChecks:
+    """
+    Everything lint_tsv checks in the sheet itself, which is every check but the
+    course lines one, so a run where only the course lines have changed can reuse
+    it. The checks run when it's created; the findings are indices into rows, or
+    into courses for pairs of courses.
+    """
 
-                # Check for empty certificate links
+    def __init__(self, courses_table, state, metrics, epsilon, duplicate_radius, link_checker=None, hashed=False):
+        self.epsilon = epsilon
+        self.duplicate_radius = duplicate_radius
+
+        with metrics.stage('row_checks'):
+            rows, self.hashes, checked, self.columns = check_rows(courses_table, state, metrics, hashed=hashed)
+            row_columns = rows.columns
+
+            empty_cert_links = []
+            misspelled_courses = []
+            typoed_measurement_courses = []
+            purple_courses = []
+            # The first row with each certificate link, and the later rows with the same link
+            first_link_rows = {}
+            repeated_link_rows = defaultdict(list)
+            # The rows of the courses with coordinates, and which of those courses were checked again
+            located = []
+            rechecked = []
+
+            for index, has_link, cert_link, misspelling, typoed_measurement, purple, lat, is_checked in zip(
+                    range(len(rows)), row_columns['has_link'], row_columns['link'], row_columns['misspelling'],
+                    row_columns['typoed_measurement'], row_columns['purple'], row_columns['lat'], checked):
+                if not has_link:
+                    continue
+
+                # Check for empty certificate links, and track the others for duplicate detection
                 if not cert_link:
-                    empty_cert_links.append(course_id)
-                else:
-                    # Track this certificate link for duplicate detection
-                    cert_links_to_courses[cert_link].append({
-                        'id': course_id,
-                        'name': course_name
-                    })
-
-                # Check for calibration misspellings
-                misspelling = detect_calibration_misspellings(course_name)
+                    empty_cert_links.append(index)
+                elif first_link_rows.setdefault(cert_link, index) != index:
+                    repeated_link_rows[cert_link].append(index)
+
                 if misspelling:
-                    misspelled_courses.append({
-                        'id': course_id,
-                        'name': course_name,
-                        'misspelling': misspelling
-                    })
-
-                # Check for typoed measurements
-                typoed_measurement = detect_typoed_measurements(course_name)
+                    misspelled_courses.append(index)
                 if typoed_measurement:
-                    typoed_measurement_courses.append({
-                        'id': course_id,
-                        'name': course_name,
-                        'typoed_measurement': typoed_measurement
-                    })
-
-                # Check for teal color (approximate location)
-                if 'Color' in row and row['Color'].upper() == 'PURPLE':
-                    purple_courses.append({
-                        'id': course_id,
-                        'name': course_name,
-                        'city': row.get('City', 'N/A'),
-                        'state': row.get('State', 'N/A')
-                    })
-
-                # Only add courses with valid coordinates
-                if row.get('Latitude') and row.get('Longitude'):
-                    lat = float(row['Latitude'])
-                    lon = float(row['Longitude'])
-
-                    courses.append({
-                        'id': course_id,
-                        'name': course_name,
-                        'lat': lat,
-                        'lon': lon,
-                        'city': row['City'],
-                        'state': row['State']
-                    })
-            except (ValueError, KeyError) as e:
-                print(f"Error processing course {row.get('CourseID', 'unknown')}: {e}")
-
-    # Find duplicated certificate links (links used by more than one course)
-    duplicated_links = {link: courses for link, courses in cert_links_to_courses.items() if len(courses) > 1}
-
-    # Find courses with close coordinates
-    close_courses = []
-
-    # Compare each course with every other course
-    for i, course1 in enumerate(courses):
-        for j, course2 in enumerate(courses[i + 1:], i + 1):
-            distance = haversine_distance(
-                course1['lat'], course1['lon'],
-                course2['lat'], course2['lon']
-            )
-
-            if distance <= epsilon:
-                close_courses.append((course1, course2, distance))
+                    typoed_measurement_courses.append(index)
+                if purple:
+                    purple_courses.append(index)
+
+                if not math.isnan(lat):
+                    if is_checked:
+                        rechecked.append(len(located))
+                    located.append(index)
+
+            # Empty links are listed with the name of the last row with the same CourseID
+            empty_ids = {row_columns['id'][index] for index in empty_cert_links}
+            self.course_names = {course_id: name for course_id, name, has_name
+                                 in zip(row_columns['id'], row_columns['name'], row_columns['has_name'])
+                                 if has_name and course_id in empty_ids}
+
+            # Find duplicated certificate links (links used by more than one course)
+            self.duplicated_links = {link: [index] + repeated_link_rows[link] for link, index in first_link_rows.items()
+                                     if link in repeated_link_rows}
+
+            # The spatial checks compare the courses with coordinates, keyed to match up their pairs from run to run
+            occurrences = Counter()
+            keys = [row_key(course_id, occurrences) for course_id in row_columns['id']]
+            courses = rows.select(located, COURSE_FIELDS)
+            courses.add_field('key', 's', [keys[index] for index in located])
+
+        self.rows = rows
+        self.courses = courses
+        self.empty_cert_links = empty_cert_links
+        self.misspelled_courses = misspelled_courses
+        self.typoed_measurement_courses = typoed_measurement_courses
+        self.purple_courses = purple_courses
+
+        # Check that each distinct certificate link resolves
+        self.link_results = None
+        self.broken_links = None
+        if link_checker:
+            with metrics.stage('links', items=len(first_link_rows)):
+                self.link_results = link_checker.check(first_link_rows, metrics)
+            # Links past the checker's cap that were never checked have no result yet
+            self.broken_links = {link: [index] + repeated_link_rows.get(link, [])
+                                 for link, index in first_link_rows.items()
+                                 if link in self.link_results and is_broken(self.link_results[link])}
+
+        # Find courses with close coordinates
+        with metrics.stage('proximity', items=len(courses)):
+            previous_pairs = state.pairs('close_coordinates', epsilon)
+            previous = None
+            if previous_pairs is not None:
+                previous = changed_courses(courses, rechecked, state, PROXIMITY_FIELDS), previous_pairs
+            self.close_courses = find_close_courses(courses, epsilon, previous)
+
+        # Find courses that look like the same course entered twice
+        with metrics.stage('near_duplicates', items=len(courses)):
+            previous_pairs = state.pairs('possible_duplicates', duplicate_radius)
+            previous = None
+            if previous_pairs is not None:
+                previous = changed_courses(courses, rechecked, state, DUPLICATE_FIELDS), previous_pairs
+            self.similar_courses = find_similar_courses(courses, duplicate_radius, previous=previous)
+
+    def line_courses(self, line_ids):
+        """
+        The row of each course with a line to check, by certificateId, which is the
+        last row with that CourseID and a certificate link.
+        """
+        row_columns = self.rows.columns
+        return {course_id: self.rows[index]
+                for index, course_id, has_link in zip(range(len(self.rows)), row_columns['id'], row_columns['has_link'])
+                if has_link and course_id in line_ids}
+
+
+def lint_tsv(courses_table, output_file, epsilon=10, metrics=None,
+             duplicate_radius=DUPLICATE_RADIUS_METERS,  # epsilon and duplicate_radius in meters
+             course_lines=(), length_tolerance=LINE_LENGTH_TOLERANCE_PERCENT,
+             state_file=None, changes_file=None, changes_json_file=None, full=False, link_checker=None,
+             sheet_checks=None):
+    """
+    Lint the course sheet (a CourseStore or any iterable of rows keyed by column)
+    and write results to a text file:
+    1. Find all courses with empty certificate links
+    2. Find all courses with coordinates that are within epsilon meters of each other
+    3. Find all courses with 'Calibration' misspellings in their names
+    4. Find all courses with typoed measurements in their names
+    5. List all courses where Color is 'PURPLE' (approximate location)
+    6. Find all courses with duplicate certificate links
+    7. Find pairs of nearby courses of the same length with similar names
+    8. Find course lines (LineString features) more than length_tolerance percent
+       longer or shorter than the certified length
+    9. If a LinkChecker is given, find certificate links that don't resolve
+
+    If state_file is given, the last run's results are read from it and this
+    run's saved there. Rows whose CourseID and contents are unchanged reuse their
+    results, and the spatial checks only look for pairs involving new, moved or
+    changed courses; the report is the same as checking everything again, which
+    full forces. The findings that are new or resolved since the last run are
+    written to changes_file as text and changes_json_file as JSON.
+
+    Returns the SheetChecks. Passing them back as sheet_checks, when the sheet
+    hasn't changed since, only checks the course lines again.
+    """
+    metrics = metrics or Metrics()
+    with metrics.stage('state'):
+        state = LintState(state_file)
+    if full:
+        state.index = {}
+
+    checks = sheet_checks or SheetChecks(courses_table, state, metrics, epsilon, duplicate_radius, link_checker,
+                                         hashed=bool(state_file))
+    rows, courses = checks.rows, checks.courses
+    row_columns = rows.columns
+    epsilon, duplicate_radius = checks.epsilon, checks.duplicate_radius
+
+    # Check the course lines against the certified lengths
+    with metrics.stage('line_lengths', items=len(course_lines)):
+        # Courses that have a line to check, by certificateId
+        line_ids = {feature.get('properties', {}).get('certificateId') for feature in course_lines}
+        mismeasured_lines = find_mismeasured_lines(checks.line_courses(line_ids), course_lines, length_tolerance)
 
     # Create timestamp
     timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
 
-    # Write results to file
-    with open(output_file, 'w', encoding='utf-8') as f:
+    # Write results to a temporary file, moved into place once it's complete
+    with metrics.stage('report'), open(f"{output_file}.tmp", 'w', encoding='utf-8') as f:
         f.write(f"Calibration Courses QA Report\n")
         f.write(f"Generated: {timestamp}\n")
         f.write(f"{'=' * 50}\n\n")
 
         f.write("=== COURSES WITH EMPTY CERTIFICATE LINKS ===\n")
-        if empty_cert_links:
-            for cert_id in empty_cert_links:
+        if checks.empty_cert_links:
+            for index in checks.empty_cert_links:
                 # Get the course name from our dictionary
-                course_name = course_names.get(cert_id, "Unknown")
+                cert_id = row_columns['id'][index]
+                course_name = checks.course_names.get(cert_id, "Unknown")
                 f.write(f"{cert_id}\t{course_name}\n")
         else:
             f.write("No courses with empty certificate links found.\n")
 
         f.write("\n=== COURSES WITH DUPLICATED CERTIFICATE LINKS ===\n")
-        if duplicated_links:
-            for link, course_list in duplicated_links.items():
+        if checks.duplicated_links:
+            for link, indices in checks.duplicated_links.items():
                 f.write(f"Link: {link}\n")
-                for course in course_list:
+                for course in map(rows.__getitem__, indices):
                     f.write(f"{course['id']}\t{course['name']}\n")
                 f.write(f"{'-' * 50}\n")
         else:
             f.write("No courses with duplicated certificate links found.\n")
 
+        if checks.broken_links is not None:
+            f.write("\n=== COURSES WITH BROKEN CERTIFICATE LINKS ===\n")
+            if checks.broken_links:
+                for link, indices in checks.broken_links.items():
+                    f.write(f"Link: {link}\n")
+                    f.write(f"{describe(checks.link_results[link])}\n")
+                    for course in map(rows.__getitem__, indices):
+                        f.write(f"{course['id']}\t{course['name']}\n")
+                    f.write(f"{'-' * 50}\n")
+            else:
+                f.write("No courses with broken certificate links found.\n")
+
         f.write("\n=== COURSES WITH 'CALIBRATION' MISSPELLINGS ===\n")
-        if misspelled_courses:
-            for course in misspelled_courses:
+        if checks.misspelled_courses:
+            for course in map(rows.__getitem__, checks.misspelled_courses):
                 f.write(f"{course['id']}\t{course['name']}\n")
         else:
             f.write("No courses with 'Calibration' misspellings found.\n")
 
         f.write("\n=== COURSES WITH TYPOED MEASUREMENTS ===\n")
-        if typoed_measurement_courses:
-            for course in typoed_measurement_courses:
+        if checks.typoed_measurement_courses:
+            for course in map(rows.__getitem__, checks.typoed_measurement_courses):
                 f.write(f"{course['id']}\t{course['name']}\n")
         else:
             f.write("No courses with typoed measurements found.\n")
 
         f.write(f"\n=== COURSES WITH CLOSE COORDINATES (within {epsilon} meters) ===\n")
-        if close_courses:
-            for course1, course2, distance in close_courses:
+        if checks.close_courses:
+            for index1, index2, distance in checks.close_courses:
+                course1, course2 = courses[index1], courses[index2]
                 f.write(f"{course1['id']}\t{course1['name']}\t{course1['city']}, {course1['state']}\n")
                 f.write(f"{course2['id']}\t{course2['name']}\t{course2['city']}, {course2['state']}\n")
                 f.write(f"Distance: {distance:.2f}m\n")
@@ -257,27 +813,115 @@ def lint_tsv(input_file, output_file, epsilon=10):  # epsilon in meters
             f.write("No courses with close coordinates found.\n")
 
         f.write("\n=== COURSES WITH APPROXIMATE LOCATION (PURPLE) ===\n")
-        if purple_courses:
-            for course in purple_courses:
+        if checks.purple_courses:
+            for course in map(rows.__getitem__, checks.purple_courses):
                 f.write(f"{course['id']}\t{course['name']}\t{course['city']}, {course['state']}\n")
         else:
             f.write("No courses with approximate location (PURPLE color) found.\n")
 
+        f.write(f"\n=== POSSIBLE DUPLICATE COURSES (same length, similar names, within {duplicate_radius} meters) ===\n")
+        if checks.similar_courses:
+            for index1, index2, similarity, distance in checks.similar_courses:
+                course1, course2 = courses[index1], courses[index2]
+                f.write(f"{course1['id']}\t{course1['name']}\t{course1['city']}, {course1['state']}\n")
+                f.write(f"{course2['id']}\t{course2['name']}\t{course2['city']}, {course2['state']}\n")
+                f.write(f"Length: {course1['dist']} {course1['units']}, Distance: {distance:.2f}m, "
+                        f"Name similarity: {similarity:.2f}\n")
+                f.write(f"{'-' * 50}\n")
+        else:
+            f.write("No possible duplicate courses found.\n")
+
+        f.write(f"\n=== COURSE LINES OFF THE CERTIFIED LENGTH (by more than {length_tolerance:g}%) ===\n")
+        if mismeasured_lines:
+            for course, measurement, certified, percent_off in mismeasured_lines:
+                longitude, latitude = measurement['midpoint']
+                f.write(f"{course['id']}\t{course['name']}\t{course['city']}, {course['state']}\n")
+                f.write(f"Certified: {course['dist']} {course['units']} ({certified:.2f}m), "
+                        f"Line: {measurement['lineLengthMeters']:.2f}m ({percent_off:+.1f}%), "
+                        f"Bearing: {measurement['bearing']:.1f}, Midpoint: {latitude:.7f}, {longitude:.7f}\n")
+                f.write(f"{'-' * 50}\n")
+        else:
+            f.write("No course lines off the certified length found.\n")
+    os.replace(f"{output_file}.tmp", output_file)
     print(f"Report written to {output_file}")
 
+    with metrics.stage('changes'):
+        findings = report_findings(checks, mismeasured_lines)
+        if checks.broken_links is None:
+            # The links weren't checked this run, so what the last check found stands
+            findings['broken_certificate_links'] = state.findings.get('broken_certificate_links', [])
+        if changes_file or changes_json_file:
+            new, resolved = finding_changes(findings, state.findings)
+            write_changes(changes_file, changes_json_file, timestamp, state.generated, new, resolved)
+            print(f"Changes since the last run written to {changes_file or changes_json_file}: "
+                  f"{sum(map(len, new.values()))} new, {sum(map(len, resolved.values()))} resolved")
+    with metrics.stage('state'):
+        course_keys = courses.columns['key']
+        pairs = {'close_coordinates': (epsilon, [[course_keys[pair[0]], course_keys[pair[1]]]
+                                                 for pair in checks.close_courses]),
+                 'possible_duplicates': (duplicate_radius, [[course_keys[pair[0]], course_keys[pair[1]]]
+                                                            for pair in checks.similar_courses])}
+        state.save(timestamp, checks.columns, rows, checks.hashes, pairs, findings)
+    return checks
+
 
 def main():
+    parser = argparse.ArgumentParser(description="Check the calibration course sheet for data quality problems.")
+    parser.add_argument("--length-tolerance", type=float, default=LINE_LENGTH_TOLERANCE_PERCENT,
+                        help="Percent a course line's length can be off the certified length "
+                             f"(default: {LINE_LENGTH_TOLERANCE_PERCENT})")
+    parser.add_argument("--full", action="store_true",
+                        help="Check every row and pair instead of reusing the results of the last run")
+    parser.add_argument("--check-links", action="store_true",
+                        help="Also check that every certificate link resolves, reusing recent results")
+    parser.add_argument("--max-link-checks", type=int, default=MAX_CHECKS_PER_RUN,
+                        help="Check at most this many links, leaving the rest for later runs "
+                             f"(default: {MAX_CHECKS_PER_RUN})")
+    parser.add_argument("--profile", help="Write cProfile stats for the run to this file")
+    args = parser.parse_args()
+
     data_dir = Path("data")
     data_dir.mkdir(exist_ok=True)
 
     input_file = data_dir / "calibration_courses.tsv"
+    store_file = data_dir / ".course_store"
     output_file = data_dir / "calibration_qa_report.txt"
+    state_file = data_dir / ".lint_state"
+    changes_file = data_dir / "calibration_qa_changes.txt"
+    changes_json_file = data_dir / "calibration_qa_changes.json"
+    link_cache_file = data_dir / ".link_cache"
+    metrics_file = data_dir / "pipeline_metrics.json"
 
     if not Path(input_file).exists():
         print(f"Error: Input file '{input_file}' not found.")
         return
 
-    lint_tsv(input_file, output_file, epsilon=10)
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+
+    metrics = Metrics()
+    # Reuses the table prepare_data.py saved if the sheet hasn't changed since
+    with metrics.stage('load'):
+        courses_table = CourseStore.load(input_file, store_file)
+        overlay_cache = OverlayCache(data_dir / ".overlay_cache")
+        additional_features, _ = load_overlays(overlay_files(data_dir / "additional_data.geojson", data_dir / "overlays"),
+                                               overlay_cache, metrics)
+        overlay_cache.save()
+    course_lines = [feature for feature in additional_features.values()
+                    if feature.get('geometry', {}).get('type') == 'LineString']
+    lint_tsv(courses_table, output_file, epsilon=10, metrics=metrics, course_lines=course_lines,
+             length_tolerance=args.length_tolerance, state_file=state_file, changes_file=changes_file,
+             changes_json_file=changes_json_file, full=args.full,
+             link_checker=LinkChecker(link_cache_file, max_checks=args.max_link_checks) if args.check_links else None)
+
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        print(f"Profile written to {args.profile}")
+
+    metrics.write(metrics_file, 'lint_tsv')
+    print(f"Pipeline metrics written to {metrics_file}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,99 @@
+"""
+Lightweight per-stage instrumentation for the data pipeline.
+
+Stages record wall time, CPU time, items processed and the process's peak
+memory when the stage last ran. Stages can nest, and streaming stages can feed
+each other; time spent in an inner stage is only counted against the inner one.
+Counters tally events that used to get a log line each.
+"""
+import json
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Metrics:
+    def __init__(self):
+        self.stages = {}
+        self.counters = Counter()
+        # Open stages, as [name, wall start, cpu start, wall in inner stages, cpu in inner stages]
+        self._open = []
+
+    def _enter(self, name):
+        self._open.append([name, time.perf_counter(), time.process_time(), 0.0, 0.0])
+
+    def _exit(self, items=0):
+        name, wall_start, cpu_start, inner_wall, inner_cpu = self._open.pop()
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+
+        stage = self.stages.setdefault(name, {'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'items': 0})
+        stage['wall_seconds'] += wall - inner_wall
+        stage['cpu_seconds'] += cpu - inner_cpu
+        stage['items'] += items
+        stage['peak_rss_mb'] = peak_rss_mb()
+
+        if self._open:
+            self._open[-1][3] += wall
+            self._open[-1][4] += cpu
+
+    @contextmanager
+    def stage(self, name, items=0):
+        """
+        Time the body of a with block as the named stage.
+        """
+        self._enter(name)
+        try:
+            yield
+        finally:
+            self._exit(items)
+
+    def stream(self, name, iterable):
+        """
+        Pass a stream through, timing the work done producing each item as the named stage.
+        """
+        iterator = iter(iterable)
+        while True:
+            self._enter(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self._exit()
+                return
+            except BaseException:
+                self._exit()
+                raise
+            self._exit(items=1)
+            yield item
+
+    def count(self, counter, amount=1):
+        self.counters[counter] += amount
+
+    def to_dict(self):
+        return {'stages': self.stages, 'counters': dict(self.counters)}
+
+    def write(self, metrics_file, section):
+        """
+        Write these metrics as one section of a metrics file shared between scripts.
+        """
+        try:
+            with open(metrics_file, 'r', encoding='utf-8') as f:
+                all_metrics = json.load(f)
+        except (OSError, ValueError):
+            all_metrics = {}
+
+        all_metrics[section] = self.to_dict()
+        with open(metrics_file, 'w', encoding='utf-8') as f:
+            json.dump(all_metrics, f, indent=2)
@@ -0,0 +1,109 @@
+"""
+Course name normalization.
+
+Every rule is compiled once at import time. Rules that can never overlap are
+folded into a single alternation with a lookup table for the replacement, so a
+name takes six regex passes instead of the fifteen or so the original chain of
+helpers needed. The output is byte-identical to that chain.
+"""
+import re
+
+# Various forms of calibration course references, along with any leading dash
+CALIBRATION_PATTERN = re.compile(
+    r'\s+-?\s*(?:calibration\s+courses?|calibration|cal\.?\s*courses?|cal\s+crses?)',
+    re.IGNORECASE
+)
+
+# Text representations of fractions, like "Quarter Mile", "A Quarter Mile" or "One Half Mile".
+# Look ahead for mile/miler/mi to avoid replacing "Half" in "Half Moon Bay"
+FRACTION_WORDS = {'quarter': '1/4 ', 'half': '1/2 '}
+FRACTION_WORD_PATTERN = re.compile(
+    r'\b(?:one\s+|a\s+)?(quarter|half)[\s-]*(?=mil(?:e|er)s?|mi\b)',
+    re.IGNORECASE
+)
+
+# Digits with optional decimal portion OR fractions, followed by optional space/dash and then
+# metric, feet or mile indicators. The units never share a first letter, so one alternation
+# finds the same matches as a pass per unit.
+NUMBER_PATTERN = r'(\d+(?:\.\d+)?|\d+\s*/\s*\d+)'
+UNIT_PATTERN = re.compile(
+    NUMBER_PATTERN + r'[ \s-]?(?:'
+    r'(?P<m>meters?|mtr|m)\b'
+    r'|(?P<ft>(?:feet|foot|ft\.?)\b|\')'
+    r'|(?P<mi>miles?|milers?|mi)\b'
+    r')',
+    re.IGNORECASE
+)
+
+MEASUREMENT_PATTERN = re.compile(
+    r'\s*(?:\s*-\s*)?(?:\d+(?:\.\d+)?|\d+\s*/\s*\d+)(?:\s*(?:m|ft|mi|km)\b)',
+    re.IGNORECASE
+)
+
+# Empty parentheses or - () that might be left over
+EMPTY_PARENTHESES_PATTERN = re.compile(r'\s*(?:-\s*)?\(\s*\)')
+
+ROAD_TYPES = {
+    'avenue': 'Ave',
+    'boulevard': 'Blvd',
+    'circle': 'Cir',
+    'court': 'Ct',
+    'drive': 'Dr',
+    'expressway': 'Expy',
+    'freeway': 'Fwy',
+    'highway': 'Hwy',
+    'lane': 'Ln',
+    'parkway': 'Pkwy',
+    'place': 'Pl',
+    'road': 'Rd',
+    'square': 'Sq',
+    'street': 'St',
+    'terrace': 'Ter',
+    # 'trail': 'Trl',
+    'turnpike': 'Tpke',
+    'way': 'Way'
+}
+
+# Abbreviating a road type and then dropping unnecessary periods after compass directions
+# and road type abbreviations, in one pass. A road type is matched case-insensitively and
+# swallows a trailing period, which the period rule would otherwise have removed from its
+# abbreviation. The other two rules are case-sensitive.
+ROAD_TYPE_PATTERN = re.compile(
+    r'\b(?:'
+    r'(?P<road>(?i:' + '|'.join(sorted(ROAD_TYPES, key=len, reverse=True)) + r'))\b(?:\.(?!\w))?'
+    r'|(?P<compass>[NSEW]|NE|NW|SE|SW)\.(?!\w)'
+    r'|(?P<abbrev>Ave|Blvd|Cir|Ct|Dr|Expy|Fwy|Hwy|Ln|Pkwy|Pl|Rd|Sq|St|Ter|Trl|Tpke|Way)\.(?!\w)'
+    r')'
+)
+
+
+def _replace_fraction_word(match):
+    return FRACTION_WORDS[match.group(1).lower()]
+
+
+def _replace_unit(match):
+    # Remove spaces in fractions
+    number = ''.join(match.group(1).split())
+    return number + match.lastgroup
+
+
+def _replace_road_type(match):
+    if match.lastgroup == 'road':
+        return ROAD_TYPES[match.group('road').lower()]
+    return match.group(match.lastgroup)
+
+
+def normalize(name):
+    """
+    Abbreviate a course name for display: strip calibration references and
+    measurements, and standardize road types and compass directions.
+    """
+    text = CALIBRATION_PATTERN.sub('', name)
+    text = text.replace(" yards", "yd")
+    text = FRACTION_WORD_PATTERN.sub(_replace_fraction_word, text)
+    text = UNIT_PATTERN.sub(_replace_unit, text)
+    text = MEASUREMENT_PATTERN.sub('', text)
+    text = EMPTY_PARENTHESES_PATTERN.sub('', text)
+    text = ROAD_TYPE_PATTERN.sub(_replace_road_type, text)
+    # Clean up any extra spaces
+    return ' '.join(text.split())
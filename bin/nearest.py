@@ -0,0 +1,605 @@
+#!/usr/bin/env python3
+"""
+The calibration courses nearest a location, from a spatial index of
+calibration_courses.geojson, on the command line or over local HTTP.
+
+Courses are bucketed into a grid over unit-sphere (x, y, z) coordinates, as in
+geodesy.neighbor_pairs, with cells CELL_SIZE_METERS wide. A query looks at the
+cells around its own in growing shells, and stops once every cell left is
+farther away than the radius, or than the k-th closest course found so far,
+counting from the query itself rather than the edge of its cell. Courses lie
+on the sphere's surface, so most cells of a shell are empty: once the shells
+would hold more cells than there are blocks of BLOCK_CELLS cells a side, the
+remaining blocks are visited instead, closest first, skipping any block or
+cell farther away than that limit. Distances are computed the same way as
+geodesy.haversine_from, so the results are exactly those of a brute-force search.
+
+The index is written next to the GeoJSON along with the GeoJSON's hash, and
+memory-mapped when it's opened, so only the table of occupied cells is built
+in memory. The file is little-endian:
+
+    header      magic "NRST", uint16 version, uint16 units count, uint32 course
+                count, uint32 cell count, float64 cell size in meters,
+                32-byte SHA-256 of the GeoJSON
+    units       for each units value: uint8 length, UTF-8 name; padded to 8 bytes
+    cells       int32 x, y and z grid coordinates of each cell, then
+                (cell count + 1) uint32 positions of each cell's first course;
+                padded to 8 bytes
+    courses     in cell order: float64 latitudes, longitudes (both in radians) and
+                cosines of the latitudes, uint32 feature indices, uint8 flags
+                (1 expired, 2 approximate) and uint8 units numbers; padded to 8 bytes
+    records     (course count + 1) uint32 byte offsets, then each course's
+                RECORD_PROPERTIES and coordinates as a JSON array
+"""
+import argparse
+import heapq
+import json
+import math
+import mmap
+import random
+import struct
+import sys
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from course_records import intern_value
+from course_store import _little_endian, _write_aligned, file_hash
+from geodesy import EARTH_RADIUS_METERS, Points, haversine_from
+
+MAGIC = b'NRST'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIId32s')
+CELL_SIZE_METERS = 20000
+RECORD_PROPERTIES = ('certificateId', 'nameAbbreviated', 'city', 'state', 'courseLength', 'units', 'expired',
+                     'approximate')
+EXPIRED = 1
+APPROXIMATE = 2
+# Allowance for rounding when comparing distances with a cell's lower bound
+BOUND_MARGIN_METERS = 0.001
+DEFAULT_K = 5
+# Cells along each side of the blocks that distant cells are visited in
+BLOCK_CELLS = 8
+
+
+def meters_to_chord(meters):
+    """
+    The straight-line chord of the unit sphere spanning a great circle distance,
+    up to the sphere's diameter.
+    """
+    return 2 * math.sin(min(meters / EARTH_RADIUS_METERS / 2, math.pi / 2))
+
+
+def course_flags(properties):
+    return (EXPIRED if properties.get('expired') else 0) | (APPROXIMATE if properties.get('approximate') else 0)
+
+
+def point_coordinates(feature):
+    """
+    A Point feature's [longitude, latitude], or None if it has no usable position.
+    """
+    geometry = feature.get('geometry') or {}
+    coordinates = geometry.get('coordinates')
+    if geometry.get('type') != 'Point' or not coordinates or len(coordinates) < 2:
+        return None
+    if not all(isinstance(c, (int, float)) and math.isfinite(c) for c in coordinates[:2]):
+        return None
+    return coordinates[:2]
+
+
+class NearestIndexBuilder:
+    """
+    Collects the position of each Point feature, then writes the index. If
+    precision is given, coordinates are rounded to it, as they are in compact GeoJSON.
+    """
+
+    def __init__(self, cell_size=CELL_SIZE_METERS, precision=None):
+        self.cell_size = cell_size
+        self.precision = precision
+        self.count = 0
+        self.lats = array('d')
+        self.lons = array('d')
+        self.indices = array('I')
+        self.flags = array('B')
+        self.units = []
+        self.records = []
+
+    def add(self, feature):
+        index = self.count
+        self.count += 1
+        coordinates = point_coordinates(feature)
+        if coordinates is None:
+            return
+        if self.precision is not None:
+            coordinates = [round(coordinate, self.precision) for coordinate in coordinates]
+        properties = feature.get('properties', {})
+        self.lons.append(coordinates[0])
+        self.lats.append(coordinates[1])
+        self.indices.append(index)
+        self.flags.append(course_flags(properties))
+        self.units.append(intern_value(properties.get('units') or ''))
+        self.records.append(json.dumps([properties.get(key) for key in RECORD_PROPERTIES] + [coordinates],
+                                       separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+
+    def collect(self, features):
+        """
+        Add each feature of a stream as it passes through.
+        """
+        for feature in features:
+            self.add(feature)
+            yield feature
+
+    def write(self, index_file, source_hash):
+        points = Points(self.lats, self.lons)
+        size = self.cell_size / EARTH_RADIUS_METERS
+        floor = math.floor
+        cells_of = [(floor(x / size), floor(y / size), floor(z / size)) for x, y, z in zip(*points.unit_vectors())]
+        # Courses in cell order, and in feature order within a cell
+        order = sorted(range(len(points)), key=lambda position: (cells_of[position], self.indices[position]))
+
+        cells = []
+        starts = array('I')
+        for sorted_position, position in enumerate(order):
+            if not cells or cells[-1] != cells_of[position]:
+                cells.append(cells_of[position])
+                starts.append(sorted_position)
+        starts.append(len(order))
+
+        units_names = sorted(set(self.units))
+        units_numbers = {name: number for number, name in enumerate(units_names)}
+        records = [self.records[position] for position in order]
+        offsets = array('I', [0])
+        for record in records:
+            offsets.append(offsets[-1] + len(record))
+
+        temporary_file = f"{index_file}.tmp"
+        with open(temporary_file, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(units_names), len(order), len(cells), self.cell_size,
+                                source_hash))
+            _write_aligned(f, b''.join(struct.pack('<B', len(name.encode('utf-8'))) + name.encode('utf-8')
+                                       for name in units_names), 8)
+            for axis in range(3):
+                f.write(_little_endian(array('i', (cell[axis] for cell in cells))))
+            _write_aligned(f, _little_endian(starts), 8)
+            for column in (points.lat, points.lon, points.cos_lat):
+                f.write(_little_endian(array('d', (column[position] for position in order))))
+            f.write(_little_endian(array('I', (self.indices[position] for position in order))))
+            f.write(bytes(self.flags[position] for position in order))
+            _write_aligned(f, bytes(units_numbers[self.units[position]] for position in order), 8)
+            f.write(_little_endian(offsets))
+            f.write(b''.join(records))
+        Path(temporary_file).replace(index_file)
+        return len(cells)
+
+
+class NearestIndex:
+    """
+    A memory-mapped index answering nearest-course and radius queries.
+    """
+
+    def __init__(self, buffer, index_file):
+        if sys.byteorder != 'little':
+            raise ValueError("Nearest-course indexes can only be mapped on little-endian machines")
+        self._buffer = buffer
+        view = memoryview(buffer)
+
+        magic, version, units_count, count, cell_count, cell_size, source_hash = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"'{index_file}' is not a version {VERSION} nearest-course index")
+        self.count = count
+        self.cell_size = cell_size
+        self.source_hash = source_hash
+        offset = HEADER.size
+
+        self.units_names = []
+        for _ in range(units_count):
+            length = view[offset]
+            self.units_names.append(bytes(view[offset + 1:offset + 1 + length]).decode('utf-8'))
+            offset += 1 + length
+        offset += -offset % 8
+
+        axes = []
+        for _ in range(3):
+            axes.append(view[offset:offset + cell_count * 4].cast('i'))
+            offset += cell_count * 4
+        self.starts = view[offset:offset + (cell_count + 1) * 4].cast('I')
+        offset += (cell_count + 1) * 4
+        offset += -offset % 8
+        # Grid coordinates to cell number, for the occupied cells only
+        self.cells = dict(zip(zip(*axes), range(cell_count)))
+        self._blocks = None
+
+        columns = []
+        for _ in range(3):
+            columns.append(view[offset:offset + count * 8].cast('d'))
+            offset += count * 8
+        self.lat, self.lon, self.cos_lat = columns
+        self.indices = view[offset:offset + count * 4].cast('I')
+        offset += count * 4
+        self.flags = view[offset:offset + count]
+        offset += count
+        self.units = view[offset:offset + count]
+        offset += count
+        offset += -offset % 8
+        self.offsets = view[offset:offset + (count + 1) * 4].cast('I')
+        self.records = view[offset + (count + 1) * 4:]
+
+    def __len__(self):
+        return self.count
+
+    @classmethod
+    def open(cls, index_file):
+        with open(index_file, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer, index_file)
+
+    @classmethod
+    def load(cls, geojson_file, index_file):
+        """
+        Open the index in index_file if it was built from geojson_file as it is now,
+        otherwise build it from geojson_file first.
+        """
+        source_hash = file_hash(geojson_file)
+        if Path(index_file).exists():
+            try:
+                index = cls.open(index_file)
+            except (OSError, ValueError):
+                index = None
+            if index and index.source_hash == source_hash:
+                return index
+
+        with open(geojson_file, 'r', encoding='utf-8') as f:
+            features = json.load(f)['features']
+        builder = NearestIndexBuilder()
+        for feature in features:
+            builder.add(feature)
+        builder.write(index_file, source_hash)
+        return cls.open(index_file)
+
+    def blocks(self):
+        """
+        The occupied cells grouped into blocks, as a list of block centres and a
+        list of (lower corner, upper corner, cells) tuples, with the centres and
+        corners in unit-sphere coordinates and each cell as its grid coordinates
+        and cell number.
+        """
+        if self._blocks is None:
+            grouped = {}
+            for cell_coordinates, cell in self.cells.items():
+                block = tuple(c // BLOCK_CELLS for c in cell_coordinates)
+                grouped.setdefault(block, []).append((*cell_coordinates, cell))
+            block_size = self.cell_size / EARTH_RADIUS_METERS * BLOCK_CELLS
+            self._blocks = ([tuple((b + 0.5) * block_size for b in block) for block in grouped],
+                            [(tuple(b * block_size for b in block), tuple((b + 1) * block_size for b in block),
+                              block_cells) for block, block_cells in grouped.items()])
+        return self._blocks
+
+    def record(self, position):
+        """
+        The properties and coordinates of the course at a position in the index.
+        """
+        values = json.loads(bytes(self.records[self.offsets[position]:self.offsets[position + 1]]))
+        record = dict(zip(RECORD_PROPERTIES, values))
+        record['coordinates'] = values[len(RECORD_PROPERTIES)]
+        return record
+
+    def _accepts(self, active, exact, units):
+        """
+        A test of whether the course at a position passes the filters, or None if
+        every course does.
+        """
+        excluded = (EXPIRED if active else 0) | (APPROXIMATE if exact else 0)
+        units_number = None
+        if units is not None:
+            if units not in self.units_names:
+                return lambda position: False
+            units_number = self.units_names.index(units)
+        if not excluded and units_number is None:
+            return None
+        flags, units_column = self.flags, self.units
+        return lambda position: (not flags[position] & excluded
+                                 and (units_number is None or units_column[position] == units_number))
+
+    def search(self, lat, lon, k=DEFAULT_K, radius=None, active=False, exact=False, units=None):
+        """
+        Find the k courses nearest (lat, lon), or the courses within radius meters
+        of it, or with both the k nearest within radius. Optionally only courses that
+        haven't expired, that aren't at approximate locations, or that are measured
+        in the given units. Returns (distance in meters, feature index, position)
+        tuples, closest first and then in feature order.
+        """
+        if k is None and radius is None:
+            raise ValueError("A query needs k, a radius or both")
+        if units is not None and units not in self.units_names:
+            return []
+        accepts = self._accepts(active, exact, units)
+
+        origin = Points([lat], [lon])
+        lat1, lon1, cos_lat1 = origin.lat[0], origin.lon[0], origin.cos_lat[0]
+        query = [column[0] for column in origin.unit_vectors()]
+        size = self.cell_size / EARTH_RADIUS_METERS
+        home = [math.floor(coordinate / size) for coordinate in query]
+
+        lats, lons, cos_lats, indices, starts = self.lat, self.lon, self.cos_lat, self.indices, self.starts
+        sin, asin, sqrt = math.sin, math.asin, math.sqrt
+        heappush, heapreplace = heapq.heappush, heapq.heapreplace
+        found = []
+        # The k smallest distances found so far, negated, so the k-th is at the top of the heap
+        closest = []
+
+        def visit(cell):
+            for position in range(starts[cell], starts[cell + 1]):
+                if accepts is None or accepts(position):
+                    lat2, lon2 = lats[position], lons[position]
+                    # The same expression as haversine_from, so the distances are identical
+                    distance = 2 * asin(sqrt(sin((lat2 - lat1) / 2) ** 2 + cos_lat1 * cos_lats[position] *
+                                             sin((lon2 - lon1) / 2) ** 2)) * EARTH_RADIUS_METERS
+                    found.append((distance, indices[position], position))
+                    if k is not None:
+                        if len(closest) < k:
+                            heappush(closest, -distance)
+                        elif distance < -closest[0]:
+                            heapreplace(closest, -distance)
+
+        def limit():
+            # The chord beyond which nothing can change the result
+            meters = math.inf if radius is None else radius
+            if k is not None and len(closest) >= k:
+                meters = min(meters, -closest[0])
+            return meters_to_chord(meters + BOUND_MARGIN_METERS)
+
+        # How far the query is from the nearest face of its own cell
+        edge = min(min(q - h * size, (h + 1) * size - q) for q, h in zip(query, home))
+        centers, blocks = self.blocks()
+        cells = self.cells
+        ring = 0
+        # Shells are mostly empty cells, so past the number of blocks it's quicker to visit those
+        while (2 * ring + 1) ** 3 <= max(len(blocks), 27):
+            for dx in range(-ring, ring + 1):
+                for dy in range(-ring, ring + 1):
+                    on_shell = abs(dx) == ring or abs(dy) == ring
+                    for dz in (range(-ring, ring + 1) if on_shell else {-ring, ring}):
+                        cell = cells.get((home[0] + dx, home[1] + dy, home[2] + dz))
+                        if cell is not None:
+                            visit(cell)
+            # Every cell outside the shells is beyond a ring of cells past the query's own cell
+            if ring * size + edge > limit():
+                break
+            ring += 1
+        else:
+            # Visit the blocks with cells outside the shells, in order of the distance to their
+            # centres less half their diagonal, skipping any block or cell farther than needed
+            half_diagonal = size * BLOCK_CELLS * sqrt(3) / 2
+            dist = math.dist
+            remaining = [(dist(query, center) - half_diagonal, block) for block, center in enumerate(centers)]
+            # Only the blocks visited need to come off the heap in order
+            heapq.heapify(remaining)
+            home_x, home_y, home_z = home
+            query_x, query_y, query_z = query
+            chord = limit()
+            while remaining:
+                bound, block = heapq.heappop(remaining)
+                if bound > chord:
+                    break
+                lower, upper, block_cells = blocks[block]
+                gap_x = max(0.0, lower[0] - query_x, query_x - upper[0])
+                gap_y = max(0.0, lower[1] - query_y, query_y - upper[1])
+                gap_z = max(0.0, lower[2] - query_z, query_z - upper[2])
+                if gap_x * gap_x + gap_y * gap_y + gap_z * gap_z > chord * chord:
+                    continue
+                for x, y, z, cell in block_cells:
+                    if abs(x - home_x) < ring and abs(y - home_y) < ring and abs(z - home_z) < ring:
+                        continue
+                    gap_x = max(0.0, x * size - query_x, query_x - (x + 1) * size)
+                    gap_y = max(0.0, y * size - query_y, query_y - (y + 1) * size)
+                    gap_z = max(0.0, z * size - query_z, query_z - (z + 1) * size)
+                    if gap_x * gap_x + gap_y * gap_y + gap_z * gap_z <= chord * chord:
+                        visit(cell)
+                        chord = limit()
+
+        found.sort()
+        if radius is not None:
+            found = [result for result in found if result[0] <= radius]
+        return found[:k] if k is not None else found
+
+    def nearest(self, lat, lon, k=DEFAULT_K, radius=None, active=False, exact=False, units=None):
+        """
+        Like search, but returning each course's record with its distance in meters.
+        """
+        return [{**self.record(position), 'distanceMeters': round(distance, 1)}
+                for distance, _, position in self.search(lat, lon, k, radius, active, exact, units)]
+
+
+def brute_force(features, lat, lon, k=DEFAULT_K, radius=None, active=False, exact=False, units=None):
+    """
+    Answer a search by measuring the distance to every course in the GeoJSON
+    features, for comparison with NearestIndex.search. Returns (distance, feature
+    index) tuples.
+    """
+    candidates = []
+    for index, feature in enumerate(features):
+        properties = feature.get('properties', {})
+        coordinates = point_coordinates(feature)
+        if coordinates is None or (active and properties.get('expired')) or \
+                (exact and properties.get('approximate')) or (units is not None and properties.get('units') != units):
+            continue
+        candidates.append((index, coordinates))
+    points = Points([coordinates[1] for _, coordinates in candidates], [coordinates[0] for _, coordinates in candidates])
+    results = sorted(zip(haversine_from(points, lat, lon), (index for index, _ in candidates)))
+    if radius is not None:
+        results = [result for result in results if result[0] <= radius]
+    return results[:k] if k is not None else results
+
+
+def sample_queries(features, count, seed=0):
+    """
+    Queries near courses and anywhere on earth, with a mix of k, radius and filters.
+    """
+    rng = random.Random(seed)
+    positions = [coordinates for coordinates in map(point_coordinates, features) if coordinates]
+    units = sorted({feature.get('properties', {}).get('units') for feature in features} - {None})
+    queries = []
+    for _ in range(count):
+        if positions and rng.random() < 0.8:
+            lon, lat = rng.choice(positions)
+            lat = max(-90.0, min(90.0, lat + rng.uniform(-1, 1)))
+            lon += rng.uniform(-1, 1)
+        else:
+            lat, lon = rng.uniform(-90, 90), rng.uniform(-180, 180)
+        query = {'lat': lat, 'lon': lon, 'k': rng.choice([1, 5, 10, None]),
+                 'radius': rng.choice([None, None, 5000, 50000, 500000]),
+                 'active': rng.random() < 0.3, 'exact': rng.random() < 0.3,
+                 'units': rng.choice(units) if units and rng.random() < 0.2 else None}
+        if query['k'] is None and query['radius'] is None:
+            query['k'] = DEFAULT_K
+        queries.append(query)
+    return queries
+
+
+def check_nearest_index(index_file, geojson_file, query_count=200):
+    """
+    Check that the index answers sample queries the same as a brute-force search of
+    the GeoJSON. Returns a list of mismatch descriptions.
+    """
+    with open(geojson_file, 'r', encoding='utf-8') as f:
+        features = json.load(f)['features']
+    index = NearestIndex.load(geojson_file, index_file)
+
+    mismatches = []
+    for query in sample_queries(features, query_count):
+        found = [(distance, feature_index) for distance, feature_index, _ in index.search(**query)]
+        expected = brute_force(features, **query)
+        if found != expected:
+            mismatches.append(f"Query {query}: index found {len(found)} courses, brute force found {len(expected)}"
+                              + (", in a different order" if len(found) == len(expected) else ""))
+    return mismatches
+
+
+def parse_query(parameters):
+    """
+    Search arguments from HTTP query parameters, as parsed by parse_qs. Raises
+    ValueError if they're missing or invalid.
+    """
+    def value(name, default=None):
+        return parameters.get(name, [default])[-1]
+
+    try:
+        lat = float(value('lat'))
+        lon = float(value('lon'))
+        k = int(value('k', DEFAULT_K)) if value('k') != '' else None
+        radius = float(value('radius')) if value('radius') else None
+    except (TypeError, ValueError):
+        raise ValueError("lat and lon are required, and lat, lon, k and radius must be numbers")
+    if not (-90 <= lat <= 90 and math.isfinite(lon)):
+        raise ValueError("lat must be between -90 and 90 and lon must be finite")
+    if (k is not None and k < 1) or (radius is not None and not radius >= 0) or (k is None and radius is None):
+        raise ValueError("k must be at least 1 and radius at least 0, and one of them must be given")
+    return {'lat': lat, 'lon': lon, 'k': k, 'radius': radius,
+            'active': value('active', '') in ('1', 'true'), 'exact': value('exact', '') in ('1', 'true'),
+            'units': value('units') or None}
+
+
+class NearestRequestHandler(BaseHTTPRequestHandler):
+    """
+    Answers GET /nearest?lat=&lon=&k=&radius=&active=1&exact=1&units= with JSON.
+    """
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path != '/nearest':
+            self.send_json(404, {'error': "Not found; query /nearest?lat=...&lon=..."})
+            return
+        try:
+            query = parse_query(parse_qs(url.query, keep_blank_values=True))
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+        self.send_json(200, {'results': self.server.index.nearest(**query)})
+
+    def send_json(self, status, body):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(content)
+
+
+def serve(index, host, port):
+    server = ThreadingHTTPServer((host, port), NearestRequestHandler)
+    server.index = index
+    print(f"Serving nearest-course queries at http://{host}:{server.server_port}/nearest?lat=...&lon=...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the calibration courses nearest a location.")
+    parser.add_argument("lat", type=float, nargs="?")
+    parser.add_argument("lon", type=float, nargs="?")
+    parser.add_argument("-k", type=int, default=DEFAULT_K,
+                        help=f"Number of courses to find (default: {DEFAULT_K}; 0 for all within the radius)")
+    parser.add_argument("--radius", type=float, help="Only find courses within this many meters")
+    parser.add_argument("--active", action="store_true", help="Only find courses that haven't expired")
+    parser.add_argument("--exact", action="store_true", help="Leave out courses at approximate locations")
+    parser.add_argument("--units", help="Only find courses measured in these units, such as m, km, mi or ft")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    parser.add_argument("--geojson", default="data/calibration_courses.geojson")
+    parser.add_argument("--index", default="data/.nearest_index",
+                        help="Index file, built from the GeoJSON if it's missing or out of date")
+    parser.add_argument("--serve", type=int, metavar="PORT", help="Answer queries over HTTP on this port")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to serve on (default: 127.0.0.1)")
+    parser.add_argument("--check", action="store_true",
+                        help="Check the index against a brute-force search of the GeoJSON")
+    parser.add_argument("--queries", type=int, default=200, help="Number of sample queries to check")
+    args = parser.parse_args()
+
+    if not Path(args.geojson).exists():
+        print(f"Error: '{args.geojson}' not found.")
+        exit(1)
+
+    if args.check:
+        mismatches = check_nearest_index(args.index, args.geojson, args.queries)
+        for mismatch in mismatches:
+            print(mismatch)
+        if mismatches:
+            exit(1)
+        print(f"Nearest-course index '{args.index}' matches a brute-force search of '{args.geojson}'.")
+        return
+
+    index = NearestIndex.load(args.geojson, args.index)
+    if args.serve is not None:
+        serve(index, args.host, args.serve)
+        return
+
+    if args.lat is None or args.lon is None:
+        parser.error("lat and lon are required unless --serve or --check is given")
+    if not -90 <= args.lat <= 90:
+        parser.error("lat must be between -90 and 90")
+    k = args.k or None
+    if k is None and args.radius is None:
+        parser.error("-k 0 needs --radius")
+
+    results = index.nearest(args.lat, args.lon, k, args.radius, args.active, args.exact, args.units)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    if not results:
+        print("No courses found.")
+    for number, result in enumerate(results, 1):
+        lon, lat = result['coordinates']
+        flags = [flag for flag in ('expired', 'approximate') if result.get(flag)]
+        print(f"{number:>3}. {result['distanceMeters'] / 1000:8.2f} km  {result['certificateId']}  "
+              f"{result['nameAbbreviated']}, {result['city']}, {result['state']}  "
+              f"({result['courseLength']} {result['units']})  {lat:.5f}, {lon:.5f}"
+              + (f"  [{', '.join(flags)}]" if flags else ""))
+
+
+if __name__ == "__main__":
+    main()
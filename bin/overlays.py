@@ -0,0 +1,240 @@
+"""
+Overlays of extra course data that patch the features converted from the sheet.
+
+An overlay is a GeoJSON file of features keyed by certificateId. The original
+data/additional_data.geojson is the first overlay, followed by any
+data/overlays/*.geojson in name order, and later overlays take precedence over
+earlier ones. Where two overlays have the same course, their properties are
+merged with the later overlay's values winning, and the later overlay's
+geometry replaces the earlier one's unless it's only a placeholder. Conflicts
+are tallied per pair of files rather than reported course by course.
+
+Each overlay's parsed features are cached along with the file's modification
+time, size and hash. An overlay whose modification time and size haven't
+changed isn't read at all, and one that was only touched is hashed but not
+parsed.
+Course lines from the overlays are measured here too, for the line collection
+and for checking them against the certified course lengths.
+"""
+import json
+import os
+from collections import Counter
+from pathlib import Path
+
+from course_store import file_hash
+from geodesy import Points, bearing_pairs, line_lengths, midpoint_pairs
+from metrics import Metrics
+
+OVERLAY_CACHE_VERSION = 1
+
+
+def overlay_files(additional_data_file, overlay_dir):
+    """
+    The overlay files that exist, lowest precedence first.
+    """
+    files = [Path(additional_data_file)] if Path(additional_data_file).exists() else []
+    return files + sorted(Path(overlay_dir).glob('*.geojson'))
+
+
+def is_placeholder(coordinates):
+    # Coordinates like [0, 0] are placeholders just to keep the GeoJSON valid
+    return bool(coordinates) and len(coordinates) == 2 and coordinates[0] == coordinates[1]
+
+
+def overlay_geometry(feature):
+    """
+    An overlay feature's geometry, without its coordinates if they're a placeholder.
+    """
+    geometry = feature['geometry']
+    if is_placeholder(geometry.get('coordinates')):
+        return {key: value for key, value in geometry.items() if key != 'coordinates'}
+    return geometry
+
+
+def has_coordinates(feature):
+    coordinates = (feature.get('geometry') or {}).get('coordinates')
+    return bool(coordinates) and not is_placeholder(coordinates)
+
+
+def is_measurable_line(feature):
+    geometry = feature.get('geometry') or {}
+    return geometry.get('type') == 'LineString' and has_coordinates(feature) and len(geometry['coordinates']) >= 2
+
+
+def measure_lines(line_features):
+    """
+    Measure each LineString feature that has real coordinates, returning for
+    each feature a dictionary of its length in meters, the bearing from its first
+    position to its last and the midpoint between them as [longitude, latitude],
+    or None if it can't be measured. All lines are measured in one batch.
+    """
+    measurable = [index for index, feature in enumerate(line_features) if is_measurable_line(feature)]
+    lines = [line_features[index]['geometry']['coordinates'] for index in measurable]
+    lengths = line_lengths(lines)
+
+    # The two endpoints of line k are points 2k and 2k + 1
+    endpoints = [position for line in lines for position in (line[0], line[-1])]
+    points = Points([position[1] for position in endpoints], [position[0] for position in endpoints])
+    pairs = [(2 * k, 2 * k + 1) for k in range(len(lines))]
+    bearings = bearing_pairs(points, pairs)
+    midpoint_lats, midpoint_lons = midpoint_pairs(points, pairs)
+
+    measurements = [None] * len(line_features)
+    for k, index in enumerate(measurable):
+        measurements[index] = {
+            'lineLengthMeters': round(lengths[k], 2),
+            'bearing': round(bearings[k], 1),
+            'midpoint': [round(midpoint_lons[k], 7), round(midpoint_lats[k], 7)]
+        }
+    return measurements
+
+
+def add_line_measurements(line_features):
+    """
+    Return copies of the line features with their measurements added to their
+    properties, so the page doesn't have to compute them.
+    """
+    return [{**feature, 'properties': {**feature.get('properties', {}), **measurement}} if measurement else feature
+            for feature, measurement in zip(line_features, measure_lines(line_features))]
+
+
+def parse_overlay(overlay_file):
+    """
+    Load an overlay as a dictionary mapping certificateId to feature. Features
+    without a certificateId are dropped, and a later feature with the same
+    certificateId replaces an earlier one.
+    """
+    with open(overlay_file, 'r', encoding='utf-8') as f:
+        overlay = json.load(f)
+
+    features = {}
+    for feature in overlay.get('features', []):
+        cert_id = feature.get('properties', {}).get('certificateId')
+        if cert_id:
+            features[cert_id] = feature
+    return features
+
+
+class OverlayCache:
+    """
+    Parsed overlays from the last run, saved as a header line and then a line per
+    overlay of path, modification time, size and SHA-256, followed by the parsed
+    features as JSON. Only the lines of overlays that are reused get decoded.
+    """
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        # Path to (modification time, size, SHA-256, features JSON) from the last run
+        self.entries = {}
+        # The same for the overlays loaded this run, which is all that gets saved
+        self.used = {}
+        if cache_file:
+            self.entries = self._read(cache_file)
+
+    @staticmethod
+    def _read(cache_file):
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline())
+                if header.get('version') != OVERLAY_CACHE_VERSION:
+                    return {}
+                entries = {}
+                for line in f:
+                    path, mtime_ns, size, sha256, features_json = line.rstrip('\n').split('\t', 4)
+                    entries[path] = (int(mtime_ns), int(size), sha256, features_json)
+                return entries
+        except (OSError, ValueError):
+            return {}
+
+    def features(self, overlay_file, metrics):
+        """
+        The overlay's features as parse_overlay would return them, from the cache if
+        the file is unchanged.
+        """
+        path = str(overlay_file)
+        stat = os.stat(overlay_file)
+        cached = self.entries.get(path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            self.used[path] = cached
+            metrics.count('overlays_reused_from_cache')
+            return json.loads(cached[3])
+
+        sha256 = file_hash(overlay_file).hex()
+        if cached and cached[2] == sha256:
+            self.used[path] = (stat.st_mtime_ns, stat.st_size, sha256, cached[3])
+            metrics.count('overlays_reused_from_cache')
+            return json.loads(cached[3])
+
+        features = parse_overlay(overlay_file)
+        self.used[path] = (stat.st_mtime_ns, stat.st_size, sha256, json.dumps(features, separators=(',', ':')))
+        metrics.count('overlays_parsed')
+        return features
+
+    def save(self):
+        if not self.cache_file:
+            return
+        with open(f"{self.cache_file}.tmp", 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'version': OVERLAY_CACHE_VERSION}) + '\n')
+            for path, (mtime_ns, size, sha256, features_json) in self.used.items():
+                f.write(f"{path}\t{mtime_ns}\t{size}\t{sha256}\t{features_json}\n")
+        os.replace(f"{self.cache_file}.tmp", self.cache_file)
+
+
+def merge_overlay_features(earlier, later):
+    """
+    Merge a later overlay's feature for a course over an earlier overlay's.
+    Returns the merged feature and which of 'geometry' and 'properties' the
+    two disagreed on. Neither feature is modified.
+    """
+    differences = []
+    if has_coordinates(earlier) and has_coordinates(later) and earlier['geometry'] != later['geometry']:
+        differences.append('geometry')
+
+    earlier_properties = earlier.get('properties', {})
+    later_properties = later.get('properties', {})
+    if any(earlier_properties[key] != value for key, value in later_properties.items() if key in earlier_properties):
+        differences.append('properties')
+
+    merged = {**earlier, **later, 'properties': {**earlier_properties, **later_properties}}
+    # A placeholder doesn't replace real coordinates
+    if 'geometry' in earlier and not has_coordinates(later) and (has_coordinates(earlier) or 'geometry' not in later):
+        merged['geometry'] = earlier['geometry']
+    return merged, differences
+
+
+def load_overlays(files, cache=None, metrics=None):
+    """
+    Merge overlays, lowest precedence first, into one dictionary mapping
+    certificateId to feature. Returns it along with a Counter of conflicts keyed
+    by (earlier file, later file, 'geometry' or 'properties').
+    """
+    cache = cache or OverlayCache()
+    metrics = metrics or Metrics()
+
+    merged = {}
+    # The file each course's merged feature was last patched by
+    sources = {}
+    conflicts = Counter()
+    for overlay_file in files:
+        for cert_id, feature in cache.features(overlay_file, metrics).items():
+            if cert_id in merged:
+                merged[cert_id], differences = merge_overlay_features(merged[cert_id], feature)
+                for difference in differences:
+                    conflicts[(sources[cert_id], str(overlay_file), difference)] += 1
+                metrics.count('overlay_courses_merged')
+            else:
+                merged[cert_id] = feature
+            sources[cert_id] = str(overlay_file)
+    return merged, conflicts
+
+
+def describe_conflicts(conflicts):
+    """
+    One line per pair of overlays that disagreed, saying how many courses' geometry
+    or properties the later one overrode.
+    """
+    pairs = {}
+    for (earlier, later, difference), count in sorted(conflicts.items()):
+        pairs.setdefault((earlier, later), []).append(f"{difference} of {count} course{'s' if count != 1 else ''}")
+    return [f"'{later}' overrode {' and '.join(overridden)} from '{earlier}'"
+            for (earlier, later), overridden in pairs.items()]
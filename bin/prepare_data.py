@@ -1,234 +1,370 @@
 #!/usr/bin/env python3
-import csv
+import argparse
+import cProfile
+import hashlib
+import heapq
+import multiprocessing
+from contextlib import ExitStack
+from functools import partial
+from itertools import chain, islice
 from pathlib import Path
 import re
 import json
 import os
+import tempfile
+import time
 from datetime import datetime, timezone
 
+import course_records
+import course_store
+import names
+from artifacts import finalize_artifacts
+from clusters import ClusterBuilder, write_cluster_levels
+from course_columns import ColumnWriter
+from course_records import intern_value
+from course_store import CourseStore, extract_url_from_anchor, file_hash
+from lint_tsv import lint_tsv
+from metrics import Metrics
+from names import normalize
+from nearest import NearestIndexBuilder
+from overlays import (OverlayCache, add_line_measurements, describe_conflicts, load_overlays, overlay_files,
+                      overlay_geometry)
+from search_index import SearchIndexBuilder
+from summary import SummaryBuilder
+from watch import InputWatcher
+
+# Features sorted in memory at once before spilling sorted runs to disk
+SORT_RUN_SIZE = 100000
+# Rows sent to a worker process at a time in parallel mode
+CONVERT_CHUNK_SIZE = 1000
+
+CERTIFICATE_YEAR_PATTERN = re.compile(r'^[A-Za-z]+([0-9]{2})')
+
+
+def row_to_feature(row):
+    name = row['Name'].replace(' (EXPIRED)','')
+    name_abbreviated = normalize(name)
+    return {
+        "type": "Feature",
+        "geometry": {
+            "type": "Point",
+            "coordinates": [
+                float(row['Longitude']),  # Note longitude comes first in GeoJSON
+                float(row['Latitude'])
+            ]
+        },
+        "properties": {
+            "certificateId": row['CourseID'],
+            "name": name,
+            "nameAbbreviated": name_abbreviated,
+            # Shared by many courses, so each feature held in memory refers to one copy
+            "city": intern_value(row['City']),
+            "state": intern_value(row['State']),
+            "courseLength": float(row['Dist'].replace(",", "")),
+            "units": intern_value(row['Units'].lower()),
+            "measurer": intern_value(row['Measurer']),
+            "certificateLink": extract_url_from_anchor(row['Certificate URL']),
+            "approximate": row['Color'] == 'PURPLE'
+        }
+    }
 
-def extract_url_from_anchor(html_string):
-    pattern = r"<a\s+(?:[^>]*?\s+)?href=['\"]([^'\"]*)['\"]"
-    match = re.search(pattern, html_string)
-
-    if match:
-        return match.group(1)
-    return None
-
-
-def remove_calibration_references(text):
-    # Pattern to match various forms of calibration course references
-    calibration_pattern = r'\s+-?\s*(?:calibration\s+courses?|calibration|cal\.?\s*courses?|cal\s+crses?)'
-
-    # Remove all matches from the text
-    result = re.sub(calibration_pattern, '', text, flags=re.IGNORECASE)
-
-    return result
-
-
-def remove_measurements(text):
-    # Pattern to match:
-    # 1. Optional whitespace
-    # 2. Optional hyphen with optional surrounding whitespace
-    # 3. Digits with optional decimal portion OR fractions
-    # 4. Unit (m, ft, mi, km)
-
-
-    measurement_pattern = r'\s*(?:\s*-\s*)?(?:\d+(?:\.\d+)?|\d+\s*/\s*\d+)(?:\s*(?:m|ft|mi|km)\b)'
-
-    # Remove all matches
-    result = re.sub(measurement_pattern, '', text, flags=re.IGNORECASE)
-    return result
-
-
-def format_measurements(text):
-    # Pre-process text representations of fractions
-    # Handle "Quarter Mile", "Half Mile", "A Quarter Mile", "One Half Mile" etc.
-    # Look ahead for mile/miler/mi to avoid replacing "Half" in "Half Moon Bay"
-    text = re.sub(r'\b(?:one\s+|a\s+)?quarter[\s-]*(?=mil(?:e|er)s?|mi\b)', '1/4 ', text, flags=re.IGNORECASE)
-    text = re.sub(r'\b(?:one\s+|a\s+)?half[\s-]*(?=mil(?:e|er)s?|mi\b)', '1/2 ', text, flags=re.IGNORECASE)
 
-    # Number pattern: Digits with optional decimal portion OR fractions
-    number_pattern = r'(\d+(?:\.\d+)?|\d+\s*/\s*\d+)'
+def convert_rows(rows):
+    """
+    Convert a chunk of rows in a worker process. Returns a (feature, error message)
+    pair for each row, so errors can be reported in sheet order by the parent.
+    """
+    results = []
+    for row in rows:
+        try:
+            results.append((row_to_feature(row), None))
+        except (ValueError, KeyError) as e:
+            results.append((None, str(e)))
+    return results
 
-    # Pattern 1: Numbers followed by optional space/dash then metric units
-    pattern_metric = number_pattern + r'[ \s-]?(meters?|mtr|m)\b'
 
-    # Pattern 2: Numbers followed by various feet indicators
-    pattern_feet = number_pattern + r'[ \s-]?(?:(?:feet|foot|ft\.?)\b|\')'
+def row_hash(row):
+    return hashlib.sha256(repr(list(row.items())).encode('utf-8')).hexdigest()
 
-    # Pattern 3: Numbers followed by mile indicators
-    pattern_mile = number_pattern + r'[ \s-]?(?:miles?|milers?|mi)\b'
 
+def feature_cache_version():
+    """
+    Hash the code that turns a row into a feature, so any change to it invalidates the cache.
+    """
+    digest = hashlib.sha256()
+    for module_file in (__file__, names.__file__, course_store.__file__, course_records.__file__):
+        digest.update(Path(module_file).read_bytes())
+    return digest.hexdigest()
 
-    def clean_number(num_str):
-        # Remove spaces in fractions
-        return re.sub(r'\s+', '', num_str)
 
+def load_feature_cache(cache_file):
+    """
+    Load the row hash to feature JSON cache written by a previous run. Returns an
+    empty cache if there isn't one or it was written by different code.
+    """
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+            if header.get('version') != feature_cache_version():
+                print(f"Feature cache '{cache_file}' is out of date. Rebuilding all rows.")
+                return {}
+            return dict(line.rstrip('\n').split('\t', 1) for line in f)
+    except (OSError, ValueError):
+        return {}
+
+
+def convert_serially(rows, metrics):
+    """
+    Convert each (row, cache key, cached feature JSON) whose feature isn't cached,
+    generating (cache key, cached feature JSON, feature, error) in order.
+    """
+    for row, key, feature_json in rows:
+        feature = error = None
+        if feature_json is None:
+            try:
+                with metrics.stage('normalize', items=1):
+                    feature = row_to_feature(row)
+            except (ValueError, KeyError) as e:
+                error = e
+        yield key, feature_json, feature, error
 
-    def replace_metric(match):
-        return f"{clean_number(match.group(1))}m"
 
-    def replace_feet(match):
-        return f"{clean_number(match.group(1))}ft"
+def convert_in_parallel(rows, jobs, metrics):
+    """
+    Like convert_serially, but with the rows converted in chunks by a pool of
+    worker processes. Results come back in the order the rows went in.
+    """
+    with multiprocessing.Pool(jobs) as pool:
+        while True:
+            # Enough chunks to keep every worker busy, converted in one round trip
+            window = list(islice(rows, CONVERT_CHUNK_SIZE * jobs * 4))
+            if not window:
+                return
+            pending = [dict(row.items()) for row, key, feature_json in window if feature_json is None]
+            chunks = [pending[start:start + CONVERT_CHUNK_SIZE] for start in range(0, len(pending), CONVERT_CHUNK_SIZE)]
+            with metrics.stage('normalize', items=len(pending)):
+                results = chain.from_iterable(pool.map(convert_rows, chunks, chunksize=1))
+            for row, key, feature_json in window:
+                feature, error = next(results) if feature_json is None else (None, None)
+                yield key, feature_json, feature, error
+
+
+def read_features(courses, feature_cache=None, cache_file=None, metrics=None, jobs=1):
+    """
+    Generate a feature for each usable row of the course sheet (a CourseStore or
+    any iterable of rows keyed by column), in sheet order.
+
+    Rows whose content hash is in feature_cache (row hash to feature JSON) reuse
+    the cached feature instead of being converted again. If cache_file is given,
+    a new cache holding exactly the rows of this sheet is written there once
+    every row has been read. With more than one job, rows are converted in that
+    many worker processes, with the same features and error messages.
+    """
+    metrics = metrics or Metrics()
+    feature_cache = feature_cache or {}
+    cache_out = None
+    if cache_file:
+        cache_out = open(f"{cache_file}.tmp", 'w', encoding='utf-8')
+        cache_out.write(json.dumps({'version': feature_cache_version()}) + '\n')
+
+    def usable_rows():
+        for row in courses:
+            if not row.get('Latitude') or not row.get('Longitude'):
+                metrics.count('rows_without_coordinates')
+                continue
+            key = row_hash(row) if feature_cache or cache_out else None
+            yield row, key, feature_cache.get(key)
 
-    def replace_mile(match):
-        return f"{clean_number(match.group(1))}mi"
-    # Apply transformations
-    result = re.sub(pattern_metric, replace_metric, text, flags=re.IGNORECASE)
+    if jobs > 1:
+        conversions = convert_in_parallel(usable_rows(), jobs, metrics)
+    else:
+        conversions = convert_serially(usable_rows(), metrics)
+
+    for key, feature_json, feature, error in conversions:
+        if feature_json is not None:
+            feature = json.loads(feature_json)
+            metrics.count('rows_reused_from_cache')
+        elif error is not None:
+            print(f"Skipping row due to error: {error}")
+            metrics.count('rows_skipped')
+            continue
+        else:
+            metrics.count('rows_converted')
 
-    result = re.sub(pattern_feet, replace_feet, result, flags=re.IGNORECASE)
+        if cache_out:
+            cache_out.write(f"{key}\t{feature_json or json.dumps(feature)}\n")
+        yield feature
 
-    result = re.sub(pattern_mile, replace_mile, result, flags=re.IGNORECASE)
-    return result
+    if cache_out:
+        cache_out.close()
+        os.replace(f"{cache_file}.tmp", cache_file)
+    if feature_cache:
+        print(f"Reused {metrics.counters['rows_reused_from_cache']} cached features, "
+              f"converted {metrics.counters['rows_converted']} rows.")
 
 
-def standardize_road_types(text):
-    # Dictionary of full road types to their abbreviations
-    road_types = {
-        'avenue': 'Ave',
-        'boulevard': 'Blvd',
-        'circle': 'Cir',
-        'court': 'Ct',
-        'drive': 'Dr',
-        'expressway': 'Expy',
-        'freeway': 'Fwy',
-        'highway': 'Hwy',
-        'lane': 'Ln',
-        'parkway': 'Pkwy',
-        'place': 'Pl',
-        'road': 'Rd',
-        'square': 'Sq',
-        'street': 'St',
-        'terrace': 'Ter',
-        # 'trail': 'Trl',
-        'turnpike': 'Tpke',
-        'way': 'Way'
+def sort_features(features, run_size=SORT_RUN_SIZE):
+    """
+    Sort features by certificateId, holding at most run_size of them in memory.
+    Sorted runs beyond that are spilled to temporary files as JSON lines and merged.
+    The sort is stable, like list.sort.
+    """
+    def key(feature):
+        return feature["properties"]["certificateId"]
+
+    with ExitStack() as stack:
+        runs = []
+        run = []
+        for feature in features:
+            run.append(feature)
+            if len(run) >= run_size:
+                run.sort(key=key)
+                run_file = stack.enter_context(tempfile.TemporaryFile('w+', encoding='utf-8'))
+                run_file.writelines(json.dumps(feature) + '\n' for feature in run)
+                run_file.seek(0)
+                runs.append(map(json.loads, run_file))
+                run = []
+        run.sort(key=key)
+        # heapq.merge breaks ties by run order, and the in-memory run holds the last rows
+        yield from heapq.merge(*runs, run, key=key)
+
+
+def tsv_to_geojson(input_file, feature_cache=None, cache_file=None, jobs=1):
+    """
+    Convert the course sheet to a GeoJSON FeatureCollection sorted by certificateId.
+    """
+    features = read_features(CourseStore.from_tsv(input_file), feature_cache, cache_file, jobs=jobs)
+    return {
+        "type": "FeatureCollection",
+        "features": list(sort_features(features))
     }
 
-    # Create regex pattern for all road types
-    # Format is: word boundary + road type + word boundary
-    # Using alternation for all road types, longest first to avoid partial matches
-    # Sort by length (descending) to match longest terms first
-    sorted_types = sorted(road_types.keys(), key=len, reverse=True)
-    pattern = r'\b(' + '|'.join(sorted_types) + r')\b'
 
-    # Case-insensitive replacement function
-    def replace_road_type(match):
-        road_type = match.group(1).lower()
-        return road_types[road_type]
+def add_to_index(properties, states, locations):
+    """
+    Add a course's state and its city and state to the sets for the course index.
+    """
+    if properties.get('state'):
+        states.add(properties['state'])
 
-    # Apply the transformation
-    result = re.sub(pattern, replace_road_type, text, flags=re.IGNORECASE)
+    if properties.get('city') and properties.get('state'):
+        locations.add(properties['city'] + ', ' + properties['state'])
 
-    return remove_unnecessary_periods(result)
 
+def add_derived_properties(features, build_year, states, locations):
+    """
+    Add the properties the page would otherwise derive on every load: the year
+    from the certificateId, whether the course had expired as of build_year, and
+    the course length in meters. The states and locations seen are added to the
+    given sets for the course index.
+    """
+    for feature in features:
+        properties = feature['properties']
+        add_to_index(properties, states, locations)
 
-def remove_unnecessary_periods(text):
-    # Pattern for compass directions with periods
-    # Matches N., S., E., W., NE., NW., SE., SW.
-    compass_pattern = r'\b([NSEW]|NE|NW|SE|SW)\.(?!\w)'
+        # Extract the first two digits after any letters at the beginning
+        year_match = CERTIFICATE_YEAR_PATTERN.match(properties.get('certificateId', ''))
+        if year_match:
+            course_year = int("20" + year_match.group(1))
+            properties['year'] = course_year
+            properties['expired'] = build_year > course_year + 10
 
-    # Pattern for road type abbreviations with periods
-    # These match common abbreviated road types with periods
-    abbrev_pattern = r'\b(Ave|Blvd|Cir|Ct|Dr|Expy|Fwy|Hwy|Ln|Pkwy|Pl|Rd|Sq|St|Ter|Trl|Tpke|Way)\.(?!\w)'
+        if 'courseLength' in properties:
+            properties['courseLengthMeters'] = properties['courseLength']
+            if properties.get('units') == 'ft':
+                properties['courseLengthMeters'] = properties['courseLength'] * .3048
 
-    # Remove periods from compass directions
-    result = re.sub(compass_pattern, r'\1', text)
+        yield feature
 
-    # Remove periods from abbreviations
-    result = re.sub(abbrev_pattern, r'\1', result)
 
-    return result
+def round_coordinates(coordinates, precision):
+    if isinstance(coordinates, list):
+        return [round_coordinates(coordinate, precision) for coordinate in coordinates]
+    return round(coordinates, precision)
 
 
-def tsv_to_geojson(input_file):
-    geojson = {
-        "type": "FeatureCollection",
-        "features": []
-    }
+def encode_feature(feature, compact=False, precision=None):
+    """
+    A feature's JSON as write_feature_collection writes it, without the separator
+    before it.
+    """
+    if precision is not None and 'coordinates' in feature.get('geometry', {}):
+        geometry = feature['geometry']
+        feature = {**feature, 'geometry': {**geometry, 'coordinates': round_coordinates(geometry['coordinates'], precision)}}
 
-    with open(input_file, 'r', encoding='utf-8') as tsv_file:
-        reader = csv.DictReader(tsv_file, delimiter='\t')
+    if compact:
+        # Sorted keys, so the bytes don't depend on which path built the feature
+        return json.dumps(feature, separators=(',', ':'), sort_keys=True)
+    # Indent each feature to its depth inside the collection
+    return json.dumps(feature, indent=2).replace('\n', '\n    ')
 
-        for row in reader:
-            if not row.get('Latitude') or not row.get('Longitude'):
-                continue
 
-            try:
-                name = row['Name'].replace(' (EXPIRED)','')
-                name_abbreviated = name
-                name_abbreviated = remove_calibration_references(name_abbreviated)
-                name_abbreviated = name_abbreviated.replace(" yards", "yd")
-                name_abbreviated = format_measurements(name_abbreviated)
-                name_abbreviated = remove_measurements(name_abbreviated)
-                # Remove empty parentheses or - () that might be left over
-                name_abbreviated = re.sub(r'\s*(?:-\s*)?\(\s*\)', '', name_abbreviated)
-                name_abbreviated = standardize_road_types(name_abbreviated)
-                # Clean up any extra spaces
-                name_abbreviated = re.sub(r'\s+', ' ', name_abbreviated).strip()
-                feature = {
-                    "type": "Feature",
-                    "geometry": {
-                        "type": "Point",
-                        "coordinates": [
-                            float(row['Longitude']),  # Note longitude comes first in GeoJSON
-                            float(row['Latitude'])
-                        ]
-                    },
-                    "properties": {
-                        "certificateId": row['CourseID'],
-                        "name": name,
-                        "nameAbbreviated": name_abbreviated,
-                        "city": row['City'],
-                        "state": row['State'],
-                        "courseLength": float(row['Dist'].replace(",", "")),
-                        "units": row['Units'].lower(),
-                        "measurer": row['Measurer'],
-                        "certificateLink": extract_url_from_anchor(row['Certificate URL']),
-                        "approximate": row['Color'] == 'PURPLE'
-                    }
-                }
+def write_encoded_features(encoded_features, output_file, compact=False):
+    """
+    Write features already encoded by encode_feature as a FeatureCollection. The
+    file is written under a temporary name and renamed into place, so it's never
+    read half-written. Returns the number of features written.
+    """
+    count = 0
+    with open(f"{output_file}.tmp", 'w', encoding='utf-8') as f:
+        if compact:
+            f.write('{"type":"FeatureCollection","features":[')
+        else:
+            f.write('{\n  "type": "FeatureCollection",\n  "features": [')
+
+        for encoded in encoded_features:
+            if compact:
+                f.write((',' if count else '') + encoded)
+            else:
+                f.write((',' if count else '') + '\n    ' + encoded)
+            count += 1
+
+        if compact:
+            f.write(']}')
+        elif count:
+            f.write('\n  ]\n}')
+        else:
+            f.write(']\n}')
+    os.replace(f"{output_file}.tmp", output_file)
+    return count
 
-                geojson["features"].append(feature)
 
-            except (ValueError, KeyError) as e:
-                print(f"Skipping row due to error: {e}")
-                continue
+def write_feature_collection(features, output_file, compact=False, precision=None):
+    """
+    Stream features to a GeoJSON FeatureCollection file without building the collection.
 
-    # Sort features by certificateId
-    geojson["features"].sort(key=lambda x: x["properties"]["certificateId"])
-    return geojson
+    Readable output is byte-identical to json.dump(collection, f, indent=2). Compact
+    output has no whitespace and sorted keys, and if precision is given, coordinates
+    are rounded to that many decimal places. Returns the number of features written.
+    """
+    return write_encoded_features((encode_feature(feature, compact, precision) for feature in features),
+                                  output_file, compact)
 
 
-def patch_geojson_with_additional_data(original_geojson, additional_data_file):
+def write_json(data, output_file):
     """
-    Patch the original GeoJSON with data from an additional GeoJSON file.
-    Don't patch over the geometry if types don't match.
-    Extract LineString geometries to a separate collection.
+    Write data as indented JSON under a temporary name, then rename it into place.
     """
-    # Load the additional data
-    with open(additional_data_file, 'r', encoding='utf-8') as f:
-        additional_data = json.load(f)
+    with open(f"{output_file}.tmp", 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(f"{output_file}.tmp", output_file)
 
-    # Create a new GeoJSON for LineString features
-    line_geojson = {
-        "type": "FeatureCollection",
-        "features": []
-    }
 
-    # Create a dictionary mapping certificateId to the additional feature for quick lookup
-    additional_features_dict = {}
-    for feature in additional_data.get('features', []):
-        cert_id = feature.get('properties', {}).get('certificateId')
-        if cert_id:
-            additional_features_dict[cert_id] = feature
+def patch_features(features, additional_features_dict, line_features, metrics=None):
+    """
+    Patch a stream of features with additional features, yielding each one as it's patched,
+    followed by any additional point features that weren't in the stream.
+    Don't patch over the geometry if types don't match.
+    LineString geometries are appended to line_features instead.
+    What was patched is tallied in the metrics' counters.
+    """
+    metrics = metrics or Metrics()
 
     # Keep track of which additional features we've processed
     processed_additional_ids = set()
 
     # Update the original features with the additional data
-    for feature in original_geojson.get('features', []):
+    for feature in features:
         cert_id = feature.get('properties', {}).get('certificateId')
 
         if cert_id and cert_id in additional_features_dict:
@@ -238,22 +374,20 @@ def patch_geojson_with_additional_data(original_geojson, additional_data_file):
             additional_geom_type = additional_feature.get('geometry', {}).get('type')
             original_geom_type = feature.get('geometry', {}).get('type')
 
-            new_coordinates = additional_feature['geometry'].get('coordinates', None)
-            if new_coordinates and len(new_coordinates) == 2 and new_coordinates[0] == new_coordinates[1]:
-                # If the coordinates are the same, remove them. They're placeholders just to keep the geojson valid
-                del additional_feature['geometry']['coordinates']
+            # Placeholder coordinates are left out, without changing the shared additional feature
+            additional_geometry = overlay_geometry(additional_feature)
 
             # If the additional feature has a LineString geometry, add it to the line collection
             if additional_geom_type == 'LineString':
                 # Create a new feature for the line collection
                 line_feature = {
                     "type": "Feature",
-                    "geometry": additional_feature['geometry'],
+                    "geometry": additional_geometry,
                     "properties": {"certificateId": cert_id}
                 }
 
                 # Compute the point by averaging the coordinates
-                coords = additional_feature['geometry'].get('coordinates', None)
+                coords = additional_geometry.get('coordinates', None)
                 if coords:
                     avg_longitude = sum(coord[0] for coord in coords) / len(coords)
                     avg_latitude = sum(coord[1] for coord in coords) / len(coords)
@@ -265,22 +399,24 @@ def patch_geojson_with_additional_data(original_geojson, additional_data_file):
                     for prop_key, prop_value in additional_feature['properties'].items():
                         line_feature['properties'][prop_key] = prop_value
 
-                line_geojson['features'].append(line_feature)
-                print(f"Added LineString geometry for certificateId: {cert_id} to line collection")
+                line_features.append(line_feature)
+                metrics.count('patch_line_geometries_added')
 
             # Update geometry only if types match
             elif 'geometry' in additional_feature and additional_geom_type == original_geom_type:
-                feature['geometry'] = {**feature['geometry'], **additional_feature['geometry']}
-                print(f"Updated geometry for certificateId: {cert_id} (type: {original_geom_type})")
+                feature['geometry'] = {**feature['geometry'], **additional_geometry}
+                metrics.count('patch_geometries_updated')
 
             # Always update properties
             if 'properties' in additional_feature:
                 for prop_key, prop_value in additional_feature['properties'].items():
                     feature['properties'][prop_key] = prop_value
-                print(f"Updated properties for certificateId: {cert_id}")
+                metrics.count('patch_properties_updated')
 
             processed_additional_ids.add(cert_id)
 
+        yield feature
+
     # Add any new features from additional data that weren't in the original
     for cert_id, feature in additional_features_dict.items():
         if cert_id in processed_additional_ids:
@@ -290,66 +426,487 @@ def patch_geojson_with_additional_data(original_geojson, additional_data_file):
 
         # Add LineString features to the line collection
         if geom_type == 'LineString':
-            line_geojson['features'].append(feature)
-            print(f"Added new LineString feature with certificateId: {cert_id} to line collection")
+            line_features.append(feature)
+            metrics.count('patch_new_lines_added')
         # Add other types to the original collection
         elif ('geometry' in feature and
               feature['geometry'].get('type') and
               'coordinates' in feature['geometry']):
-            original_geojson['features'].append(feature)
-            print(f"Added new feature with certificateId: {cert_id} to original collection")
+            metrics.count('patch_new_features_added')
+            yield feature
         else:
-            print(f"Skipped adding new feature with certificateId: {cert_id} - incomplete geometry")
+            metrics.count('patch_new_features_skipped')
+
+
+def patch_geojson_with_additional_data(original_geojson, additional_data_files):
+    """
+    Patch the original GeoJSON with data from additional GeoJSON files, later
+    files taking precedence. Don't patch over the geometry if types don't match.
+    Extract LineString geometries to a separate collection.
+    """
+    # Create a new GeoJSON for LineString features
+    line_geojson = {
+        "type": "FeatureCollection",
+        "features": []
+    }
+
+    additional_features_dict, _ = load_overlays(additional_data_files)
+    original_geojson['features'] = list(patch_features(original_geojson.get('features', []),
+                                                       additional_features_dict, line_geojson['features']))
 
     return original_geojson, line_geojson
 
 
+def copy_feature(feature):
+    """
+    A copy of a feature that can be patched and given derived properties without
+    changing the original.
+    """
+    copy = dict(feature)
+    for key in ('geometry', 'properties'):
+        if isinstance(copy.get(key), dict):
+            copy[key] = dict(copy[key])
+    return copy
+
+
+class DerivedOutputs:
+    """
+    The outputs built from the finished features alongside the GeoJSON: the
+    columnar export, cluster levels, search index, summary and nearest-course index.
+    """
+
+    def __init__(self, columns_file, clusters_dir, search_dir, summary_file, nearest_index_file, precision=None):
+        self.columns_file = columns_file
+        self.clusters_dir = clusters_dir
+        self.search_dir = search_dir
+        self.summary_file = summary_file
+        self.nearest_index_file = nearest_index_file
+        self.columns = ColumnWriter()
+        self.clusters = ClusterBuilder()
+        self.search_index = SearchIndexBuilder()
+        self.summary = SummaryBuilder()
+        self.nearest_index = NearestIndexBuilder(precision=precision)
+
+    def collect(self, features, metrics):
+        """
+        Add each feature of a stream to every output as it passes through.
+        """
+        features = metrics.stream('columns', self.columns.collect(features))
+        features = metrics.stream('clusters', self.clusters.collect(features))
+        features = metrics.stream('search_index', self.search_index.collect(features))
+        features = metrics.stream('summary', self.summary.collect(features))
+        return metrics.stream('nearest_index', self.nearest_index.collect(features))
+
+    def write(self, build_year, geojson_file, metrics):
+        with metrics.stage('columns'):
+            self.columns.write(self.columns_file)
+        print(f"Columnar export written to {self.columns_file}")
+
+        with metrics.stage('clusters'):
+            write_cluster_levels(self.clusters.build(), self.clusters_dir)
+        print(f"Cluster levels written to {self.clusters_dir}")
+
+        with metrics.stage('search_index'):
+            shard_count = self.search_index.write(self.search_dir)
+        print(f"Search index written to {self.search_dir} ({shard_count} shards)")
+
+        with metrics.stage('summary'):
+            self.summary.write(self.summary_file, build_year)
+        print(f"Summary written to {self.summary_file}")
+
+        # Tied to the GeoJSON it indexes, so bin/nearest.py can tell if it's out of date
+        with metrics.stage('nearest_index'):
+            cell_count = self.nearest_index.write(self.nearest_index_file, file_hash(geojson_file))
+        print(f"Nearest-course index written to {self.nearest_index_file} ({cell_count} cells)")
+
+
+class IncrementalMapBuilder:
+    """
+    The map data kept in memory by --watch, so a change to the sheet or to an
+    overlay only converts the rows, and patches the features, that it affects.
+
+    Each distinct row of the sheet is converted once, and its unpatched feature
+    kept by the row's values, normalized name and all. Each finished feature is
+    kept along with its encoded JSON, and reused for as long as its row, the
+    overlay feature for its certificateId and the build year stay the same. The
+    features come out the same, in the same order, as a full build's.
+    """
+
+    def __init__(self, input_file, additional_data_file, overlay_dir, overlay_cache_file, output_options):
+        self.input_file = input_file
+        self.additional_data_file = additional_data_file
+        self.overlay_dir = overlay_dir
+        self.overlay_cache_file = overlay_cache_file
+        self.output_options = output_options
+
+        # The sheet as last read, and its column names, which rows are only comparable under
+        self.courses = None
+        self.column_names = None
+        # Row values to unpatched feature, or None if the row couldn't be converted
+        self.converted = {}
+        # (row values, unpatched feature) of each usable row, sorted by certificateId
+        self.rows = []
+        # The overlay files as last read, and their merged features by certificateId
+        self.overlays = []
+        self.overlay_features = {}
+        # Row values to (finished feature, encoded feature, line features) for build_year
+        self.finished = {}
+        self.build_year = None
+
+    def inputs(self):
+        """
+        The files the map data is built from.
+        """
+        return [self.input_file] + overlay_files(self.additional_data_file, self.overlay_dir)
+
+    def read_sheet(self, metrics):
+        """
+        Parse the sheet again, converting only the rows that aren't in memory yet.
+        """
+        courses = CourseStore.from_tsv(self.input_file)
+        column_names = list(courses.columns)
+        previous = self.converted if column_names == self.column_names else {}
+        converted = {}
+        rows = []
+        # Rows without both coordinates aren't usable, as in read_features
+        if 'Latitude' in column_names and 'Longitude' in column_names:
+            latitude, longitude = column_names.index('Latitude'), column_names.index('Longitude')
+            # Much quicker a column at a time than going through each row's columns
+            for index, values in enumerate(zip(*courses.columns.values())):
+                if not values[latitude] or not values[longitude]:
+                    continue
+                if values in converted:
+                    feature = converted[values]
+                elif values in previous:
+                    feature = previous[values]
+                else:
+                    try:
+                        with metrics.stage('normalize', items=1):
+                            feature = row_to_feature(courses.row(index))
+                        metrics.count('rows_converted')
+                    except (ValueError, KeyError) as e:
+                        print(f"Skipping row due to error: {e}")
+                        feature = None
+                converted[values] = feature
+                if feature is not None:
+                    rows.append((values, feature))
+        rows.sort(key=lambda row: row[1]['properties']['certificateId'])
+        self.courses, self.column_names, self.converted, self.rows = courses, column_names, converted, rows
+
+    def read_overlays(self, metrics):
+        """
+        Load the overlays again, returning the certificateIds whose merged overlay
+        feature was added, removed or changed.
+        """
+        overlays = overlay_files(self.additional_data_file, self.overlay_dir)
+        overlay_cache = OverlayCache(self.overlay_cache_file)
+        overlay_features, conflicts = load_overlays(overlays, overlay_cache, metrics)
+        overlay_cache.save()
+        for conflict in describe_conflicts(conflicts):
+            print(f"Overlay conflict: {conflict}")
+
+        changed = {cert_id for cert_id in overlay_features.keys() | self.overlay_features.keys()
+                   if overlay_features.get(cert_id) != self.overlay_features.get(cert_id)}
+        self.overlays, self.overlay_features = overlays, overlay_features
+        return changed
+
+    def build(self, build_year, changed_ids=frozenset()):
+        """
+        Finish the features for build_year, patching only those that are new or
+        whose certificateId is in changed_ids. Returns the finished features, their
+        encodings, the measured line features, and the states and locations for
+        the course index.
+        """
+        previous = self.finished if build_year == self.build_year else {}
+        finished = {}
+        features = []
+        encoded = []
+        line_features = []
+        states = set()
+        locations = set()
+        sheet_ids = set()
+        for values, feature in self.rows:
+            cert_id = feature['properties']['certificateId']
+            sheet_ids.add(cert_id)
+            output = finished.get(values) or (previous.get(values) if cert_id not in changed_ids else None)
+            if output is None:
+                overlay = {cert_id: self.overlay_features[cert_id]} if cert_id in self.overlay_features else {}
+                lines = []
+                patched = patch_features([copy_feature(feature)], overlay, lines)
+                finished_feature = next(add_derived_properties(patched, build_year, states, locations))
+                output = (finished_feature, encode_feature(finished_feature, **self.output_options), lines)
+            finished[values] = output
+            add_to_index(output[0]['properties'], states, locations)
+            features.append(output[0])
+            encoded.append(output[1])
+            line_features += output[2]
+
+        # Overlay features for courses that aren't in the sheet follow, as in patch_features
+        unmatched = {cert_id: copy_feature(feature) for cert_id, feature in self.overlay_features.items()
+                     if cert_id not in sheet_ids}
+        for feature in add_derived_properties(patch_features([], unmatched, line_features), build_year, states, locations):
+            features.append(feature)
+            encoded.append(encode_feature(feature, **self.output_options))
+
+        self.finished = finished
+        self.build_year = build_year
+        return features, encoded, add_line_measurements(line_features), states, locations
+
+
+def watch(builder, output_file, line_output_file, index_output_file, last_updated_file, manifest_file,
+          derived_outputs, lint=None, full=False):
+    """
+    Build the map data with an IncrementalMapBuilder, then again each time the
+    sheet or an overlay changes, until interrupted. What the page loads is written
+    first: the GeoJSON, the course index and, with a manifest_file, a manifest of
+    their hashed copies. Then lint, if given as lint_tsv with its files filled in, runs again, only
+    checking the course lines if the sheet hasn't changed. Last, derived_outputs
+    (a function returning DerivedOutputs) are rebuilt and added to the manifest,
+    unless the inputs have changed again by then.
+    """
+    watcher = InputWatcher(builder.inputs)
+    changed = set(map(str, builder.inputs()))
+    lint_checks = None
+    while True:
+        started = time.perf_counter()
+        metrics = Metrics()
+        sheet_changed = str(builder.input_file) in changed
+        retry = set()
+        pending = set()
+        try:
+            if sheet_changed:
+                with metrics.stage('read'):
+                    builder.read_sheet(metrics)
+            changed_ids = set()
+            if changed - {str(builder.input_file)}:
+                with metrics.stage('patch'):
+                    changed_ids = builder.read_overlays(metrics)
+        except (OSError, ValueError) as e:
+            print(f"Error: {e}")
+            # Read again with the next change, once the file is fixed
+            retry = changed
+        if not retry and not builder.rows:
+            print(f"Error: No valid features found in '{builder.input_file}'.")
+        elif not retry:
+            build_time = datetime.now(timezone.utc)
+            with metrics.stage('build'):
+                features, encoded, line_features, states, locations = builder.build(build_time.year, changed_ids)
+            outputs = derived_outputs()
+
+            with metrics.stage('write'):
+                write_encoded_features(encoded, output_file, builder.output_options['compact'])
+                if builder.overlays:
+                    write_feature_collection(line_features, line_output_file, **builder.output_options)
+                write_json({'states': sorted(states), 'locations': sorted(locations)}, index_output_file)
+                write_json({'last_updated': build_time.strftime('%Y-%m-%dT%H:%M:%SZ')}, last_updated_file)
+            artifact_files = [output_file, index_output_file, outputs.columns_file, outputs.summary_file,
+                              last_updated_file]
+            if builder.overlays:
+                artifact_files.append(line_output_file)
+            # The derived outputs from the last build are listed until they're rebuilt
+            if manifest_file:
+                with metrics.stage('artifacts'):
+                    finalize_artifacts([path for path in artifact_files if Path(path).exists()], manifest_file)
+            print(f"Map data rebuilt in {(time.perf_counter() - started) * 1000:.0f} ms: {len(features)} point "
+                  f"features, {len(line_features)} LineString features, "
+                  f"{metrics.counters['rows_converted']} rows converted.")
+
+            if lint and builder.courses is not None:
+                lint_started = time.perf_counter()
+                lint_checks = lint(builder.courses, metrics=Metrics(), course_lines=line_features, full=full,
+                                   sheet_checks=None if sheet_changed else lint_checks)
+                full = False
+                print(f"QA report rebuilt in {(time.perf_counter() - lint_started) * 1000:.0f} ms.")
+
+            pending = watcher.changes()
+            if not pending:
+                for _ in outputs.collect(features, metrics):
+                    pass
+                outputs.write(build_time.year, output_file, metrics)
+                if manifest_file:
+                    manifest, rewritten, stale = finalize_artifacts(artifact_files, manifest_file)
+                    print(f"Artifact manifest written to {manifest_file}: {rewritten} of {len(manifest['files'])} "
+                          f"outputs changed, {len(stale)} old copies removed.")
+
+        if not pending:
+            print(f"Watching {len(builder.inputs())} input files for changes. Press Ctrl+C to stop.")
+            pending = watcher.wait()
+        changed = retry | pending
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Convert the calibration course sheet to GeoJSON.")
+    parser.add_argument("--full", action="store_true",
+                        help="Convert and lint every row instead of reusing results cached by the last run")
+    parser.add_argument("--readable", action="store_true",
+                        help="Write indented GeoJSON with full coordinate precision, for debugging")
+    parser.add_argument("--precision", type=int, default=7,
+                        help="Decimal places kept in coordinates of compact output (default: 7, about 1cm)")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Convert rows in this many worker processes (default: 1, no workers)")
+    parser.add_argument("--lint", action="store_true",
+                        help="Also write the QA report from the same load of the sheet, like lint_tsv.py")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep the sheet in memory and rebuild the outputs, and the QA report with --lint, "
+                             "whenever the sheet or an overlay changes")
+    parser.add_argument("--hashed-artifacts", action="store_true",
+                        help="Also write content-hashed copies of the outputs and data/manifest.json listing them, "
+                             "for hosts that can cache the copies indefinitely")
+    parser.add_argument("--profile", help="Write cProfile stats for the run to this file")
+    args = parser.parse_args()
+
     input_file = "data/calibration_courses.tsv"
     additional_data_file = "data/additional_data.geojson"
+    overlay_dir = "data/overlays"
+    overlay_cache_file = "data/.overlay_cache"
     output_file = "data/calibration_courses.geojson"
     line_output_file = "data/calibration_course_lines.geojson"
+    index_output_file = "data/course_index.json"
+    columns_output_file = "data/calibration_courses.bin"
+    clusters_output_dir = "data/clusters"
+    search_output_dir = "data/search"
+    summary_output_file = "data/summary.json"
+    nearest_index_file = "data/.nearest_index"
+    cache_file = "data/.feature_cache"
+    store_file = "data/.course_store"
+    lint_output_file = "data/calibration_qa_report.txt"
+    lint_state_file = "data/.lint_state"
+    lint_changes_file = "data/calibration_qa_changes.txt"
+    lint_changes_json_file = "data/calibration_qa_changes.json"
+    metrics_file = "data/pipeline_metrics.json"
+    manifest_file = "data/manifest.json" if args.hashed_artifacts else None
+    last_updated_file = os.path.join('data', 'last_updated.json')
 
     if not Path(input_file).exists():
         print(f"Error: Input file '{input_file}' not found.")
         return
 
-    geojson_data = tsv_to_geojson(input_file)
+    output_options = {'compact': not args.readable, 'precision': None if args.readable else args.precision}
+
+    if args.watch:
+        builder = IncrementalMapBuilder(input_file, additional_data_file, overlay_dir, overlay_cache_file,
+                                        output_options)
+        derived_outputs = partial(DerivedOutputs, columns_output_file, clusters_output_dir, search_output_dir,
+                                  summary_output_file, nearest_index_file, precision=output_options['precision'])
+        lint = None
+        if args.lint:
+            lint = partial(lint_tsv, output_file=lint_output_file, epsilon=10, state_file=lint_state_file,
+                           changes_file=lint_changes_file, changes_json_file=lint_changes_json_file)
+        try:
+            watch(builder, output_file, line_output_file, index_output_file, last_updated_file, manifest_file,
+                  derived_outputs, lint, full=args.full)
+        except KeyboardInterrupt:
+            print("Stopped watching.")
+        return
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+
+    # Expiry is relative to the build, which the page displays as the last update
+    build_time = datetime.now(timezone.utc)
+    metrics = Metrics()
+
+    # Parsed once, and saved so lint_tsv.py can map it instead of parsing again
+    with metrics.stage('load'):
+        courses = CourseStore.load(input_file, store_file)
 
-    if len(geojson_data["features"]) == 0:
+    feature_cache = {} if args.full else load_feature_cache(cache_file)
+    features = metrics.stream('read', read_features(courses, feature_cache, cache_file, metrics, args.jobs))
+    features = metrics.stream('sort', sort_features(features))
+
+    first_feature = next(features, None)
+    if first_feature is None:
         print(f"Error: No valid features found in '{input_file}'.")
         exit(1)
+    features = chain([first_feature], features)
 
     # Patch with additional data if available
-    if Path(additional_data_file).exists():
-        print(f"Patching with additional data from '{additional_data_file}'...")
-        geojson_data, line_geojson_data = patch_geojson_with_additional_data(geojson_data, additional_data_file)
+    line_features = []
+    overlays = overlay_files(additional_data_file, overlay_dir)
+    if overlays:
+        overlay_names = ", ".join(f"'{overlay}'" for overlay in overlays)
+        print(f"Patching with additional data from {overlay_names}...")
+        with metrics.stage('patch'):
+            overlay_cache = OverlayCache(overlay_cache_file)
+            additional_features_dict, conflicts = load_overlays(overlays, overlay_cache, metrics)
+            overlay_cache.save()
+        for conflict in describe_conflicts(conflicts):
+            print(f"Overlay conflict: {conflict}")
+        features = metrics.stream('patch', patch_features(features, additional_features_dict, line_features, metrics))
+    else:
+        print(f"Note: No additional data in '{additional_data_file}' or '{overlay_dir}'. Continuing without patching.")
 
-        # Write the line data to a separate file
-        with open(line_output_file, 'w', encoding='utf-8') as f:
-            json.dump(line_geojson_data, f, indent=2)
-        print(f"LineString geometries written to {line_output_file}")
-        print(f"Wrote {len(line_geojson_data['features'])} LineString features.")
+    states = set()
+    locations = set()
+    features = metrics.stream('derive', add_derived_properties(features, build_time.year, states, locations))
 
-        print(f"Patching complete.")
-    else:
-        print(f"Note: Additional data file '{additional_data_file}' not found. Continuing without patching.")
+    derived_outputs = DerivedOutputs(columns_output_file, clusters_output_dir, search_output_dir, summary_output_file,
+                                     nearest_index_file, precision=output_options['precision'])
+    features = derived_outputs.collect(features, metrics)
 
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(geojson_data, f, indent=2)
+    with metrics.stage('write'):
+        feature_count = write_feature_collection(features, output_file, **output_options)
 
     print(f"Conversion complete. Point GeoJSON written to {output_file}")
-    print(f"Converted {len(geojson_data['features'])} point features.")
+    print(f"Converted {feature_count} point features.")
 
-    # So we can display last update time on the webpage
-    timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    derived_outputs.write(build_time.year, output_file, metrics)
 
-    data = {
-        'last_updated': timestamp
-    }
+    if overlays:
+        with metrics.stage('line_measurements', items=len(line_features)):
+            line_features = add_line_measurements(line_features)
 
-    with open(os.path.join('data', 'last_updated.json'), 'w') as f:
-        json.dump(data, f, indent=2)
+        # Write the line data to a separate file
+        with metrics.stage('write'):
+            write_feature_collection(line_features, line_output_file, **output_options)
+        print(f"LineString geometries written to {line_output_file}")
+        print(f"Wrote {len(line_features)} LineString features.")
+
+        patch_counts = {counter: count for counter, count in sorted(metrics.counters.items())
+                        if counter.startswith('patch_')}
+        print("Patching complete: " + ", ".join(f"{counter[len('patch_'):]}={count}"
+                                               for counter, count in patch_counts.items()))
+
+    with metrics.stage('write'):
+        # States and locations for the page's dropdowns
+        write_json({'states': sorted(states), 'locations': sorted(locations)}, index_output_file)
+        print(f"Course index written to {index_output_file}")
+
+        # So we can display last update time on the webpage
+        timestamp = build_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        data = {
+            'last_updated': timestamp
+        }
+
+        write_json(data, last_updated_file)
+
+    # Cacheable copies of everything the page loads, found through the manifest
+    if manifest_file:
+        artifact_files = [output_file, index_output_file, columns_output_file, summary_output_file,
+                          last_updated_file]
+        if overlays:
+            artifact_files.append(line_output_file)
+        with metrics.stage('artifacts'):
+            manifest, rewritten, stale = finalize_artifacts(artifact_files, manifest_file)
+        print(f"Artifact manifest written to {manifest_file}: {rewritten} of {len(manifest['files'])} outputs "
+              f"changed, {len(stale)} old copies removed.")
+
+    if args.lint:
+        lint_metrics = Metrics()
+        lint_tsv(courses, lint_output_file, epsilon=10, metrics=lint_metrics, course_lines=line_features,
+                 state_file=lint_state_file, changes_file=lint_changes_file, changes_json_file=lint_changes_json_file,
+                 full=args.full)
+        lint_metrics.write(metrics_file, 'lint_tsv')
+
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        print(f"Profile written to {args.profile}")
+
+    metrics.write(metrics_file, 'prepare_data')
+    print(f"Pipeline metrics written to {metrics_file}")
 
 
 if __name__ == "__main__":
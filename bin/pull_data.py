@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Download the calibration course sheet export, and say whether it changed.
+
+The ETag and Last-Modified of the last download are kept in a state file and
+sent back as If-None-Match and If-Modified-Since, so an unchanged sheet costs
+a 304 and no download. A server that ignores them sends the whole sheet again,
+so the download is also compared with the current file by SHA-256. Either way,
+an unchanged sheet exits with UNCHANGED_EXIT_STATUS so later steps can skip
+their work. The year of the last build is kept too, since whether a course has
+expired depends on it: in a new year, an unchanged sheet still counts as changed.
+
+The previous sheet is backed up before it's replaced, optionally gzipped, and
+only the newest few backups are kept.
+
+Run with --check, this checks the download against a stub HTTP server on
+localhost that answers with and without a 304.
+"""
+import argparse
+import contextlib
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from course_store import file_hash
+
+SHEET_ID = "137rMUUj72qlMxZXUVvEUF_c1r6dHB6pQqDXmffcnSbc"
+SHEET_URL = f"https://docs.google.com/spreadsheets/d/{SHEET_ID}/export?format=tsv"
+
+# Exit status when the sheet hasn't changed since the last download
+UNCHANGED_EXIT_STATUS = 3
+BACKUP_COUNT = 5
+
+
+def load_state(state_file):
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state_file, state):
+    with open(state_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+
+
+def download(url, destination, etag=None, last_modified=None, timeout=60):
+    """
+    Download url to destination, sending the validators of the last download if
+    given. Returns None if the server says it's not modified, or destination's
+    path, its SHA-256 and the response headers.
+    """
+    request = urllib.request.Request(url)
+    if etag:
+        request.add_header('If-None-Match', etag)
+    if last_modified:
+        request.add_header('If-Modified-Since', last_modified)
+
+    try:
+        response = urllib.request.urlopen(request, timeout=timeout)
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None
+        raise
+
+    destination = Path(destination)
+    digest = hashlib.sha256()
+    try:
+        with response, open(destination, 'wb') as f:
+            for block in iter(lambda: response.read(1 << 20), b''):
+                digest.update(block)
+                f.write(block)
+    except BaseException:
+        # Don't leave a partial download behind
+        destination.unlink(missing_ok=True)
+        raise
+    return destination, digest.hexdigest(), response.headers
+
+
+def back_up(path, compress=False):
+    """
+    Copy path to a backup named after the current time, gzipped if compress is set.
+    """
+    timestamp = datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')
+    backup_file = Path(f"{path}.bak.{timestamp}" + (".gz" if compress else ""))
+    if compress:
+        with open(path, 'rb') as source, gzip.open(backup_file, 'wb') as destination:
+            shutil.copyfileobj(source, destination)
+    else:
+        shutil.copy2(path, backup_file)
+    return backup_file
+
+
+def rotate_backups(path, keep):
+    """
+    Delete all but the newest keep backups of path. Returns the deleted files.
+    """
+    path = Path(path)
+    # Timestamps sort in date order, compressed or not
+    backups = sorted(path.parent.glob(f"{path.name}.bak.*"), key=lambda backup: backup.name.removesuffix('.gz'))
+    stale = backups[:-keep] if keep > 0 else backups
+    for backup in stale:
+        backup.unlink()
+    return stale
+
+
+def update_sheet(url, output, state_file, backups=BACKUP_COUNT, compress=False, force=False, build_year=None):
+    """
+    Download the sheet at url to output if it has changed since the last
+    download, or if the build year has changed since then. Returns 0 if it
+    changed, UNCHANGED_EXIT_STATUS if not, or 1 if it couldn't be downloaded.
+    """
+    if build_year is None:
+        build_year = datetime.now(timezone.utc).year
+
+    state = load_state(state_file) if output.exists() and not force else {}
+    if state.get('url') != url:
+        state = {}
+    year_changed = state.get('build_year') != build_year
+
+    try:
+        result = download(url, f"{output}.tmp", state.get('etag'), state.get('last_modified'))
+    except (urllib.error.URLError, OSError) as e:
+        print(f"Error: Failed to download the Google Sheet: {e}")
+        print("Please check the Sheet ID and ensure the sheet is publicly accessible.")
+        return 1
+
+    if result is None:
+        if year_changed:
+            save_state(state_file, {**state, 'build_year': build_year})
+            print(f"Sheet not modified since the last download, but it was last built before {build_year}.")
+            return 0
+        print(f"Sheet not modified since the last download. {output} is up to date.")
+        return UNCHANGED_EXIT_STATUS
+
+    temporary_file, sha256, headers = result
+    if temporary_file.stat().st_size == 0:
+        temporary_file.unlink()
+        print("Error: The downloaded file is empty.")
+        print("Please check the Sheet ID and ensure the sheet is publicly accessible.")
+        return 1
+
+    state = {'url': url, 'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified'),
+             'sha256': sha256, 'build_year': build_year}
+
+    if not force and output.exists() and file_hash(output).hex() == sha256:
+        temporary_file.unlink()
+        save_state(state_file, state)
+        if year_changed:
+            print(f"Downloaded sheet is identical to {output}, but it was last built before {build_year}.")
+            return 0
+        print(f"Downloaded sheet is identical to {output}. Nothing to update.")
+        return UNCHANGED_EXIT_STATUS
+
+    if output.exists() and backups > 0:
+        backup_file = back_up(output, compress)
+        print(f"Creating backup of existing TSV: {backup_file}")
+        for stale_backup in rotate_backups(output, backups):
+            print(f"Removing old backup: {stale_backup}")
+
+    print(f"Updating {output} with new data...")
+    os.replace(temporary_file, output)
+    save_state(state_file, state)
+
+    with open(output, 'rb') as f:
+        row_count = sum(1 for _ in f)
+    print(f"Update complete. The new TSV contains {row_count} rows (including header).")
+    return 0
+
+
+class StubSheetHandler(BaseHTTPRequestHandler):
+    """
+    Serves the stub server's sheet with its ETag, answering a matching
+    If-None-Match with a 304 unless the server is set to ignore it.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.validators.append(self.headers.get('If-None-Match'))
+            body, etag = server.body, server.etag
+        if server.honor_validators and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def check_pull_data(work_dir):
+    """
+    Check downloads from the stub server end to end: a new sheet is written, an
+    unchanged one is skipped whether the server answers with a 304 or sends it
+    again under a new ETag, a changed one replaces the old with a backup, and a
+    new build year counts as a change. The sheet must have the mode a new file
+    gets, so it can be published. Returns a list of problems.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubSheetHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.validators = []
+    server.body, server.etag, server.honor_validators = b"CourseID\tName\n1\tFirst\n", '"1"', True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    url = f"http://127.0.0.1:{server.server_address[1]}/sheet.tsv"
+    output = Path(work_dir) / 'calibration_courses.tsv'
+    state_file = Path(work_dir) / 'fetch_state.json'
+    year = 2025
+    problems = []
+
+    def expect(description, status, build_year=year):
+        with contextlib.redirect_stdout(io.StringIO()):
+            found = update_sheet(url, output, state_file, backups=1, build_year=build_year)
+        if found != status:
+            problems.append(f"{description}: exit status {found}, expected {status}")
+
+    try:
+        expect("First download", 0)
+        if not output.exists() or output.read_bytes() != server.body:
+            problems.append("First download wasn't written to the sheet")
+        new_file = Path(work_dir) / 'new_file'
+        new_file.touch()
+        if output.exists() and output.stat().st_mode != new_file.stat().st_mode:
+            problems.append(f"Sheet has mode {output.stat().st_mode:o}, expected {new_file.stat().st_mode:o}")
+
+        expect("Unchanged sheet answered with a 304", UNCHANGED_EXIT_STATUS)
+        if server.validators[-1] != '"1"':
+            problems.append(f"Sent If-None-Match {server.validators[-1]!r}, expected the last ETag '\"1\"'")
+
+        server.etag, server.honor_validators = '"2"', False
+        expect("Unchanged sheet sent again with a new ETag", UNCHANGED_EXIT_STATUS)
+        if load_state(state_file).get('etag') != '"2"':
+            problems.append("The new ETag of an unchanged sheet wasn't saved")
+        server.honor_validators = True
+        expect("Unchanged sheet with the new ETag", UNCHANGED_EXIT_STATUS)
+
+        expect("Unchanged sheet in a new build year", 0, year + 1)
+        expect("Unchanged sheet later in the new build year", UNCHANGED_EXIT_STATUS, year + 1)
+
+        old_body = server.body
+        server.body, server.etag = server.body + b"2\tSecond\n", '"3"'
+        expect("Changed sheet", 0, year + 1)
+        backups = list(Path(work_dir).glob(f"{output.name}.bak.*"))
+        if output.read_bytes() != server.body:
+            problems.append("Changed sheet wasn't written")
+        if len(backups) != 1 or backups[0].read_bytes() != old_body:
+            problems.append(f"Expected one backup of the old sheet, found {len(backups)}")
+    finally:
+        server.shutdown()
+        server.server_close()
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download the calibration course sheet if it has changed.")
+    parser.add_argument("--url", default=SHEET_URL, help="Where to download the sheet from")
+    parser.add_argument("--output", type=Path, default=Path("data/calibration_courses.tsv"))
+    parser.add_argument("--state", type=Path, default=Path("data/.fetch_state.json"),
+                        help="Where the validators and hash of the last download, and the build year, are kept")
+    parser.add_argument("--backups", type=int, default=BACKUP_COUNT,
+                        help=f"Number of backups of old sheets to keep (default: {BACKUP_COUNT})")
+    parser.add_argument("--compress", action="store_true", help="Gzip backups")
+    parser.add_argument("--force", action="store_true",
+                        help="Download and replace the sheet even if it hasn't changed")
+    parser.add_argument("--check", action="store_true",
+                        help="Check the download against a stub HTTP server instead of downloading the sheet")
+    args = parser.parse_args()
+
+    if args.check:
+        with tempfile.TemporaryDirectory() as work_dir:
+            problems = check_pull_data(work_dir)
+        for problem in problems:
+            print(problem)
+        if problems:
+            exit(1)
+        print("Sheet downloads are written, skipped and backed up as expected.")
+        return
+
+    print("Starting update of calibration courses TSV from Google Sheet...")
+    print(f"Downloading {args.url}")
+    status = update_sheet(args.url, args.output, args.state, args.backups, args.compress, args.force)
+    if status:
+        exit(status)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Static search index over the course names, cities, states and measurers.
+
+Each field's text is lowercased and split into words of letters and digits.
+The index maps every distinct word of each field to a posting list of the
+indices of the features (in calibration_courses.geojson order) that contain
+it. A query matches the features where every query word is found inside
+some word of the searched fields, the same as the table's substring filters
+apart from matching across word boundaries.
+
+The index is written to a directory as:
+
+    terms.json      version, feature count, shard prefix length, and for each
+                    field its words in sorted order
+    <prefix>.json   for each field, the posting lists of the words starting with
+                    prefix, each a sorted list of feature indices stored as the
+                    differences between consecutive indices
+
+A client searches the small word lists first, then loads only the shards of the
+words that matched.
+"""
+import argparse
+import json
+import random
+import re
+import string
+from array import array
+from pathlib import Path
+
+VERSION = 1
+SEARCH_FIELDS = ('nameAbbreviated', 'city', 'state', 'measurer')
+SHARD_PREFIX_LENGTH = 2
+TERMS_FILE = 'terms.json'
+
+WORD_PATTERN = re.compile(r'[^\W_]+')
+SAFE_SHARD_CHARACTERS = set(string.ascii_lowercase + string.digits)
+
+
+def tokenize(text):
+    return WORD_PATTERN.findall(text.lower()) if text else []
+
+
+def shard_prefix(term):
+    return term[:SHARD_PREFIX_LENGTH]
+
+
+def shard_file_name(prefix):
+    """
+    The file a shard is written to, with any character that isn't a plain letter
+    or digit spelled out as _ and its hex code point, so names are safe in URLs.
+    """
+    return ''.join(c if c in SAFE_SHARD_CHARACTERS else f"_{ord(c):x}" for c in prefix) + '.json'
+
+
+def delta_encode(indices):
+    return [index - previous for previous, index in zip([0] + list(indices[:-1]), indices)]
+
+
+def delta_decode(deltas):
+    indices = []
+    index = 0
+    for delta in deltas:
+        index += delta
+        indices.append(index)
+    return indices
+
+
+class SearchIndexBuilder:
+    """
+    Collects the words of each feature's searchable fields, then writes the index.
+    """
+
+    def __init__(self, fields=SEARCH_FIELDS):
+        self.fields = fields
+        self.count = 0
+        # Field to word to the indices of the features containing it
+        self.postings = {field: {} for field in fields}
+
+    def add(self, feature):
+        properties = feature.get('properties', {})
+        for field in self.fields:
+            value = properties.get(field)
+            postings = self.postings[field]
+            for term in tokenize(value if isinstance(value, str) else None):
+                indices = postings.get(term)
+                if indices is None:
+                    postings[term] = array('I', [self.count])
+                elif indices[-1] != self.count:
+                    indices.append(self.count)
+        self.count += 1
+
+    def collect(self, features):
+        """
+        Add each feature of a stream as it passes through.
+        """
+        for feature in features:
+            self.add(feature)
+            yield feature
+
+    def write(self, output_dir):
+        output_dir = Path(output_dir)
+        output_dir.mkdir(exist_ok=True)
+
+        shards = {}
+        for field, postings in self.postings.items():
+            for term, indices in postings.items():
+                shards.setdefault(shard_prefix(term), {}).setdefault(field, {})[term] = delta_encode(indices)
+
+        written = {TERMS_FILE}
+        for prefix, shard in shards.items():
+            file_name = shard_file_name(prefix)
+            with open(output_dir / f"{file_name}.tmp", 'w', encoding='utf-8') as f:
+                json.dump(shard, f, separators=(',', ':'), sort_keys=True)
+            (output_dir / f"{file_name}.tmp").replace(output_dir / file_name)
+            written.add(file_name)
+
+        with open(output_dir / f"{TERMS_FILE}.tmp", 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': VERSION,
+                'featureCount': self.count,
+                'shardPrefixLength': SHARD_PREFIX_LENGTH,
+                'fields': {field: sorted(postings) for field, postings in self.postings.items()}
+            }, f, separators=(',', ':'))
+        (output_dir / f"{TERMS_FILE}.tmp").replace(output_dir / TERMS_FILE)
+
+        # Shards of words that have since disappeared from the sheet
+        for stale_file in output_dir.glob('*.json'):
+            if stale_file.name not in written:
+                stale_file.unlink()
+        return len(shards)
+
+
+class SearchIndex:
+    """
+    Queries a written index, loading shards only as their words are needed.
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = Path(index_dir)
+        with open(self.index_dir / TERMS_FILE, 'r', encoding='utf-8') as f:
+            terms = json.load(f)
+        if terms.get('version') != VERSION:
+            raise ValueError(f"'{index_dir}' is not a version {VERSION} search index")
+        self.count = terms['featureCount']
+        self.terms = terms['fields']
+        self.shards = {}
+
+    def shard(self, prefix):
+        if prefix not in self.shards:
+            with open(self.index_dir / shard_file_name(prefix), 'r', encoding='utf-8') as f:
+                self.shards[prefix] = json.load(f)
+        return self.shards[prefix]
+
+    def postings(self, field, term):
+        return delta_decode(self.shard(shard_prefix(term))[field][term])
+
+    def search(self, query, fields=SEARCH_FIELDS):
+        """
+        Return the sorted indices of the features where each word of the query is
+        part of a word in one of the fields. An empty query matches every feature.
+        """
+        matches = None
+        for query_term in set(tokenize(query)):
+            term_matches = set()
+            for field in fields:
+                for term in self.terms.get(field, ()):
+                    if query_term in term:
+                        term_matches.update(self.postings(field, term))
+            matches = term_matches if matches is None else matches & term_matches
+            if not matches:
+                return []
+        return list(range(self.count)) if matches is None else sorted(matches)
+
+
+def feature_fields(features, fields=SEARCH_FIELDS):
+    """
+    The lowercased text of each feature's fields, as a list per feature.
+    """
+    texts = []
+    for feature in features:
+        properties = feature.get('properties', {})
+        texts.append([properties[field].lower() for field in fields if isinstance(properties.get(field), str)])
+    return texts
+
+
+def scan(texts_by_feature, query):
+    """
+    Find the features matching a query the way the table's substring filters do,
+    by looking for the whole query in the text of each of their fields (from
+    feature_fields), for comparison with SearchIndex.search.
+    """
+    query = query.lower()
+    if not query.strip():
+        return list(range(len(texts_by_feature)))
+    return [index for index, texts in enumerate(texts_by_feature) if any(query in text for text in texts)]
+
+
+def crosses_word_boundary(query):
+    """
+    Whether a query is more than a single word, so the index can match it by
+    words found apart where the table's filters look for it as it's written.
+    """
+    return tokenize(query) != [query.lower()]
+
+
+def sample_queries(texts_by_feature, count, seed=0):
+    """
+    Queries made of whole words, pieces of words and pieces of the text running
+    across words from the features, with some combining two fields and some
+    that match nothing.
+    """
+    rng = random.Random(seed)
+    queries = ['', 'zzqxj']
+    while len(queries) < count and texts_by_feature:
+        texts = rng.choice(texts_by_feature)
+        words = [word for text in texts for word in tokenize(text)]
+        if not words:
+            continue
+        word = rng.choice(words)
+        start = rng.randrange(len(word))
+        piece = word[start:start + rng.randint(1, 4)]
+        text = rng.choice([text for text in texts if text])
+        start = rng.randrange(len(text))
+        span = text[start:start + rng.randint(2, 8)]
+        queries.append(rng.choice([word, piece, f"{piece} {rng.choice(words)}", piece.upper(), span]))
+    return queries
+
+
+def check_search_index(index_dir, geojson_file, query_count=200):
+    """
+    Check that the index answers sample queries the same as a scan of the GeoJSON.
+    Returns a list of mismatch descriptions.
+    """
+    with open(geojson_file, 'r', encoding='utf-8') as f:
+        features = json.load(f)['features']
+
+    index = SearchIndex(index_dir)
+    if index.count != len(features):
+        return [f"Feature count differs: {index.count} in '{index_dir}', {len(features)} in '{geojson_file}'"]
+
+    # Every field, and the name alone
+    field_sets = {fields: feature_fields(features, fields) for fields in (SEARCH_FIELDS, SEARCH_FIELDS[:1])}
+    mismatches = []
+    for query in sample_queries(field_sets[SEARCH_FIELDS], query_count):
+        for fields, texts_by_feature in field_sets.items():
+            found = index.search(query, fields)
+            expected = scan(texts_by_feature, query)
+            # Every course the filters match has each of the query's words inside one of its
+            # words, and only a query across word boundaries can match more in the index
+            missing = set(expected).difference(found)
+            if missing or (found != expected and not crosses_word_boundary(query)):
+                mismatches.append(f"Query {query!r} in {', '.join(fields)}: index found {len(found)} courses, "
+                                  f"scan found {len(expected)}, {len(missing)} of them missed by the index")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the search index against a scan of the course GeoJSON.")
+    parser.add_argument("index_dir", nargs="?", default="data/search")
+    parser.add_argument("geojson_file", nargs="?", default="data/calibration_courses.geojson")
+    parser.add_argument("--queries", type=int, default=200, help="Number of sample queries to check")
+    args = parser.parse_args()
+
+    mismatches = check_search_index(args.index_dir, args.geojson_file, args.queries)
+    for mismatch in mismatches:
+        print(mismatch)
+    if mismatches:
+        exit(1)
+    print(f"Search index in '{args.index_dir}' matches a scan of '{args.geojson_file}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Aggregate course counts for the page's stats widgets, computed while the
+features are written instead of in the browser.
+
+The summary holds the course, expired and approximate location counts, the
+number of courses per state, year and unit, the measurers ranked the way
+MeasurerStats ranks them, and the course age counts StackedBarChart plots for
+each year.
+"""
+import argparse
+import json
+import os
+import unicodedata
+from collections import Counter
+
+# First year StackedBarChart plots, and the oldest age it stacks
+FIRST_CHART_YEAR = 2013
+MAX_CHART_AGE = 10
+
+
+def collation_key(name):
+    """
+    Approximates String.localeCompare, which MeasurerStats sorts tied names
+    with: accents and case only break ties, and lowercase comes first.
+    """
+    base = ''.join(c for c in unicodedata.normalize('NFKD', name) if not unicodedata.combining(c))
+    return base.casefold(), name.swapcase()
+
+
+def rank_measurers(counts):
+    """
+    Order measurers by course count, most first, then by name, and give tied
+    measurers the rank of the first of them, like 1, 2, 2, 4.
+    """
+    ranking = []
+    rank = 0
+    previous_count = None
+    for position, (name, count) in enumerate(sorted(counts.items(),
+                                                    key=lambda item: (-item[1], collation_key(item[0]))), 1):
+        if count != previous_count:
+            rank = position
+        ranking.append({'name': name, 'count': count, 'rank': rank})
+        previous_count = count
+    return ranking
+
+
+def year_ages(year_counts, last_year):
+    """
+    For each year from FIRST_CHART_YEAR to last_year, how many courses were each
+    age from 0 to MAX_CHART_AGE years old that year, as StackedBarChart stacks them.
+    """
+    return [{'year': year, **{f"age{age}": year_counts.get(year - age, 0) for age in range(MAX_CHART_AGE + 1)}}
+            for year in range(FIRST_CHART_YEAR, last_year + 1)]
+
+
+class SummaryBuilder:
+    """
+    Tallies features as they stream past, then builds the summary.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.expired = 0
+        self.approximate = 0
+        self.states = Counter()
+        self.years = Counter()
+        self.units = Counter()
+        self.measurers = Counter()
+
+    def add(self, feature):
+        properties = feature.get('properties', {})
+        self.count += 1
+        self.expired += bool(properties.get('expired'))
+        self.approximate += bool(properties.get('approximate'))
+        if properties.get('state'):
+            self.states[properties['state']] += 1
+        if properties.get('year'):
+            self.years[properties['year']] += 1
+        if properties.get('units'):
+            self.units[properties['units']] += 1
+        if properties.get('measurer'):
+            self.measurers[properties['measurer']] += 1
+
+    def collect(self, features):
+        """
+        Add each feature of a stream as it passes through.
+        """
+        for feature in features:
+            self.add(feature)
+            yield feature
+
+    def build(self, build_year):
+        return {
+            'courses': self.count,
+            'expired': self.expired,
+            'active': self.count - self.expired,
+            'approximate': self.approximate,
+            'states': dict(sorted(self.states.items())),
+            'years': {str(year): count for year, count in sorted(self.years.items())},
+            'units': dict(sorted(self.units.items())),
+            'measurers': rank_measurers(self.measurers),
+            'yearAges': year_ages(self.years, build_year)
+        }
+
+    def write(self, output_file, build_year):
+        with open(f"{output_file}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.build(build_year), f, indent=2)
+        os.replace(f"{output_file}.tmp", output_file)
+
+
+def check_summary(summary_file, geojson_file):
+    """
+    Compare a summary with counts made the way the widgets make them, straight
+    from the GeoJSON. Returns a list of mismatch descriptions.
+    """
+    with open(summary_file, 'r', encoding='utf-8') as f:
+        summary = json.load(f)
+    with open(geojson_file, 'r', encoding='utf-8') as f:
+        features = json.load(f)['features']
+
+    properties = [feature.get('properties', {}) for feature in features]
+    measurer_counts = Counter(p['measurer'] for p in properties if p.get('measurer'))
+    expected = {
+        'courses': len(properties),
+        'expired': sum(1 for p in properties if p.get('expired')),
+        'active': sum(1 for p in properties if not p.get('expired')),
+        'approximate': sum(1 for p in properties if p.get('approximate')),
+        'states': dict(sorted(Counter(p['state'] for p in properties if p.get('state')).items())),
+        'years': {str(year): count for year, count in
+                  sorted(Counter(p['year'] for p in properties if p.get('year')).items())},
+        'units': dict(sorted(Counter(p['units'] for p in properties if p.get('units')).items())),
+    }
+
+    mismatches = [f"{key} is {summary.get(key)!r}, expected {value!r}"
+                  for key, value in expected.items() if summary.get(key) != value]
+
+    # Ranks depend only on the counts, so they're checked whatever order tied names are in
+    ranking = summary.get('measurers', [])
+    if sorted((m['name'], m['count']) for m in ranking) != sorted(measurer_counts.items()):
+        mismatches.append("measurers don't match the course counts")
+    for position, measurer in enumerate(ranking, 1):
+        expected_rank = 1 + sum(1 for count in measurer_counts.values() if count > measurer['count'])
+        if measurer['rank'] != expected_rank:
+            mismatches.append(f"{measurer['name']} is ranked {measurer['rank']} at position {position}, "
+                              f"expected {expected_rank}")
+
+    if summary.get('yearAges'):
+        last_year = summary['yearAges'][-1]['year']
+        for row in summary['yearAges']:
+            for age in range(MAX_CHART_AGE + 1):
+                count = int(expected['years'].get(str(row['year'] - age), 0))
+                if row[f"age{age}"] != count:
+                    mismatches.append(f"{count} courses were {age} years old in {row['year']}, "
+                                      f"summary has {row[f'age{age}']}")
+        if [row['year'] for row in summary['yearAges']] != list(range(FIRST_CHART_YEAR, last_year + 1)):
+            mismatches.append("yearAges doesn't cover every year")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the stats summary against the course GeoJSON.")
+    parser.add_argument("summary_file", nargs="?", default="data/summary.json")
+    parser.add_argument("geojson_file", nargs="?", default="data/calibration_courses.geojson")
+    args = parser.parse_args()
+
+    mismatches = check_summary(args.summary_file, args.geojson_file)
+    for mismatch in mismatches:
+        print(mismatch)
+    if mismatches:
+        exit(1)
+    print(f"'{args.summary_file}' matches '{args.geojson_file}'.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Generate realistic synthetic calibration course sheets for benchmarking.
+
+Rows have the same columns as the USATF sheet export. Names are drawn from the
+variants the normalization rules exist for, coordinates cluster around metro
+areas with the odd exact duplicate, and a few rows have the problems the linter
+looks for: missing links, shared links, misspellings and typoed measurements.
+"""
+import argparse
+import csv
+import json
+import random
+
+COLUMNS = ['CourseID', 'Name', 'Dist', 'Units', 'Latitude', 'Longitude', 'Certificate URL', 'Color',
+           'City', 'State', 'Measurer']
+
+STATES = ['AK', 'AZ', 'CA', 'CO', 'FL', 'GA', 'IL', 'MA', 'MI', 'MN', 'NC', 'NY', 'OH', 'OR', 'PA', 'TX', 'VA', 'WA']
+COLORS = ['GREEN'] * 8 + ['BLUE', 'PURPLE']
+
+NAME_TEMPLATES = [
+    "{street} {road} Calibration Course",
+    "{street} {road} Cal Course {length}",
+    "{street} {road} - {length} calibration",
+    "{direction}. {street} {road}. Cal. Course ({length})",
+    "{street} Park {length} Calibration Courses",
+    "A Quarter Mile {street} {road} cal crse",
+    "Half Moon Bay {road} {length}",
+    "{street} {road} {length} yards calibration ()",
+    "{street} {road} {length} {misspelling}",
+]
+STREETS = ["Lake Merritt", "Main", "Oak", "Riverside", "Sunset", "Elm", "5th", "Broadway", "Ocean", "Park"]
+ROADS = ["Avenue", "Street", "St.", "Boulevard", "Blvd.", "Drive", "Road", "Way", "Parkway", "Trail", "Lane"]
+LENGTHS = ["1000ft", "1,000 ft.", "1000 feet", "300 m", "300 meters", "1/2 Mile", "0.25 mi", "1000'", "1 km",
+           "1- 000ft"]
+MISSPELLINGS = ["Calibration", "Calibraton", "Cakibration", "Celebration", "Calbration"]
+DISTANCES = [('1,000', 'ft'), ('1000', 'Ft'), ('300', 'M'), ('0.25', 'Mi'), ('1', 'Km'), ('500', 'm')]
+
+
+def synthetic_names(count, seed=0):
+    rng = random.Random(seed)
+    return [rng.choice(NAME_TEMPLATES).format(street=rng.choice(STREETS), road=rng.choice(ROADS),
+                                              length=rng.choice(LENGTHS), direction=rng.choice("NSEW"),
+                                              misspelling=rng.choice(MISSPELLINGS))
+            for _ in range(count)]
+
+
+def synthetic_courses(count, seed=0):
+    """
+    Generate courses scattered around a few hundred metro areas, with the odd
+    exact duplicate, roughly like the real sheet.
+    """
+    rng = random.Random(seed)
+    metros = [(rng.uniform(25, 49), rng.uniform(-124, -67)) for _ in range(300)]
+
+    courses = []
+    for i in range(count):
+        if courses and rng.random() < 0.02:
+            lat, lon = courses[-1]['lat'], courses[-1]['lon']
+        else:
+            metro_lat, metro_lon = rng.choice(metros)
+            lat = metro_lat + rng.gauss(0, 0.3)
+            lon = metro_lon + rng.gauss(0, 0.3)
+        courses.append({'id': str(i), 'lat': lat, 'lon': lon})
+    return courses
+
+
+def synthetic_rows(count, seed=0):
+    """
+    Generate sheet rows as dictionaries keyed by column name.
+    """
+    rng = random.Random(seed)
+    names = synthetic_names(count, seed)
+    for index, course in enumerate(synthetic_courses(count, seed)):
+        state = rng.choice(STATES)
+        dist, units = rng.choice(DISTANCES)
+        link_id = rng.randrange(count) if rng.random() < 0.01 else index
+        link = f"<a href='https://certifiedroadraces.com/certificate/?type=c&id={link_id}'>View</a>"
+        yield {
+            'CourseID': f"{state}{rng.randint(10, 25):02d}{index % 1000:03d}{rng.choice(['JG', 'MW', 'RMB', 'FW'])}",
+            'Name': names[index] + (" (EXPIRED)" if rng.random() < 0.1 else ""),
+            'Dist': dist,
+            'Units': units,
+            'Latitude': f"{course['lat']:.6f}" if rng.random() > 0.005 else "",
+            'Longitude': f"{course['lon']:.6f}",
+            'Certificate URL': link if rng.random() > 0.01 else "",
+            'Color': rng.choice(COLORS),
+            'City': f"City {rng.randrange(2000)}",
+            'State': state,
+            'Measurer': f"Measurer {rng.randrange(max(count // 20, 1))}",
+        }
+
+
+def write_synthetic_tsv(output_file, count, seed=0):
+    """
+    Write a synthetic sheet and return its course ids.
+    """
+    course_ids = []
+    with open(output_file, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS, delimiter='\t', lineterminator='\r\n')
+        writer.writeheader()
+        for row in synthetic_rows(count, seed):
+            writer.writerow(row)
+            course_ids.append(row['CourseID'])
+    return course_ids
+
+
+def write_synthetic_additional_data(output_file, course_ids, fraction=0.01, seed=0):
+    """
+    Write an additional data file patching a fraction of the courses, mostly with
+    course endpoints, plus a few courses missing from the sheet.
+    """
+    rng = random.Random(seed)
+    features = []
+    for cert_id in rng.sample(course_ids, int(len(course_ids) * fraction)):
+        lon, lat = rng.uniform(-124, -67), rng.uniform(25, 49)
+        if rng.random() < 0.7:
+            geometry = {"type": "LineString", "coordinates": [[lon, lat], [lon + 0.002, lat + 0.002]]}
+        else:
+            geometry = {"type": "Point", "coordinates": [lon, lat]}
+        features.append({"type": "Feature", "geometry": geometry,
+                         "properties": {"certificateId": cert_id, "approximate": rng.random() < 0.2}})
+    for index in range(max(len(features) // 10, 1)):
+        features.append({"type": "Feature", "geometry": {"type": "Point", "coordinates": [0, 0]},
+                         "properties": {"certificateId": f"ZZ99{index:03d}XX"}})
+
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump({"type": "FeatureCollection", "features": features}, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic calibration course sheet.")
+    parser.add_argument("output_file")
+    parser.add_argument("rows", type=int)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--additional-data", help="Also write an additional data file patching some of the courses")
+    args = parser.parse_args()
+
+    course_ids = write_synthetic_tsv(args.output_file, args.rows, args.seed)
+    if args.additional_data:
+        write_synthetic_additional_data(args.additional_data, course_ids, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
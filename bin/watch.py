@@ -0,0 +1,60 @@
+"""
+Polling for changes to the build's inputs, for prepare_data.py --watch.
+
+The standard library has no way to be told a file changed, so each input's
+modification time and size are checked every WATCH_INTERVAL_SECONDS instead,
+which costs a few stat calls. The inputs are listed again on every poll, so an
+overlay added to or removed from the overlays directory counts as a change too.
+A file that's still being written when it's read changes again, and is picked
+up by the next poll.
+"""
+import os
+import time
+
+WATCH_INTERVAL_SECONDS = 0.05
+
+
+def input_signatures(paths):
+    """
+    The modification time and size of each path that exists, by path.
+    """
+    signatures = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        signatures[str(path)] = (stat.st_mtime_ns, stat.st_size)
+    return signatures
+
+
+class InputWatcher:
+    """
+    Waits for the files listed by list_inputs, a function returning the paths
+    to watch, to change.
+    """
+
+    def __init__(self, list_inputs, interval=WATCH_INTERVAL_SECONDS):
+        self.list_inputs = list_inputs
+        self.interval = interval
+        self.signatures = input_signatures(list_inputs())
+
+    def changes(self):
+        """
+        The paths added, removed or modified since the last call, without waiting.
+        """
+        signatures = input_signatures(self.list_inputs())
+        changed = {path for path in signatures.keys() | self.signatures.keys()
+                   if signatures.get(path) != self.signatures.get(path)}
+        self.signatures = signatures
+        return changed
+
+    def wait(self):
+        """
+        Block until at least one input changes, returning the changed paths.
+        """
+        while True:
+            changed = self.changes()
+            if changed:
+                return changed
+            time.sleep(self.interval)
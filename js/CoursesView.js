@@ -115,6 +115,8 @@ export class CoursesView extends LitElement {
     static properties = {
         coursesUrl: {type: String},
         courseLinesUrl: {type: String},
+        courseIndexUrl: {type: String},
+        manifestUrl: {type: String},
         styleUrl: {type: String},
         initialCenter: {type: Array},
         calibrationCourses: {type: Array, state: true},
@@ -225,12 +227,47 @@ export class CoursesView extends LitElement {
 
     }
 
+    // Swap each data URL for the content-hashed copy bin/prepare_data.py --hashed-artifacts lists in
+    // the manifest, which never changes and so can be cached indefinitely by hosts that allow it.
+    // Falls back to the plain URLs without a manifestUrl or if the manifest can't be loaded.
+    async resolveDataUrls(urls) {
+        if (!this.manifestUrl) return urls;
+        try {
+            const manifestResponse = await fetch(this.manifestUrl, {cache: 'no-cache'});
+            if (!manifestResponse.ok) return urls;
+            const manifest = await manifestResponse.json();
+            const manifestBase = new URL(this.manifestUrl, document.baseURI);
+            return urls.map(url => {
+                const entry = manifest.files[url.split('/').pop()];
+                return entry ? new URL(entry.path, manifestBase).href : url;
+            });
+        } catch (error) {
+            console.warn('Error loading data manifest, using unhashed data files:', error);
+            return urls;
+        }
+    }
+
+    // Fetch a hashed copy, falling back to the plain URL if it fails. Each GitHub Pages deploy replaces
+    // the whole site, so the copies listed by a manifest loaded before a deploy may be gone.
+    async fetchData(url, plainUrl) {
+        if (url !== plainUrl) {
+            try {
+                const response = await fetch(url);
+                if (response.ok) return response;
+                console.warn(`Failed to fetch ${url}: ${response.status} ${response.statusText}, using ${plainUrl}`);
+            } catch (error) {
+                console.warn(`Error fetching ${url}, using ${plainUrl}:`, error);
+            }
+        }
+        return fetch(plainUrl);
+    }
+
     async loadData() {
         try {
-            const [coursesResponse, courseLinesResponse] = await Promise.all([
-                fetch(this.coursesUrl),
-                fetch(this.courseLinesUrl)
-            ]);
+            const plainUrls = [this.coursesUrl, this.courseLinesUrl, this.courseIndexUrl];
+            const urls = await this.resolveDataUrls(plainUrls);
+            const [coursesResponse, courseLinesResponse, courseIndexResponse] = await Promise.all(
+                urls.map((url, i) => this.fetchData(url, plainUrls[i])));
 
             if (!coursesResponse.ok) {
                 throw new Error(`Failed to fetch course data: ${coursesResponse.status} ${coursesResponse.statusText}`);
@@ -240,15 +277,22 @@ export class CoursesView extends LitElement {
                 throw new Error(`Failed to fetch course lines data: ${courseLinesResponse.status} ${courseLinesResponse.statusText}`);
             }
 
-            const [coursesData, courseLinesData] = await Promise.all([
+            if (!courseIndexResponse.ok) {
+                throw new Error(`Failed to fetch course index: ${courseIndexResponse.status} ${courseIndexResponse.statusText}`);
+            }
+
+            const [coursesData, courseLinesData, courseIndex] = await Promise.all([
                 coursesResponse.json(),
-                courseLinesResponse.json()
+                courseLinesResponse.json(),
+                courseIndexResponse.json()
             ]);
 
             this.calibrationCourses = coursesData.features;
             this.calibrationCourseLines = courseLinesData.features;
 
-            this.processData();
+            // Year, expiry, metric length and the dropdown options are all computed by bin/prepare_data.py
+            this.states = courseIndex.states;
+            this.locations = courseIndex.locations;
         } catch (error) {
             console.error('Error loading calibration courses data:', error);
             this.renderError(error);
@@ -258,42 +302,6 @@ export class CoursesView extends LitElement {
         }
     }
 
-    processData() {
-        const statesSet = new Set();
-        const locationsSet = new Set();
-        const currentYear = new Date().getFullYear();
-
-        for (const [id, course] of Object.entries(this.calibrationCourses)) {
-            // Extract state and location information for dropdowns
-            const properties = course.properties;
-            if (properties.state) {
-                statesSet.add(properties.state);
-            }
-
-            if (properties.city && properties.state) {
-                locationsSet.add(properties.city + ', ' + properties.state);
-            }
-
-            // Extract the first two digits after any letters at the beginning
-            const yearMatch = properties.certificateId.match(/^[A-Za-z]+(\d{2})/);
-            if (yearMatch && yearMatch[1]) {
-                const courseYear = parseInt("20" + yearMatch[1]);
-                course.properties.year = courseYear;
-                course.properties.expired = currentYear > (courseYear + 10)
-            } else {
-                // Handle the case where no matching pattern is found
-                console.warn("Could not extract year from certificateId:", properties.certificateId);
-            }
-            course.properties.courseLengthMeters = course.properties.courseLength
-            if (course.properties.units === "ft") {
-                course.properties.courseLengthMeters = course.properties.courseLength * .3048
-            }
-        }
-
-        this.states = [...statesSet].sort();
-        this.locations = [...locationsSet].sort();
-    }
-
     initializeMap() {
         // Get saved map state or use defaults
         const center = sessionStorage.getItem('mapCenter')